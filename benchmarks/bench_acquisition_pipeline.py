@@ -0,0 +1,66 @@
+"""
+collect_emc_time_series 串行/流水线、PACED/BACK_TO_BACK 调度的 sweeps/s 对比。
+
+使用 fieldfox_simulator.FieldFoxSimulator：*OPC? 阻塞一个 sweep time，
+响应按链路速率阻塞，ASCII/REAL32 数据与真实 FieldFox 格式一致。
+用法: python benchmarks/bench_acquisition_pipeline.py [--duration 4] [--points 10001] [--sweep-time 0.3]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fieldfox_simulator import FieldFoxSimulator, SimulatedVisaResource  # noqa: E402
+from n9918a_backend import EMCDetectorAccumulator, N9918AController  # noqa: E402
+
+
+def run(pipelined, trace_format, args, schedule="PACED"):
+    controller = N9918AController(ip_address="simulated", trace_format=trace_format)
+    simulator = FieldFoxSimulator(
+        latency_s=args.latency_ms / 1000.0,
+        link_bytes_per_second=args.link_mbps * 1e6 / 8,
+        sweep_time=args.sweep_time,
+    )
+    controller.device = SimulatedVisaResource(simulator)
+    controller.connected = True
+    with contextlib.redirect_stdout(io.StringIO()):
+        controller._select_trace_format()
+        controller._write_batch([":SENS:FREQ:STAR 30000000", ":SENS:FREQ:STOP 1000000000", f":SENS:SWE:POIN {args.points}"])
+    controller.start_freq, controller.stop_freq, controller.n_points = 30e6, 1e9, args.points
+    accumulator = EMCDetectorAccumulator()
+    with contextlib.redirect_stdout(io.StringIO()):
+        controller.collect_emc_time_series(
+            args.duration, accumulator=accumulator, keep_samples=False, pipelined=pipelined, schedule=schedule
+        )
+    stats = controller.last_collection_stats
+    return stats["sweeps_per_second"], accumulator.sample_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--duration", type=float, default=4.0)
+    parser.add_argument("--points", type=int, default=10001)
+    parser.add_argument("--sweep-time", type=float, default=0.3)
+    parser.add_argument("--link-mbps", type=float, default=20.0)
+    parser.add_argument("--latency-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(f"{args.points} 点, sweep {args.sweep_time * 1000:.0f} ms, 链路 {args.link_mbps:.0f} Mbit/s, 采集 {args.duration:.1f} s")
+    print(f"{'format':>8} {'paced serial':>13} {'paced pipelined':>16} {'back-to-back':>13} {'gain':>7}")
+    for trace_format in ("ASCII", "REAL32"):
+        serial, _ = run(False, trace_format, args)
+        pipelined, _ = run(True, trace_format, args)
+        back_to_back, _ = run(True, trace_format, args, schedule="BACK_TO_BACK")
+        print(
+            f"{trace_format:>8} {serial:>13.2f} {pipelined:>16.2f} {back_to_back:>13.2f} "
+            f"{back_to_back / serial - 1:>6.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
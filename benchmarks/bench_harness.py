@@ -0,0 +1,197 @@
+"""
+基准套件共用工具：计时、峰值内存、JSON 结果输出与基线对比。
+
+每个用例记录 best/median 墙钟时间、tracemalloc 峰值内存（单独再跑一次，
+不影响计时）和吞吐量；与基线 JSON 按 (name, points, samples) 匹配，
+时间或内存超过阈值倍数即视为回归，脚本以退出码 1 结束。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+MIN_REGRESSION_DELTA_S = 1e-3
+
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+class BenchmarkCase:
+    """一个基准用例：setup() 准备输入（不计时），run(inputs) 为被测调用。"""
+
+    def __init__(self, name, run, setup=None, points=None, samples=None, work_items=1, unit="calls", repeat=None, stages=None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.points = points
+        self.samples = samples
+        self.work_items = work_items
+        self.unit = unit
+        self.repeat = repeat
+        self.stages = stages
+
+
+def case_key(name, points, samples):
+    return f"{name}|points={points}|samples={samples}"
+
+
+def _call_quietly(func, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+
+def measure_case(case, repeat):
+    inputs = _call_quietly(case.setup) if case.setup else None
+    repeat = case.repeat or repeat
+    times = []
+    stage_runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = _call_quietly(case.run, inputs)
+        times.append(time.perf_counter() - start)
+        if case.stages is not None:
+            stage_runs.append(case.stages(output))
+
+    tracemalloc.start()
+    try:
+        _call_quietly(case.run, inputs)
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    best = min(times)
+    result = {
+        "name": case.name,
+        "points": case.points,
+        "samples": case.samples,
+        "repeat": repeat,
+        "wall_time_s": best,
+        "median_time_s": statistics.median(times),
+        "peak_memory_mb": peak / 1e6,
+        "throughput": case.work_items / best if best > 0 else None,
+        "throughput_unit": f"{case.unit}/s",
+    }
+    if stage_runs:
+        result["stages_s"] = {
+            stage: min(run.get(stage, float("inf")) for run in stage_runs)
+            for stage in stage_runs[0]
+        }
+    return result
+
+
+def compare_with_baseline(results, baseline, time_threshold, memory_threshold):
+    """返回回归列表；基线中没有的用例跳过。"""
+    reference = {case_key(item["name"], item["points"], item["samples"]): item for item in baseline.get("results", [])}
+    regressions = []
+    for item in results:
+        base = reference.get(case_key(item["name"], item["points"], item["samples"]))
+        if not base:
+            item["baseline_ratio"] = None
+            continue
+        time_ratio = item["wall_time_s"] / base["wall_time_s"] if base["wall_time_s"] > 0 else 1.0
+        memory_ratio = (
+            item["peak_memory_mb"] / base["peak_memory_mb"] if base["peak_memory_mb"] > 0.5 else 1.0
+        )
+        item["baseline_ratio"] = {"time": time_ratio, "memory": memory_ratio}
+        # 亚毫秒级用例的抖动不计为回归
+        if time_ratio > time_threshold and item["wall_time_s"] - base["wall_time_s"] > MIN_REGRESSION_DELTA_S:
+            regressions.append(f"{item['name']} ({item['points']} pts, {item['samples']} samples): 时间 x{time_ratio:.2f}")
+        if memory_ratio > memory_threshold:
+            regressions.append(f"{item['name']} ({item['points']} pts, {item['samples']} samples): 内存 x{memory_ratio:.2f}")
+    return regressions
+
+
+def environment_info():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _print_row(item):
+    ratio = item.get("baseline_ratio")
+    ratio_text = f"x{ratio['time']:.2f}/x{ratio['memory']:.2f}" if ratio else "-"
+    points = "-" if item["points"] is None else item["points"]
+    samples = "-" if item["samples"] is None else item["samples"]
+    print(
+        f"{item['name']:<34} {points:>6} {samples:>7} {item['wall_time_s'] * 1e3:>11.2f} "
+        f"{item['peak_memory_mb']:>9.1f} {item['throughput']:>13.4g} {item['throughput_unit']:<14} {ratio_text}"
+    )
+    for stage, seconds in (item.get("stages_s") or {}).items():
+        print(f"    - {stage:<30} {seconds * 1e3:>21.2f} ms")
+
+
+def run_suite(suite_name, build_cases, description, argv=None):
+    """解析命令行、运行用例、写 JSON、与基线比较；返回进程退出码。"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--quick", action="store_true", help="只跑小规模用例")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--filter", default=None, help="只跑名称包含该字符串的用例")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, f"{suite_name}.json"))
+    parser.add_argument("--baseline", default=os.path.join(BASELINE_DIR, f"{suite_name}.json"))
+    parser.add_argument("--time-threshold", type=float, default=2.0, help="耗时超过基线的倍数视为回归")
+    parser.add_argument("--memory-threshold", type=float, default=1.5, help="峰值内存超过基线的倍数视为回归")
+    parser.add_argument("--update-baseline", action="store_true", help="把本次结果写为新基线")
+    args = parser.parse_args(argv)
+
+    cases = [case for case in build_cases(args.quick) if not args.filter or args.filter in case.name]
+    print(f"[BENCH] {suite_name}: {len(cases)} 个用例, repeat={args.repeat}{' (quick)' if args.quick else ''}")
+    print(
+        f"{'name':<34} {'points':>6} {'samples':>7} {'best ms':>11} {'peak MB':>9} "
+        f"{'throughput':>13} {'unit':<14} vs baseline (time/mem)"
+    )
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = []
+    regressions = []
+    for case in cases:
+        item = measure_case(case, args.repeat)
+        if baseline:
+            regressions += compare_with_baseline([item], baseline, args.time_threshold, args.memory_threshold)
+        results.append(item)
+        _print_row(item)
+
+    report = {
+        "suite": suite_name,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment_info(),
+        "quick": args.quick,
+        "time_threshold": args.time_threshold,
+        "memory_threshold": args.memory_threshold,
+        "results": results,
+        "regressions": regressions,
+    }
+    target = args.baseline if args.update_baseline else args.output
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    with open(target, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[SAVE] {'基线' if args.update_baseline else '结果'}已写入: {target}")
+
+    if baseline is None and not args.update_baseline:
+        print(f"[WARN] 未找到基线 {args.baseline}，跳过对比（--update-baseline 生成）")
+    if regressions:
+        print("[FAIL] 性能回归:")
+        for line in regressions:
+            print(f"   - {line}")
+        return 1
+    return 0
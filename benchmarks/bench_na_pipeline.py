@@ -0,0 +1,102 @@
+"""
+NA 结果处理基准套件：build_na_result 与 export_na_report，覆盖 201/2001/5001/10001 点，
+包括 ANT_FULL 全扫宽（上百个谷值）用例。
+
+每个用例额外输出阶段耗时（stages_s）：build_na_result 拆为 valleys / bandwidths /
+target / valley_bandwidths / smith / series，外加 json.dumps 的 serialization；
+export_na_report 按 PDF 页类型拆为 page_summary / page_s11 / page_vswr / page_smith /
+page_details / page_valleys，便于把回归定位到具体阶段。
+用法: python benchmarks/bench_na_pipeline.py [--quick] [--repeat 3] [--update-baseline]
+"""
+import json
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+from bench_harness import BenchmarkCase, run_suite
+
+from n9918a_na_backend import NA_PRESET_CONFIGS, build_na_result, export_na_report, na_result_lists  # noqa: E402
+
+POINTS = (201, 2001, 5001, 10001)
+QUICK_POINTS = (201, 2001)
+PRESETS = ("ANT_433", "ANT_FULL")
+# 全扫宽曲线上每 RIPPLE_PERIOD_POINTS 个点一个小谷，点数越多谷值越多（10001 点约 300 个）
+RIPPLE_PERIOD_POINTS = 32
+
+
+def synthetic_s11(preset_key, n_points, seed=9918):
+    """合成 S11 (dB) 与复反射系数：主谐振 + 周期性纹波 + 噪声。"""
+    config = dict(NA_PRESET_CONFIGS[preset_key], points=n_points)
+    rng = np.random.default_rng(seed + n_points)
+    frequencies = np.linspace(config["start_freq"], config["stop_freq"], n_points)
+    center = config["target_freq"] or (config["start_freq"] + config["stop_freq"]) / 3
+    span = config["stop_freq"] - config["start_freq"]
+    s11_db = -2.5 - 22.0 / (1.0 + ((frequencies - center) / (span * 0.02)) ** 2)
+    if config["full_sweep"]:
+        cycles = max(4, n_points // RIPPLE_PERIOD_POINTS)
+        s11_db += 1.5 * np.cos(np.linspace(0.0, 2.0 * np.pi * cycles, n_points))
+    s11_db += rng.normal(0.0, 0.05, n_points)
+    s11_db = np.minimum(s11_db, -0.05)
+    magnitude = 10 ** (s11_db / 20)
+    phase = np.linspace(0.0, -6.0 * np.pi, n_points)
+    return {
+        "frequencies": frequencies.tolist(),
+        "s11_db": s11_db.tolist(),
+        "real": (magnitude * np.cos(phase)).tolist(),
+        "imag": (magnitude * np.sin(phase)).tolist(),
+        "config": config,
+        "preset_key": preset_key,
+    }
+
+
+def run_build(data):
+    timings = {}
+    result = build_na_result(timings=timings, **data)
+    start = time.perf_counter()
+    json.dumps(na_result_lists(result), ensure_ascii=False)
+    timings["serialization"] = time.perf_counter() - start
+    return result, timings
+
+
+def build_result_setup(data):
+    return build_na_result(**data)
+
+
+def run_export(result):
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp, warnings.catch_warnings():
+        # 无中文字体的机器上 matplotlib 会对每个缺字形告警，不影响计时
+        warnings.simplefilter("ignore", UserWarning)
+        export_na_report(result, user_info={"operator": "bench"}, output_dir=tmp, timings=timings)
+    return timings
+
+
+def build_cases(quick=False):
+    cases = []
+    for preset_key in PRESETS:
+        for n_points in QUICK_POINTS if quick else POINTS:
+            def data_setup(preset_key=preset_key, n_points=n_points):
+                return synthetic_s11(preset_key, n_points)
+
+            def export_setup(preset_key=preset_key, n_points=n_points):
+                return build_result_setup(synthetic_s11(preset_key, n_points))
+
+            cases += [
+                BenchmarkCase(
+                    f"build_na_result[{preset_key}]", run_build, setup=data_setup,
+                    points=n_points, work_items=n_points, unit="points", stages=lambda out: out[1],
+                ),
+                # PDF 导出单次即需数秒，只跑一次
+                BenchmarkCase(
+                    f"export_na_report[{preset_key}]", run_export, setup=export_setup,
+                    points=n_points, work_items=1, unit="reports", repeat=1, stages=lambda out: out,
+                ),
+            ]
+    return cases
+
+
+if __name__ == "__main__":
+    sys.exit(run_suite("na_pipeline", build_cases, __doc__))
@@ -0,0 +1,164 @@
+"""
+post_process_peak_search 基准：逐点循环（旧实现）与向量化实现对比。
+
+用法: python benchmarks/bench_peak_search.py [--repeat 5] [--points 2001 10001 50001]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from n9918a_backend import (  # noqa: E402
+    collapse_exceeding_regions,
+    find_peaks_manual,
+    get_emission_limit_info,
+    get_fcc_ce_limits,
+    post_process_peak_search,
+    signal,
+)
+
+
+def legacy_post_process_peak_search(frequencies, amplitudes, peak_distance=30, min_prominence=2, detector_type="QUASI_PEAK"):
+    """旧版逐点实现（限值逐点查询、逐峰打分），仅作基准对照。"""
+    if len(amplitudes) < 3:
+        return []
+    mean_amp = np.mean(amplitudes)
+    std_amp = np.std(amplitudes)
+    dynamic_prominence = max(min_prominence, std_amp * 0.2)
+    min_height = mean_amp + dynamic_prominence * 0.3
+    if signal:
+        primary_peaks, _ = signal.find_peaks(amplitudes, distance=peak_distance, prominence=dynamic_prominence, height=min_height)
+        secondary_peaks, _ = signal.find_peaks(
+            amplitudes,
+            distance=max(5, peak_distance // 4),
+            prominence=max(0.3, dynamic_prominence * 0.3),
+            height=mean_amp + 0.3,
+        )
+    else:
+        primary_peaks = find_peaks_manual(amplitudes, distance=peak_distance, prominence=dynamic_prominence)
+        secondary_peaks = find_peaks_manual(
+            amplitudes,
+            distance=max(5, peak_distance // 4),
+            prominence=max(0.3, dynamic_prominence * 0.3),
+        )
+
+    threshold_indices = []
+    for i in range(len(amplitudes)):
+        fcc_limit, ce_limit = get_fcc_ce_limits(frequencies[i], detector_type=detector_type)
+        if amplitudes[i] > fcc_limit or amplitudes[i] > ce_limit:
+            threshold_indices.append(i)
+    threshold_peaks = collapse_exceeding_regions(threshold_indices, amplitudes, frequencies)
+
+    all_peaks = list(set(list(primary_peaks) + list(secondary_peaks) + threshold_peaks))
+    if len(all_peaks) == 0:
+        all_peaks = find_peaks_manual(amplitudes, distance=peak_distance // 2, prominence=min_prominence * 0.3)
+
+    peak_scores = []
+    for idx in all_peaks:
+        if idx < 0 or idx >= len(amplitudes):
+            continue
+        amp_dbuv = amplitudes[idx]
+        limit_info = get_emission_limit_info(frequencies[idx], detector_type=detector_type)
+        fcc_margin = amp_dbuv - limit_info["fcc_limit"]
+        ce_margin = amp_dbuv - limit_info["ce_limit"]
+        amplitude_score = (amp_dbuv - mean_amp) / std_amp if std_amp > 0 else 0
+        margin_score = max(fcc_margin, ce_margin, 0)
+        prominence_score = 0
+        if 1 <= idx < len(amplitudes) - 1:
+            prominence_score = min(amp_dbuv - amplitudes[idx - 1], amp_dbuv - amplitudes[idx + 1])
+        exceed_bonus = 15 if (fcc_margin > 0 or ce_margin > 0) else 0
+        total_score = amplitude_score * 0.2 + margin_score * 0.5 + prominence_score * 0.2 + exceed_bonus
+        peak_scores.append((idx, total_score, amp_dbuv, fcc_margin, ce_margin, limit_info))
+    peak_scores.sort(key=lambda x: x[1], reverse=True)
+
+    freq_range_mhz = (frequencies[-1] - frequencies[0]) / 1e6
+    max_peaks = 25 if freq_range_mhz < 1 else 40 if freq_range_mhz < 100 else 50
+    exceed_peaks = []
+    normal_peaks = []
+    for idx, score, amp_dbuv, fcc_margin, ce_margin, limit_info in peak_scores:
+        freq_hz = frequencies[idx]
+        peak_data = {
+            'frequency_hz': freq_hz,
+            'frequency_mhz': freq_hz / 1e6,
+            'amplitude_dbuv': amp_dbuv,
+            'fcc_limit': limit_info["fcc_limit"],
+            'ce_limit': limit_info["ce_limit"],
+            'fcc_margin': fcc_margin,
+            'ce_margin': ce_margin,
+            'exceed_fcc': fcc_margin > 0,
+            'exceed_ce': ce_margin > 0,
+            'importance_score': score,
+            'limit_unit': limit_info["unit"],
+            'limit_measurement_type': limit_info["measurement_type"],
+            'fcc_detector': limit_info["fcc_detector"],
+            'ce_detector': limit_info["ce_detector"],
+            'limit_note': limit_info["note"],
+        }
+        (exceed_peaks if fcc_margin > 0 or ce_margin > 0 else normal_peaks).append(peak_data)
+    peak_results = exceed_peaks + normal_peaks[:max_peaks - len(exceed_peaks)]
+    peak_results.sort(key=lambda x: x['frequency_hz'])
+    return peak_results
+
+
+def synthetic_spectrum(n_points, seed=9918):
+    rng = np.random.default_rng(seed + n_points)
+    frequencies = np.linspace(30e6, 1e9, n_points)
+    mhz = frequencies / 1e6
+    amplitudes = 18 + 7 * np.sin(np.log10(mhz) * 3.7) + rng.uniform(-1.2, 1.2, n_points)
+    for center, height, width in [(47.0, 19, 1.8), (175.0, 27, 2.8), (275.0, 30, 3.6), (500.0, 14, 5.5)]:
+        amplitudes += height * np.exp(-((mhz - center) ** 2) / (2 * width ** 2))
+    return frequencies.tolist(), np.round(amplitudes, 3).tolist()
+
+
+def _best_time(func, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _same_results(left, right):
+    if len(left) != len(right):
+        return False
+    for a, b in zip(left, right):
+        if a.keys() != b.keys():
+            return False
+        for key in a:
+            if isinstance(a[key], float):
+                if abs(a[key] - b[key]) > 1e-9:
+                    return False
+            elif a[key] != b[key]:
+                return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--points", type=int, nargs="+", default=[2001, 10001, 50001])
+    args = parser.parse_args()
+
+    print(f"{'points':>8} {'legacy ms':>12} {'vector ms':>12} {'speedup':>9} {'peaks':>6} identical")
+    for n_points in args.points:
+        frequencies, amplitudes = synthetic_spectrum(n_points)
+        legacy_time, legacy = _best_time(
+            lambda: legacy_post_process_peak_search(frequencies, amplitudes), args.repeat
+        )
+        vector_time, vector = _best_time(
+            lambda: post_process_peak_search(frequencies, amplitudes), args.repeat
+        )
+        print(
+            f"{n_points:>8} {legacy_time * 1e3:>12.2f} {vector_time * 1e3:>12.2f} "
+            f"{legacy_time / vector_time:>8.1f}x {len(vector):>6} {_same_results(legacy, vector)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
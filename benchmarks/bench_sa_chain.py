@@ -0,0 +1,148 @@
+"""
+SA 处理链基准套件：_parse_numeric_csv、calculate_emc_detector_modes、
+calculate_quasi_peak_value、post_process_peak_search、collapse_exceeding_regions、
+save_emi_measurement_data，覆盖 1001/2001/10001 点 × 20/300/3000 次采样。
+
+结果写入 benchmarks/results/sa_chain.json，并与 benchmarks/baselines/sa_chain.json 对比，
+耗时超过基线 2 倍或峰值内存超过 1.5 倍时退出码为 1。
+用法: python benchmarks/bench_sa_chain.py [--quick] [--repeat 3] [--update-baseline]
+"""
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from bench_harness import BenchmarkCase, run_suite
+
+from n9918a_backend import (  # noqa: E402
+    EMCSampleStore,
+    N9918AController,
+    calculate_emc_detector_modes,
+    calculate_quasi_peak_value,
+    collapse_exceeding_regions,
+    compile_limit_table,
+    post_process_peak_search,
+    save_emi_measurement_data,
+)
+
+POINTS = (1001, 2001, 10001)
+SAMPLES = (20, 300, 3000)
+QUICK_POINTS = (1001, 2001)
+QUICK_SAMPLES = (20, 300)
+# calculate_quasi_peak_value 是逐频点标量参考实现，只对这么多频点计时
+QP_SCALAR_BINS = 16
+# 超过该单元数（points x samples）的用例只跑一次
+SINGLE_RUN_CELLS = 5_000_000
+
+
+def synthetic_spectrum(n_points, seed=9918):
+    rng = np.random.default_rng(seed + n_points)
+    frequencies = np.linspace(30e6, 1e9, n_points)
+    mhz = frequencies / 1e6
+    amplitudes = 18 + 7 * np.sin(np.log10(mhz) * 3.7) + rng.uniform(-1.2, 1.2, n_points)
+    for center, height, width in [(47.0, 19, 1.8), (175.0, 27, 2.8), (275.0, 30, 3.6), (500.0, 14, 5.5)]:
+        amplitudes += height * np.exp(-((mhz - center) ** 2) / (2 * width ** 2))
+    return frequencies.tolist(), np.round(amplitudes, 3).tolist()
+
+
+def synthetic_store(n_points, n_samples, seed=9918):
+    frequencies, base = synthetic_spectrum(n_points, seed)
+    rng = np.random.default_rng(seed + n_points * 7 + n_samples)
+    base = np.asarray(base)
+    store = EMCSampleStore(frequencies, initial_capacity=n_samples)
+    for index in range(n_samples):
+        burst = 6.0 * (rng.random() < 0.2)
+        store.append(index * 0.05, base + burst + rng.normal(0.0, 1.0, n_points), frequencies)
+    return store
+
+
+def _repeat_for(n_points, n_samples):
+    return 1 if n_points * n_samples > SINGLE_RUN_CELLS else None
+
+
+def _save_in_tempdir(store):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            return save_emi_measurement_data({"sampling_data": store}, filename_prefix="bench")
+        finally:
+            os.chdir(cwd)
+
+
+def build_cases(quick=False):
+    points_list = QUICK_POINTS if quick else POINTS
+    samples_list = QUICK_SAMPLES if quick else SAMPLES
+    controller = N9918AController(ip_address="bench")
+    cases = []
+
+    for n_points in points_list:
+        def csv_setup(n_points=n_points):
+            _frequencies, amplitudes = synthetic_spectrum(n_points)
+            return ",".join(f"{value:.6E}" for value in amplitudes)
+
+        def peak_setup(n_points=n_points):
+            return synthetic_spectrum(n_points)
+
+        def collapse_setup(n_points=n_points):
+            frequencies, amplitudes = synthetic_spectrum(n_points)
+            # 降低 10dB 的限值，制造成片的超限区域
+            exceeding = np.flatnonzero(np.asarray(amplitudes) + 10.0 > compile_limit_table(frequencies).fcc)
+            return exceeding.tolist(), amplitudes, frequencies
+
+        cases += [
+            BenchmarkCase(
+                "_parse_numeric_csv", lambda data: controller._parse_numeric_csv(data),
+                setup=csv_setup, points=n_points, work_items=n_points, unit="points",
+            ),
+            BenchmarkCase(
+                "post_process_peak_search", lambda data: post_process_peak_search(*data),
+                setup=peak_setup, points=n_points, work_items=n_points, unit="points",
+            ),
+            BenchmarkCase(
+                "collapse_exceeding_regions", lambda data: collapse_exceeding_regions(*data),
+                setup=collapse_setup, points=n_points, work_items=n_points, unit="points",
+            ),
+        ]
+
+    for n_samples in samples_list:
+        def qp_setup(n_samples=n_samples):
+            store = synthetic_store(QP_SCALAR_BINS, n_samples)
+            matrix = store.amplitudes.astype(np.float64)
+            return store.timestamps.tolist(), [matrix[:, index].tolist() for index in range(QP_SCALAR_BINS)], store.frequencies
+
+        def qp_run(data):
+            times, columns, frequencies = data
+            return [calculate_quasi_peak_value(times, column, frequency) for column, frequency in zip(columns, frequencies)]
+
+        cases.append(
+            BenchmarkCase(
+                "calculate_quasi_peak_value", qp_run, setup=qp_setup, points=QP_SCALAR_BINS,
+                samples=n_samples, work_items=QP_SCALAR_BINS * n_samples, unit="cells",
+            )
+        )
+
+    for n_points in points_list:
+        for n_samples in samples_list:
+            def store_setup(n_points=n_points, n_samples=n_samples):
+                return synthetic_store(n_points, n_samples)
+
+            cells = n_points * n_samples
+            cases += [
+                BenchmarkCase(
+                    "calculate_emc_detector_modes", lambda store: calculate_emc_detector_modes(store, "QUASI_PEAK"),
+                    setup=store_setup, points=n_points, samples=n_samples, work_items=cells, unit="cells",
+                    repeat=_repeat_for(n_points, n_samples),
+                ),
+                BenchmarkCase(
+                    "save_emi_measurement_data", _save_in_tempdir,
+                    setup=store_setup, points=n_points, samples=n_samples, work_items=cells, unit="cells",
+                    repeat=_repeat_for(n_points, n_samples),
+                ),
+            ]
+    return cases
+
+
+if __name__ == "__main__":
+    sys.exit(run_suite("sa_chain", build_cases, __doc__))
@@ -0,0 +1,682 @@
+# fieldfox_simulator.py
+"""
+FieldFox N9918A SCPI 模拟器：无硬件时做吞吐基准和回归测试。
+
+- FieldFoxSimulator: SCPI 状态机，模拟 SA / NA 模式、由 span/RBW/points（NA 为 points/IFBW）
+  推出的 sweep time、ASCII 与 REAL,32 / REAL,64 块传输、*OPC? 阻塞、SYST:ERR? 错误队列、
+  MMEM:STOR/LOAD:STAT 状态文件，
+  以及可配置的网络时延、抖动和链路速率。
+- SimulatedVisaResource: 进程内 pyvisa 风格资源，直接赋给 controller.device 使用。
+- FieldFoxSimulatorServer: 本地 TCP SCPI socket 服务（同 FieldFox 5025 端口的行协议），
+  pyvisa-py 可用资源名 "TCPIP0::127.0.0.1::<port>::SOCKET" 连接。
+- SimulatorResourceManager: 未安装 pyvisa 时连接上述 socket 服务的最小 ResourceManager。
+
+用法: python fieldfox_simulator.py [--port 5025] [--latency-ms 2] [--jitter-ms 1] [--link-mbps 100]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import re
+import socket
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+SIMULATOR_IDN = "Keysight Technologies,N9918A,SIM00001,A.11.55"
+SCPI_SOCKET_PORT = 5025
+
+# 默认 SA 场景：(中心频率 Hz, 高出底噪 dB, 宽度 Hz, 出现概率)
+DEFAULT_SA_EMITTERS = (
+    (47e6, 22.0, 1.5e6, 1.0),
+    (175e6, 30.0, 3e6, 1.0),
+    (275e6, 36.0, 3e6, 0.6),
+    (433.92e6, 28.0, 1e6, 0.25),
+)
+# 默认 NA 天线谐振点：(谐振频率 Hz, Q)
+DEFAULT_NA_RESONANCES = (
+    (315e6, 25.0),
+    (433.92e6, 30.0),
+    (868e6, 35.0),
+    (915e6, 35.0),
+    (2.44e9, 40.0),
+    (5.5e9, 20.0),
+)
+
+SA_DEFAULT_SETTINGS = {
+    "FREQ:STAR": "0",
+    "FREQ:STOP": "26500000000",
+    "SWE:POIN": "401",
+    "BAND:RES": "1000000",
+    "BAND:VID": "1000000",
+    "AMPL:UNIT": "DBM",
+    "AVER:COUN": "1",
+    "AVER:TYPE": "POW",
+    "DET": "AUTO",
+}
+NA_DEFAULT_SETTINGS = {
+    "FREQ:STAR": "30000",
+    "FREQ:STOP": "26500000000",
+    "SWE:POIN": "201",
+    "BWID": "10000",
+    "CALC:PAR:DEF": "S11",
+    "CALC:FORM": "MLOG",
+}
+SCPI_ROOTS = {"FREQ", "SWE", "BAND", "AMPL", "AVER", "DET", "POW", "BWID", "CALC", "TRAC", "FORM",
+              "INIT", "INST", "SYST", "CORR", "MMEM", "DISP", "SENS"}
+DATA_QUERIES = {"TRAC:DATA", "TRAC:XVAL", "CALC:DATA:FDAT", "CALC:DATA:SDAT"}
+MAX_CONTINUOUS_SWEEPS_PER_UPDATE = 200
+
+
+def _short_node(node: str) -> str:
+    """SCPI 长/短格式节点统一成短格式：STARt -> STAR，VIDeo -> VID，TRACe1 -> TRAC1。"""
+    match = re.match(r"([A-Z]+)(\d*)$", node)
+    if not match:
+        return node
+    name, suffix = match.groups()
+    if len(name) > 4:
+        name = name[:3] if name[3] in "AEIOU" else name[:4]
+    return name + suffix
+
+
+def normalize_scpi_header(header: str) -> str:
+    """':SENS:FREQ:START' -> 'FREQ:STAR'；省略的 SENS 根节点与 IMMediate 等默认节点去掉。"""
+    header = header.strip().upper().lstrip(":")
+    if header.startswith("*"):
+        return header
+    nodes = [_short_node(node) for node in header.split(":") if node]
+    if nodes and nodes[0] == "SENS":
+        nodes = nodes[1:]
+    if nodes and nodes[-1] == "IMM":
+        nodes = nodes[:-1]
+    return ":".join(nodes)
+
+
+def _split_trace_index(key: str) -> Tuple[str, int]:
+    """'TRAC2:TYPE' -> ('TRAC:TYPE', 2)；无下标时默认 1。"""
+    match = re.match(r"TRAC(\d*)(:.*)?$", key)
+    if not match:
+        return key, 1
+    return "TRAC" + (match.group(2) or ""), int(match.group(1) or 1)
+
+
+class SCPIError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(f'{code},"{message}"')
+        self.code = code
+
+
+class FieldFoxSimulator:
+    """
+    单台 FieldFox 的 SCPI 行为模型，线程安全（同一时刻只处理一条消息，与真机一致）。
+
+    time_scale 缩放所有 sweep time（仪器返回的 SWE:TIME? 也随之缩放），
+    sweep_time 不为 None 时固定 SA/NA sweep time，便于基准对比。
+    """
+
+    def __init__(
+        self,
+        latency_s: float = 0.0,
+        jitter_s: float = 0.0,
+        link_bytes_per_second: Optional[float] = None,
+        time_scale: float = 1.0,
+        sweep_time: Optional[float] = None,
+        seed: int = 9918,
+        sa_emitters=DEFAULT_SA_EMITTERS,
+        na_resonances=DEFAULT_NA_RESONANCES,
+    ):
+        self.latency_s = float(latency_s)
+        self.jitter_s = float(jitter_s)
+        self.link_bytes_per_second = link_bytes_per_second
+        self.time_scale = float(time_scale)
+        self.fixed_sweep_time = sweep_time
+        self.sa_emitters = tuple(sa_emitters)
+        self.na_resonances = tuple(na_resonances)
+        self.rng = np.random.default_rng(seed)
+        self.jitter_rng = random.Random(seed)
+        self.lock = threading.RLock()
+        self.stats = {"messages": 0, "queries": 0, "bytes_sent": 0, "sweeps": 0, "errors": 0}
+        # MMEM:STOR:STAT 保存的状态文件（含 CORR 校准设置），与真机存储一样不受 *RST 影响
+        self.state_files: Dict[str, Tuple[str, Dict[str, Dict[str, str]]]] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        self.mode = "SA"
+        self.settings: Dict[str, Dict[str, str]] = {
+            "SA": dict(SA_DEFAULT_SETTINGS),
+            "NA": dict(NA_DEFAULT_SETTINGS),
+        }
+        self.data_format = "ASC"
+        self.byte_order = "NORM"
+        self.errors: List[str] = []
+        self.continuous = True
+        self.continuous_since = time.monotonic()
+        self.sweep_end: Optional[float] = None
+        self.trace_types = {1: "CLRW", 2: "BLAN", 3: "BLAN", 4: "BLAN"}
+        self.traces: Dict[int, Optional[np.ndarray]] = {index: None for index in self.trace_types}
+        self.average_counts = {index: 0 for index in self.trace_types}
+        self.na_gamma: Optional[np.ndarray] = None
+
+    def inject_error(self, code: int = -200, message: str = "Execution error") -> None:
+        with self.lock:
+            self.errors.append(f'{code},"{message}"')
+
+    def _setting(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        return self.settings[self.mode].get(key, default)
+
+    def _float_setting(self, key: str) -> float:
+        return float(self._setting(key, "0"))
+
+    def frequency_axis(self) -> np.ndarray:
+        return np.linspace(
+            self._float_setting("FREQ:STAR"),
+            self._float_setting("FREQ:STOP"),
+            int(self._float_setting("SWE:POIN")),
+        )
+
+    def sweep_time(self) -> float:
+        """SA: 约 2*span/(RBW*min(RBW,VBW))，且每点至少 20us；NA: points/IFBW 加固定开销。"""
+        if self.fixed_sweep_time is not None:
+            return float(self.fixed_sweep_time) * self.time_scale
+        points = self._float_setting("SWE:POIN")
+        if self.mode == "NA":
+            seconds = points * 1.2 / max(self._float_setting("BWID"), 1.0) + 0.01
+        else:
+            span = abs(self._float_setting("FREQ:STOP") - self._float_setting("FREQ:STAR"))
+            rbw = max(self._float_setting("BAND:RES"), 1.0)
+            vbw = max(self._float_setting("BAND:VID"), 1.0)
+            seconds = max(2.0 * span / (rbw * min(rbw, vbw)), points * 20e-6, 0.005)
+        return seconds * self.time_scale
+
+    def _sa_trace_dbuv(self) -> np.ndarray:
+        frequencies = self.frequency_axis()
+        floor_db = 12.0 + 10.0 * np.log10(max(self._float_setting("BAND:RES"), 1.0) / 100e3)
+        power = np.power(10.0, (floor_db + self.rng.normal(0.0, 1.5, frequencies.size)) / 10.0)
+        for center, height, width, probability in self.sa_emitters:
+            if self.rng.random() > probability:
+                continue
+            level = floor_db + height + self.rng.normal(0.0, 0.5)
+            shape = np.exp(-((frequencies - center) ** 2) / (2.0 * width ** 2))
+            power += np.power(10.0, level / 10.0) * shape
+        return 10.0 * np.log10(power)
+
+    def _na_gamma(self) -> np.ndarray:
+        frequencies = self.frequency_axis()
+        gamma = np.full(frequencies.size, 0.92 + 0j)
+        for resonance, q_factor in self.na_resonances:
+            detuning = 2.0 * q_factor * (frequencies / resonance - 1.0)
+            gamma -= 0.88 / (1.0 + 1j * detuning)
+        magnitude = np.abs(gamma)
+        gamma = np.where(magnitude > 0.99, gamma / np.maximum(magnitude, 1e-12) * 0.99, gamma)
+        gamma *= np.exp(-2j * np.pi * frequencies * 2e-9)
+        noise = self.rng.normal(0.0, 2e-4, (2, frequencies.size))
+        return gamma + noise[0] + 1j * noise[1]
+
+    def _complete_sweep(self) -> None:
+        self.stats["sweeps"] += 1
+        if self.mode == "NA":
+            self.na_gamma = self._na_gamma()
+            return
+        new_trace = self._sa_trace_dbuv()
+        average_limit = max(1, int(self._float_setting("AVER:COUN")))
+        for index, trace_type in self.trace_types.items():
+            previous = self.traces[index]
+            if previous is not None and previous.size != new_trace.size:
+                previous = None
+            if trace_type == "CLRW" or previous is None and trace_type != "BLAN":
+                self.traces[index] = new_trace.copy()
+                self.average_counts[index] = 1
+            elif trace_type == "MAXH":
+                self.traces[index] = np.maximum(previous, new_trace)
+            elif trace_type == "MINH":
+                self.traces[index] = np.minimum(previous, new_trace)
+            elif trace_type == "AVG":
+                count = min(self.average_counts[index] + 1, average_limit)
+                linear = np.power(10.0, previous / 20.0)
+                linear += (np.power(10.0, new_trace / 20.0) - linear) / count
+                self.traces[index] = 20.0 * np.log10(linear)
+                self.average_counts[index] = count
+
+    def _wait_for_sweeps(self) -> None:
+        """*OPC? 与数据查询在 sweep 完成前阻塞；连续扫描时补齐期间应完成的 sweep。"""
+        if self.sweep_end is not None:
+            delay = self.sweep_end - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.sweep_end = None
+            self._complete_sweep()
+        if self.continuous:
+            now = time.monotonic()
+            sweep_time = max(self.sweep_time(), 1e-6)
+            completed = int((now - self.continuous_since) / sweep_time)
+            for _ in range(min(completed, MAX_CONTINUOUS_SWEEPS_PER_UPDATE)):
+                self._complete_sweep()
+            if completed:
+                self.continuous_since += completed * sweep_time
+
+    def _encode_values(self, values) -> bytes:
+        values = np.asarray(values, dtype=np.float64)
+        if self.data_format == "ASC":
+            return ",".join(f"{value:.10E}" for value in values).encode("ascii")
+        dtype = np.float32 if self.data_format == "REAL32" else np.float64
+        order = ">" if self.byte_order == "NORM" else "<"
+        payload = values.astype(np.dtype(dtype).newbyteorder(order)).tobytes()
+        length = str(len(payload))
+        return f"#{len(length)}{length}".encode("ascii") + payload
+
+    def _amplitude_unit_offset(self) -> float:
+        unit = (self._setting("AMPL:UNIT") or "DBM").upper()
+        return {"DBUV": 0.0, "DBMV": -60.0, "DBM": -107.0}.get(unit, -107.0)
+
+    def _set(self, key: str, argument: str) -> None:
+        argument = argument.strip()
+        if key == "INST:SEL":
+            mode = argument.strip("'\"").upper()
+            if mode not in self.settings:
+                raise SCPIError(-224, "Illegal parameter value")
+            if mode != self.mode:
+                self.mode = mode
+                self.sweep_end = None
+        elif key == "FORM:DATA" or key == "FORM":
+            value = argument.replace(" ", "").upper()
+            if value.startswith("REAL,64"):
+                self.data_format = "REAL64"
+            elif value.startswith("REAL"):
+                self.data_format = "REAL32"
+            elif value.startswith("ASC"):
+                self.data_format = "ASC"
+            else:
+                raise SCPIError(-224, "Illegal parameter value")
+        elif key == "FORM:BORD":
+            self.byte_order = "SWAP" if argument.upper().startswith("SWAP") else "NORM"
+        elif key == "INIT:CONT":
+            continuous = argument.upper() in ("ON", "1")
+            if continuous and not self.continuous:
+                self.continuous_since = time.monotonic()
+            elif not continuous and self.continuous:
+                self._wait_for_sweeps()
+            self.continuous = continuous
+        elif key.startswith("TRAC") and key.endswith(":TYPE"):
+            _base, index = _split_trace_index(key)
+            trace_type = _short_node(argument.upper())
+            if trace_type not in ("CLRW", "MAXH", "MINH", "AVG", "BLAN"):
+                raise SCPIError(-224, "Illegal parameter value")
+            if self.trace_types.get(index) != trace_type:
+                self.traces[index] = None
+            self.trace_types[index] = trace_type
+        elif key == "MMEM:STOR:STAT":
+            self.state_files[argument.strip("'\"")] = (self.mode, {mode: dict(values) for mode, values in self.settings.items()})
+        elif key in ("MMEM:LOAD:STAT", "MMEM:DEL"):
+            name = argument.strip("'\"")
+            if name not in self.state_files:
+                raise SCPIError(-256, "File name not found")
+            if key == "MMEM:DEL":
+                del self.state_files[name]
+                return
+            self.mode, settings = self.state_files[name]
+            self.settings = {mode: dict(values) for mode, values in settings.items()}
+            self.sweep_end = None
+            self.na_gamma = None
+        elif key.split(":")[0] in ("CORR", "MMEM", "DISP", "SYST", "POW", "DET", "AMPL", "AVER") or key in self.settings[self.mode] or key.endswith(":AUTO"):
+            self.settings[self.mode][key] = argument
+        elif key.split(":")[0] in ("FREQ", "SWE", "BAND", "BWID", "CALC"):
+            try:
+                float(argument)
+            except ValueError:
+                if key.split(":")[0] != "CALC":
+                    raise SCPIError(-104, "Data type error")
+            self.settings[self.mode][key] = argument
+        else:
+            raise SCPIError(-113, "Undefined header")
+
+    def _command(self, key: str) -> None:
+        if key == "*CLS":
+            self.errors.clear()
+        elif key == "*RST":
+            self.reset()
+        elif key == "INIT":
+            self._wait_for_sweeps()
+            self.sweep_end = time.monotonic() + self.sweep_time()
+        elif key == "INIT:REST":
+            self.traces = {index: None for index in self.trace_types}
+            self.average_counts = {index: 0 for index in self.trace_types}
+        elif key.split(":")[0] in ("CORR", "MMEM"):
+            pass
+        else:
+            raise SCPIError(-113, "Undefined header")
+
+    def _query(self, key: str) -> bytes:
+        if key == "*IDN":
+            return SIMULATOR_IDN.encode("ascii")
+        if key == "*OPC":
+            self._wait_for_sweeps()
+            return b"1"
+        if key == "SYST:ERR":
+            return (self.errors.pop(0) if self.errors else '+0,"No error"').encode("ascii")
+        if key == "INST:SEL":
+            return f'"{self.mode}"'.encode("ascii")
+        if key == "INST:CAT":
+            return b'"SA","NA"'
+        if key == "SWE:TIME":
+            return f"{self.sweep_time():.6E}".encode("ascii")
+        if key == "INIT:CONT":
+            return b"1" if self.continuous else b"0"
+        if key == "FORM:DATA" or key == "FORM":
+            return {"ASC": b"ASC,0", "REAL32": b"REAL,32", "REAL64": b"REAL,64"}[self.data_format]
+
+        base, index = _split_trace_index(key)
+        if base in DATA_QUERIES:
+            if self.mode == "SA" and base.startswith("CALC") or self.mode == "NA" and base.startswith("TRAC"):
+                raise SCPIError(-113, "Undefined header")
+            self._wait_for_sweeps()
+            if base == "TRAC:XVAL":
+                return self._encode_values(self.frequency_axis())
+            if base == "TRAC:DATA":
+                trace = self.traces.get(index)
+                if trace is None or trace.size != int(self._float_setting("SWE:POIN")):
+                    self._complete_sweep()
+                    trace = self.traces.get(index)
+                if trace is None:
+                    trace = np.full(int(self._float_setting("SWE:POIN")), -200.0)
+                return self._encode_values(trace + self._amplitude_unit_offset())
+            if self.na_gamma is None or self.na_gamma.size != int(self._float_setting("SWE:POIN")):
+                self._complete_sweep()
+            if base == "CALC:DATA:SDAT":
+                interleaved = np.empty(self.na_gamma.size * 2)
+                interleaved[0::2] = self.na_gamma.real
+                interleaved[1::2] = self.na_gamma.imag
+                return self._encode_values(interleaved)
+            return self._encode_values(self._formatted_na_data())
+
+        if key.startswith("TRAC") and key.endswith(":TYPE"):
+            return self.trace_types.get(index, "BLAN").encode("ascii")
+        value = self._setting(key)
+        if value is None:
+            raise SCPIError(-113, "Undefined header")
+        return value.encode("ascii")
+
+    def _formatted_na_data(self) -> np.ndarray:
+        magnitude = np.maximum(np.abs(self.na_gamma), 1e-12)
+        fmt = (self._setting("CALC:FORM") or "MLOG").upper()
+        if fmt.startswith("PHAS"):
+            return np.degrees(np.angle(self.na_gamma))
+        if fmt.startswith("SWR"):
+            clipped = np.minimum(magnitude, 0.999999)
+            return (1 + clipped) / (1 - clipped)
+        if fmt.startswith("MLIN"):
+            return magnitude
+        return 20.0 * np.log10(magnitude)
+
+    def execute(self, message: str) -> Optional[bytes]:
+        """
+        执行一条消息（可用 ';' 拼接多条命令）；有查询时返回以 '\\n' 结尾的响应，
+        多个查询结果用 ';' 连接，与 FieldFox 一致。
+        """
+        with self.lock:
+            self.stats["messages"] += 1
+            responses = []
+            for command in message.strip().split(";"):
+                command = command.strip()
+                if not command:
+                    continue
+                parts = command.split(None, 1)
+                header = parts[0]
+                argument = parts[1] if len(parts) > 1 else ""
+                key = normalize_scpi_header(header.rstrip("?"))
+                try:
+                    if not key.startswith("*") and key.split(":")[0].rstrip("0123456789") not in SCPI_ROOTS:
+                        raise SCPIError(-113, "Undefined header")
+                    if header.endswith("?"):
+                        self.stats["queries"] += 1
+                        responses.append(self._query(key))
+                    elif argument:
+                        self._set(key, argument)
+                    else:
+                        self._command(key)
+                except SCPIError as exc:
+                    self.stats["errors"] += 1
+                    self.errors.append(str(exc))
+            if not responses:
+                return None
+            response = b";".join(responses) + b"\n"
+            self.stats["bytes_sent"] += len(response)
+        self._simulate_link(len(response))
+        return response
+
+    def _simulate_link(self, n_bytes: int) -> None:
+        delay = self.latency_s
+        if self.jitter_s:
+            delay += self.jitter_rng.uniform(0.0, self.jitter_s)
+        if self.link_bytes_per_second:
+            delay += n_bytes / float(self.link_bytes_per_second)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _SCPIResource:
+    """pyvisa MessageBasedResource 的最小子集：write/read/query/query_binary_values。"""
+
+    def __init__(self, timeout: int = 10000):
+        self.timeout = timeout
+        self.read_termination = "\n"
+        self.write_termination = "\n"
+        self._buffer = b""
+
+    def _send(self, data: bytes) -> None:
+        raise NotImplementedError
+
+    def _receive(self) -> bytes:
+        raise NotImplementedError
+
+    def _read_exact(self, n_bytes: int) -> bytes:
+        while len(self._buffer) < n_bytes:
+            self._buffer += self._receive()
+        data, self._buffer = self._buffer[:n_bytes], self._buffer[n_bytes:]
+        return data
+
+    def _read_until_newline(self) -> bytes:
+        while b"\n" not in self._buffer:
+            self._buffer += self._receive()
+        data, _sep, self._buffer = self._buffer.partition(b"\n")
+        return data
+
+    def read_raw(self) -> bytes:
+        """读一条完整响应；IEEE 488.2 定长块按长度读取，避免数据中的 '\\n' 截断。"""
+        first = self._read_exact(1)
+        if first == b"\n":
+            return b""
+        if first != b"#":
+            return first + self._read_until_newline()
+        n_digits = int(self._read_exact(1))
+        length = int(self._read_exact(n_digits))
+        payload = self._read_exact(length)
+        self._read_until_newline()
+        return b"#" + str(n_digits).encode() + str(length).encode() + payload
+
+    def write(self, command: str) -> int:
+        data = (command + self.write_termination).encode("ascii")
+        self._send(data)
+        return len(data)
+
+    def read(self) -> str:
+        return self.read_raw().decode("ascii", errors="replace").rstrip("\r\n")
+
+    def query(self, command: str) -> str:
+        self.write(command)
+        return self.read()
+
+    def query_binary_values(self, command, datatype="f", is_big_endian=False, container=list):
+        self.write(command)
+        raw = self.read_raw()
+        if not raw.startswith(b"#"):
+            raise ValueError(f"Expected IEEE block response, got {raw[:20]!r}")
+        n_digits = int(raw[1:2])
+        payload = raw[2 + n_digits:]
+        values = np.frombuffer(payload, dtype=np.dtype(datatype).newbyteorder(">" if is_big_endian else "<"))
+        if container is list:
+            return values.tolist()
+        return container(values)
+
+    def close(self) -> None:
+        pass
+
+
+class SimulatedVisaResource(_SCPIResource):
+    """进程内资源：不经过 socket，直接调用 FieldFoxSimulator.execute()。"""
+
+    def __init__(self, simulator: Optional[FieldFoxSimulator] = None, timeout: int = 10000):
+        super().__init__(timeout)
+        self.simulator = simulator if simulator is not None else FieldFoxSimulator()
+        self._pending: List[bytes] = []
+
+    def _send(self, data: bytes) -> None:
+        response = self.simulator.execute(data.decode("ascii"))
+        if response is not None:
+            self._pending.append(response)
+
+    def _receive(self) -> bytes:
+        if not self._pending:
+            raise TimeoutError("VI_ERROR_TMO: no response pending from simulator")
+        return self._pending.pop(0)
+
+
+class SocketVisaResource(_SCPIResource):
+    """连接 TCP SCPI socket（FieldFox 5025 端口或 FieldFoxSimulatorServer）的资源。"""
+
+    def __init__(self, host: str, port: int = SCPI_SOCKET_PORT, timeout: int = 10000):
+        self._socket = socket.create_connection((host, int(port)), timeout=timeout / 1000.0)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().__init__(timeout)
+
+    @property
+    def timeout(self) -> int:
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value) -> None:
+        self._timeout = value
+        self._socket.settimeout(None if value is None else value / 1000.0)
+
+    def _send(self, data: bytes) -> None:
+        self._socket.sendall(data)
+
+    def _receive(self) -> bytes:
+        data = self._socket.recv(65536)
+        if not data:
+            raise ConnectionError("SCPI socket closed by peer")
+        return data
+
+    def close(self) -> None:
+        try:
+            self._socket.close()
+        except OSError:
+            pass
+
+
+def parse_socket_resource_name(resource_name: str) -> Tuple[str, int]:
+    """'TCPIP0::127.0.0.1::5025::SOCKET' -> ('127.0.0.1', 5025)。"""
+    parts = resource_name.split("::")
+    if len(parts) != 4 or not parts[0].upper().startswith("TCPIP") or parts[3].upper() != "SOCKET":
+        raise ValueError(f"Not a TCPIP SOCKET resource: {resource_name}")
+    return parts[1], int(parts[2])
+
+
+class SimulatorResourceManager:
+    """pyvisa.ResourceManager 替身：只支持 TCPIP::<host>::<port>::SOCKET 资源。"""
+
+    def __init__(self, *_args, **_kwargs):
+        self.resources: List[SocketVisaResource] = []
+
+    def open_resource(self, resource_name: str, **_kwargs) -> SocketVisaResource:
+        host, port = parse_socket_resource_name(resource_name)
+        resource = SocketVisaResource(host, port)
+        self.resources.append(resource)
+        return resource
+
+    def close(self) -> None:
+        for resource in self.resources:
+            resource.close()
+        self.resources.clear()
+
+
+class _SCPISocketHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        simulator = self.server.simulator
+        for line in self.rfile:
+            message = line.decode("ascii", errors="replace").strip()
+            if not message:
+                continue
+            response = simulator.execute(message)
+            if response is not None:
+                self.wfile.write(response)
+                self.wfile.flush()
+
+
+class FieldFoxSimulatorServer(socketserver.ThreadingTCPServer):
+    """本地 TCP SCPI 服务；port=0 时由系统分配端口，start() 后台运行。"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = SCPI_SOCKET_PORT, simulator: Optional[FieldFoxSimulator] = None):
+        self.simulator = simulator if simulator is not None else FieldFoxSimulator()
+        super().__init__((host, port), _SCPISocketHandler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def resource_name(self) -> str:
+        host, port = self.server_address[:2]
+        return f"TCPIP0::{host}::{port}::SOCKET"
+
+    def start(self) -> "FieldFoxSimulatorServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="fieldfox-simulator", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FieldFox N9918A SCPI simulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=SCPI_SOCKET_PORT)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--link-mbps", type=float, default=0.0, help="0 表示不限速")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="sweep time 缩放系数")
+    args = parser.parse_args()
+
+    simulator = FieldFoxSimulator(
+        latency_s=args.latency_ms / 1000.0,
+        jitter_s=args.jitter_ms / 1000.0,
+        link_bytes_per_second=args.link_mbps * 1e6 / 8 if args.link_mbps > 0 else None,
+        time_scale=args.time_scale,
+    )
+    server = FieldFoxSimulatorServer(args.host, args.port, simulator)
+    print(f"[SIM] FieldFox 模拟器运行中: {server.resource_name}  (Ctrl+C 退出)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -15,9 +15,15 @@ import matplotlib.pyplot as plt
 import numpy as np
 import time
 import csv
+import json
 import os
 import math
+import queue
+import threading
 from datetime import datetime
+from functools import lru_cache
+
+from scpi_state import SCPIShadowState, open_visa_resource
 try:
     from scipy import signal
 except ImportError:
@@ -74,6 +80,10 @@ def linear_average_dbuv(values):
     return microvolts_to_dbuv(sum(linear_values) / len(linear_values))
 
 
+def _empty_trace_transfer_stats():
+    return {"reads": 0, "bytes": 0, "transfer_time": 0.0, "parse_time": 0.0}
+
+
 def _log_interpolate_limit(freq_mhz, start_mhz, stop_mhz, start_limit, stop_limit):
     if freq_mhz <= start_mhz:
         return float(start_limit)
@@ -85,103 +95,241 @@ def _log_interpolate_limit(freq_mhz, start_mhz, stop_mhz, start_limit, stop_limi
     return float(start_limit) + ratio * (float(stop_limit) - float(start_limit))
 
 
-def _select_detector_limit(detector_type, quasi_peak, average=None, peak=None):
-    detector = (detector_type or "QUASI_PEAK").upper()
-    if detector in {"AVERAGE", "AVG", "EAV"} and average is not None:
-        return float(average), "AVERAGE"
-    if detector in {"PEAK", "PK", "POSITIVE"} and peak is not None:
-        return float(peak), "PEAK"
-    return float(quasi_peak), "QUASI_PEAK"
+def _log_interpolate_limit_array(freq_mhz, start_mhz, stop_mhz, start_limit, stop_limit):
+    clipped = np.clip(freq_mhz, start_mhz, stop_mhz)
+    ratio = (np.log10(clipped) - math.log10(start_mhz)) / (math.log10(stop_mhz) - math.log10(start_mhz))
+    return float(start_limit) + ratio * (float(stop_limit) - float(start_limit))
 
 
-def get_emission_limit_info(freq_hz, detector_type="QUASI_PEAK"):
-    """
-    Return screening FCC/CE limit metadata for the current frequency.
-
-    The returned limits are intentionally labelled as screening references:
-    conducted ranges are in dBuV at the receiver input, while radiated ranges
-    are in dBuV/m and require the correction chain to include antenna factor.
-    """
-    freq_mhz = float(freq_hz) / 1e6
+def _normalize_limit_detector(detector_type):
     detector = (detector_type or "QUASI_PEAK").upper()
-
-    if 0.150 <= freq_mhz < 30.0:
-        if freq_mhz < 0.500:
-            fcc_qp = _log_interpolate_limit(freq_mhz, 0.150, 0.500, 66.0, 56.0)
-            fcc_avg = _log_interpolate_limit(freq_mhz, 0.150, 0.500, 56.0, 46.0)
-        elif freq_mhz < 5.0:
-            fcc_qp, fcc_avg = 56.0, 46.0
-        else:
-            fcc_qp, fcc_avg = 60.0, 50.0
-        ce_qp, ce_avg = fcc_qp, fcc_avg
-        fcc_limit, fcc_detector = _select_detector_limit(detector, fcc_qp, average=fcc_avg)
-        ce_limit, ce_detector = _select_detector_limit(detector, ce_qp, average=ce_avg)
-        return {
-            "fcc_limit": fcc_limit,
-            "ce_limit": ce_limit,
-            "fcc_detector": fcc_detector,
-            "ce_detector": ce_detector,
+    if detector in {"AVERAGE", "AVG", "EAV"}:
+        return "AVERAGE"
+    if detector in {"PEAK", "PK", "POSITIVE"}:
+        return "PEAK"
+    return "QUASI_PEAK"
+
+
+# FCC/CE 筛查限值规则表：get_emission_limit_info()（单个频点）和 compile_limit_table()（整条频率轴）都由它求值。
+# 每个频段覆盖 [start_mhz, stop_mhz)，stop_inclusive 时含终点；fcc / ce 为限值分段 (上界 MHz, {检测器: 限值})，
+# 频点取第一个“频率 < 上界”的分段，最后一段延伸到频段终点。限值为 (起点, 终点) 时在分段内按 log10(f) 线性插值。
+# 分段中没有的检测器按准峰值限值处理，检测器标注也记为 QUASI_PEAK。
+_CONDUCTED_LIMIT_SEGMENTS = (
+    (0.500, {"QUASI_PEAK": (66.0, 56.0), "AVERAGE": (56.0, 46.0)}),
+    (5.0, {"QUASI_PEAK": 56.0, "AVERAGE": 46.0}),
+    (30.0, {"QUASI_PEAK": 60.0, "AVERAGE": 50.0}),
+)
+_LIMIT_RULES = (
+    {
+        "band": "conducted",
+        "start_mhz": 0.150,
+        "stop_mhz": 30.0,
+        "stop_inclusive": False,
+        "fcc": _CONDUCTED_LIMIT_SEGMENTS,
+        "ce": _CONDUCTED_LIMIT_SEGMENTS,
+        "info": {
             "unit": "dBuV",
             "measurement_type": "conducted_mains_screening",
             "distance_m": None,
             "fcc_source": "FCC Part 15 Class B conducted mains screening",
             "ce_source": "EN 55032/CISPR 32 Class B conducted mains screening",
-            "note": SCREENING_LIMIT_NOTE,
-        }
-
-    if 30.0 <= freq_mhz < 1000.0:
-        if freq_mhz < 88.0:
-            fcc_limit = 40.0
-        elif freq_mhz < 216.0:
-            fcc_limit = 43.5
-        elif freq_mhz < 960.0:
-            fcc_limit = 46.0
-        else:
-            fcc_limit = 54.0
-        ce_limit = 40.0 if freq_mhz < 230.0 else 47.0
-        return {
-            "fcc_limit": fcc_limit,
-            "ce_limit": ce_limit,
-            "fcc_detector": "QUASI_PEAK",
-            "ce_detector": "QUASI_PEAK",
+        },
+    },
+    {
+        "band": "radiated",
+        "start_mhz": 30.0,
+        "stop_mhz": 1000.0,
+        "stop_inclusive": False,
+        "fcc": (
+            (88.0, {"QUASI_PEAK": 40.0}),
+            (216.0, {"QUASI_PEAK": 43.5}),
+            (960.0, {"QUASI_PEAK": 46.0}),
+            (1000.0, {"QUASI_PEAK": 54.0}),
+        ),
+        "ce": (
+            (230.0, {"QUASI_PEAK": 40.0}),
+            (1000.0, {"QUASI_PEAK": 47.0}),
+        ),
+        "info": {
             "unit": "dBuV/m",
             "measurement_type": "radiated_3m_screening",
             "distance_m": 3.0,
             "fcc_source": "FCC Part 15 Class B radiated 3m screening",
             "ce_source": "EN 55032/CISPR 32 Class B radiated 3m screening",
-            "note": SCREENING_LIMIT_NOTE,
-        }
-
-    if 1000.0 <= freq_mhz <= 18000.0:
-        fcc_limit, fcc_detector = _select_detector_limit(detector, 54.0, average=54.0, peak=74.0)
-        ce_limit, ce_detector = _select_detector_limit(detector, 50.0, average=50.0, peak=70.0)
-        return {
-            "fcc_limit": fcc_limit,
-            "ce_limit": ce_limit,
-            "fcc_detector": fcc_detector,
-            "ce_detector": ce_detector,
+        },
+    },
+    {
+        "band": "radiated_above_1ghz",
+        "start_mhz": 1000.0,
+        "stop_mhz": 18000.0,
+        "stop_inclusive": True,
+        "fcc": ((18000.0, {"QUASI_PEAK": 54.0, "AVERAGE": 54.0, "PEAK": 74.0}),),
+        "ce": ((18000.0, {"QUASI_PEAK": 50.0, "AVERAGE": 50.0, "PEAK": 70.0}),),
+        "info": {
             "unit": "dBuV/m",
             "measurement_type": "radiated_3m_screening_above_1ghz",
             "distance_m": 3.0,
             "fcc_source": "FCC Part 15 Class B radiated above 1GHz screening",
             "ce_source": "EN 55032/CISPR 32 Class B radiated above 1GHz screening",
-            "note": SCREENING_LIMIT_NOTE,
-        }
+        },
+    },
+)
+# 规则表之外的频率：120 dB 占位限值，检测器标注沿用调用方传入的名称
+_OUT_OF_SCOPE_LIMIT = 120.0
+_OUT_OF_SCOPE_LIMIT_INFO = {
+    "unit": "dBuV",
+    "measurement_type": "out_of_screening_scope",
+    "distance_m": None,
+    "fcc_source": "out of configured screening range",
+    "ce_source": "out of configured screening range",
+}
+LIMIT_BANDS = tuple(rule["band"] for rule in _LIMIT_RULES) + ("out_of_scope",)
+
 
+def _limit_level(levels, detector):
+    return levels.get(detector, levels["QUASI_PEAK"])
+
+
+def _limit_band_info(rule, detector_type):
+    """频段元数据（不含限值），检测器标注按规则表换算。"""
+    if rule is None:
+        detector = (detector_type or "QUASI_PEAK").upper()
+        return {"fcc_detector": detector, "ce_detector": detector, **_OUT_OF_SCOPE_LIMIT_INFO, "note": SCREENING_LIMIT_NOTE}
+    detector = _normalize_limit_detector(detector_type)
+    labels = {
+        side: detector if detector in rule[side][0][1] else "QUASI_PEAK"
+        for side in ("fcc", "ce")
+    }
     return {
-        "fcc_limit": 120.0,
-        "ce_limit": 120.0,
-        "fcc_detector": detector,
-        "ce_detector": detector,
-        "unit": "dBuV",
-        "measurement_type": "out_of_screening_scope",
-        "distance_m": None,
-        "fcc_source": "out of configured screening range",
-        "ce_source": "out of configured screening range",
+        "fcc_detector": labels["fcc"],
+        "ce_detector": labels["ce"],
+        **rule["info"],
         "note": SCREENING_LIMIT_NOTE,
     }
 
 
+def _limit_rule_for(freq_mhz):
+    for rule in _LIMIT_RULES:
+        if rule["start_mhz"] <= freq_mhz < rule["stop_mhz"]:
+            return rule
+        if rule["stop_inclusive"] and freq_mhz == rule["stop_mhz"]:
+            return rule
+    return None
+
+
+def _segment_limit(segments, band_start_mhz, freq_mhz, detector):
+    lower = band_start_mhz
+    for upper, levels in segments[:-1]:
+        if freq_mhz < upper:
+            break
+        lower = upper
+    else:
+        upper, levels = segments[-1]
+    level = _limit_level(levels, detector)
+    if isinstance(level, tuple):
+        return _log_interpolate_limit(freq_mhz, lower, upper, *level)
+    return float(level)
+
+
+def _segment_limit_array(segments, band_start_mhz, freq_mhz, detector):
+    choices = []
+    lower = band_start_mhz
+    for upper, levels in segments:
+        level = _limit_level(levels, detector)
+        if isinstance(level, tuple):
+            choices.append(_log_interpolate_limit_array(freq_mhz, lower, upper, *level))
+        else:
+            choices.append(np.full(freq_mhz.shape, float(level)))
+        lower = upper
+    if len(segments) == 1:
+        return choices[0]
+    conditions = [freq_mhz < upper for upper, _levels in segments[:-1]]
+    return np.select(conditions, choices[:-1], default=choices[-1])
+
+
+def get_emission_limit_info(freq_hz, detector_type="QUASI_PEAK"):
+    """
+    Return screening FCC/CE limit metadata for the current frequency.
+
+    The returned limits are intentionally labelled as screening references:
+    conducted ranges are in dBuV at the receiver input, while radiated ranges
+    are in dBuV/m and require the correction chain to include antenna factor.
+    """
+    freq_mhz = float(freq_hz) / 1e6
+    rule = _limit_rule_for(freq_mhz)
+    if rule is None:
+        return {"fcc_limit": _OUT_OF_SCOPE_LIMIT, "ce_limit": _OUT_OF_SCOPE_LIMIT, **_limit_band_info(None, detector_type)}
+    detector = _normalize_limit_detector(detector_type)
+    return {
+        "fcc_limit": _segment_limit(rule["fcc"], rule["start_mhz"], freq_mhz, detector),
+        "ce_limit": _segment_limit(rule["ce"], rule["start_mhz"], freq_mhz, detector),
+        **_limit_band_info(rule, detector_type),
+    }
+
+
+class CompiledLimitTable:
+    """
+    频率轴 + 检测器对应的预编译限值表。
+
+    fcc / ce 为逐点限值数组，band_index 指向 band_info 中的频段元数据，
+    info(i) 返回与 get_emission_limit_info() 相同结构的字典。
+    """
+
+    def __init__(self, frequencies, detector_type, fcc, ce, band_index, band_info):
+        self.frequencies = frequencies
+        self.detector_type = detector_type
+        self.fcc = fcc
+        self.ce = ce
+        self.band_index = band_index
+        self.band_info = band_info
+
+    def __len__(self):
+        return len(self.fcc)
+
+    def info(self, index):
+        info = dict(self.band_info[int(self.band_index[index])])
+        info["fcc_limit"] = float(self.fcc[index])
+        info["ce_limit"] = float(self.ce[index])
+        return info
+
+    def exceeding_indices(self, amplitudes):
+        """返回幅度超过 FCC 或 CE 限值的下标列表。"""
+        amplitudes = np.asarray(amplitudes, dtype=np.float64)
+        return np.flatnonzero((amplitudes > self.fcc) | (amplitudes > self.ce)).tolist()
+
+
+@lru_cache(maxsize=32)
+def _compile_limit_table_cached(frequency_bytes, detector_type):
+    freq_hz = np.frombuffer(frequency_bytes, dtype=np.float64)
+    freq_mhz = freq_hz / 1e6
+    detector = _normalize_limit_detector(detector_type)
+
+    band_index = np.full(freq_mhz.shape, len(_LIMIT_RULES), dtype=np.int8)
+    fcc = np.full(freq_mhz.shape, _OUT_OF_SCOPE_LIMIT)
+    ce = np.full(freq_mhz.shape, _OUT_OF_SCOPE_LIMIT)
+    for index, rule in enumerate(_LIMIT_RULES):
+        inside = freq_mhz >= rule["start_mhz"]
+        inside &= (freq_mhz <= rule["stop_mhz"]) if rule["stop_inclusive"] else (freq_mhz < rule["stop_mhz"])
+        band_mhz = freq_mhz[inside]
+        band_index[inside] = index
+        fcc[inside] = _segment_limit_array(rule["fcc"], rule["start_mhz"], band_mhz, detector)
+        ce[inside] = _segment_limit_array(rule["ce"], rule["start_mhz"], band_mhz, detector)
+    band_info = tuple(_limit_band_info(rule, detector_type) for rule in _LIMIT_RULES + (None,))
+
+    for array in (freq_hz, fcc, ce, band_index):
+        array.flags.writeable = False
+    return CompiledLimitTable(freq_hz, detector_type, fcc, ce, band_index, band_info)
+
+
+def compile_limit_table(frequencies, detector_type="QUASI_PEAK"):
+    """
+    一次向量化计算整条频率轴的 FCC/CE 筛查限值，按 (频率轴, 检测器) LRU 缓存。
+    """
+    freq_array = np.ascontiguousarray(frequencies, dtype=np.float64)
+    detector = (detector_type or "QUASI_PEAK").upper()
+    return _compile_limit_table_cached(freq_array.tobytes(), detector)
+
+
 def collapse_contiguous_indices(indices, amplitudes):
     """Collapse adjacent exceeding bins to the highest-amplitude representative."""
     if not indices:
@@ -278,9 +426,27 @@ class N9918AController:
         }
     }
     
-    def __init__(self, ip_address='192.168.0.124', timeout=10000):
+    # 优先使用 REAL,32 二进制块传输 trace；不支持时按连接回退到 ASCII。
+    TRACE_FORMATS = ("REAL32", "ASCII")
+
+    # PER_SWEEP: 每次 sweep 读取 trace，PC 端计算 PEAK/QP/AVERAGE；
+    # TRACE_HOLD: 仪器连续扫描，TRAC1 Max Hold + TRAC2 电压平均，结束时各读一次。
+    ACQUISITION_MODES = ("PER_SWEEP", "TRACE_HOLD")
+    # BACK_TO_BACK: trace 读完立即触发下一次 sweep；PACED: 按固定间隔采样（旧行为）。
+    SWEEP_SCHEDULES = ("BACK_TO_BACK", "PACED")
+    TRACE_HOLD_MAX_AVERAGE_COUNT = 10000
+
+    # 由 start/stop/points 等设置派生、可缓存的数据及其依赖
+    FREQUENCY_AXIS_SETTINGS = (":SENS:FREQ:STAR", ":SENS:FREQ:STOP", ":SENS:SWE:POIN")
+    SWEEP_TIME_SETTINGS = FREQUENCY_AXIS_SETTINGS + (":SENS:BAND:RES", ":SENS:BAND:VID")
+
+    def __init__(self, ip_address='192.168.0.124', timeout=10000, trace_format="REAL32", scpi_state=None):
         self.ip_address = ip_address
         self.timeout = timeout
+        self.preferred_trace_format = str(trace_format or "ASCII").upper()
+        self.trace_format = "ASCII"
+        self.last_trace_transfer = {}
+        self.trace_transfer_stats = _empty_trace_transfer_stats()
         self.rm = None
         self.device = None
         self.connected = False
@@ -293,19 +459,27 @@ class N9918AController:
         self.amplitude_unit = "DBUV"
         self.sa_corrections = DEFAULT_SA_CORRECTIONS.copy()
         self.last_scpi_errors = []
+        self.last_configure_latency = None
+        # 流水线采集：VISA 线程读到 trace 即触发下一次 sweep，工作线程负责解析与检测器累加。
+        self.pipelined_acquisition = True
+        self.sweep_schedule = "BACK_TO_BACK"
+        self.last_collection_stats = {}
+        # 与 NA 控制器共用同一台仪器时应传入同一个 SCPIShadowState。
+        self.scpi_state = scpi_state if scpi_state is not None else SCPIShadowState()
         
     def connect(self):
         try:
             self.rm = pyvisa.ResourceManager()
-            self.device = self.rm.open_resource(f"TCPIP0::{self.ip_address}::inst0::INSTR")
+            self.device = open_visa_resource(self.rm, self.ip_address)
             self.device.timeout = self.timeout
             
             self.device.write("*CLS")
             device_id = self.device.query("*IDN?")
             print(f"Connected to: {device_id}")
             
-            # 官方示例使用 *OPC? 等待模式切换完成，避免后续配置命令跑在旧模式下。
-            self.device.query("INST:SEL 'SA';*OPC?")
+            self.scpi_state.invalidate("SA connect")
+            self.select_mode()
+            self._select_trace_format()
             
             self.connected = True
             print("Successfully connected to N9918A")
@@ -339,6 +513,34 @@ class N9918AController:
             - self.sa_corrections.get("external_preamp_gain_db", 0.0)
         )
 
+    def select_mode(self):
+        """
+        切换到 SA 模式；影子状态已是 SA 时跳过。
+        官方示例使用 *OPC? 等待模式切换完成，避免后续配置命令跑在旧模式下。
+        """
+        if self.scpi_state.mode == "SA":
+            return False
+        self.device.query("INST:SEL 'SA';*OPC?")
+        self.scpi_state.set_mode("SA")
+        return True
+
+    def _write_setting(self, command, label=None):
+        """
+        写入一条设置命令；影子状态中值未变化时跳过。
+        label 不为空时按可选命令处理：失败只告警且不记录影子状态。
+        """
+        if not self.scpi_state.filter_writes([command]):
+            return False
+        try:
+            self.device.write(command)
+        except Exception as exc:
+            if label is None:
+                raise
+            print(f"[WARN] {label} command failed ({command}): {exc}")
+            return False
+        self.scpi_state.record_write(command)
+        return True
+
     def _write_optional(self, command, label):
         try:
             self.device.write(command)
@@ -359,15 +561,60 @@ class N9918AController:
         self.last_scpi_errors = errors
         if errors:
             print(f"[WARN] SCPI 错误 ({context}): {' | '.join(errors)}")
+            # 出错后无法确定哪些设置生效，影子状态整体作废。
+            self.scpi_state.invalidate(f"SCPI error: {context}")
         return errors
 
+    def _select_trace_format(self):
+        """Negotiate the trace transfer format once per connection."""
+        self.trace_format = "ASCII"
+        if self.preferred_trace_format == "REAL32" and hasattr(self.device, "query_binary_values"):
+            try:
+                self.device.write("FORM:DATA REAL,32")
+                self.device.write("FORM:BORD NORM")
+                if not self._check_scpi_errors("SA REAL,32 trace format"):
+                    self.trace_format = "REAL32"
+                    self.scpi_state.record_write("FORM:DATA REAL,32")
+                    self.scpi_state.record_write("FORM:BORD NORM")
+            except Exception as exc:
+                print(f"[WARN] REAL,32 trace 传输不可用，回退 ASCII: {exc}")
+        if self.trace_format == "ASCII":
+            self._write_setting("FORM:DATA ASC,0", "ASCII trace format")
+        print(f"[FORMAT] SA trace 传输格式: {self.trace_format}")
+        return self.trace_format
+
+    def _apply_trace_format(self):
+        # FORM:DATA 是仪器全局设置，NA 模式可能改过，每次准备 SA trace 时重新下发。
+        if self.trace_format == "REAL32":
+            self._write_setting("FORM:DATA REAL,32")
+        else:
+            self._write_setting("FORM:DATA ASC,0", "ASCII trace format")
+
+    def reset_trace_transfer_stats(self):
+        self.trace_transfer_stats = _empty_trace_transfer_stats()
+
+    def trace_transfer_summary(self):
+        """Per-sample transfer cost of trace reads since the last reset."""
+        stats = self.trace_transfer_stats
+        reads = stats["reads"]
+        return {
+            "format": self.trace_format,
+            "reads": reads,
+            "total_bytes": stats["bytes"],
+            "bytes_per_sample": stats["bytes"] / reads if reads else 0,
+            "transfer_time_per_sample_ms": stats["transfer_time"] / reads * 1000.0 if reads else 0.0,
+            "parse_time_per_sample_ms": stats["parse_time"] / reads * 1000.0 if reads else 0.0,
+        }
+
     def _reset_trace_for_new_sweep(self):
         """Keep trace 1 in Clear/Write so each triggered sweep overwrites history."""
-        self.device.write(":TRAC1:TYPE CLRW")
-        self._write_optional(":TRAC2:TYPE BLAN", "blank trace 2")
-        self._write_optional(":TRAC3:TYPE BLAN", "blank trace 3")
-        self._write_optional(":TRAC4:TYPE BLAN", "blank trace 4")
-        self._write_optional(":INIT:REST", "restart trace averaging")
+        changed = self._write_setting(":TRAC1:TYPE CLRW")
+        changed = self._write_setting(":TRAC2:TYPE BLAN", "blank trace 2") or changed
+        changed = self._write_setting(":TRAC3:TYPE BLAN", "blank trace 3") or changed
+        changed = self._write_setting(":TRAC4:TYPE BLAN", "blank trace 4") or changed
+        # trace 类型未变化时（长时间采样的逐次 sweep）无需重启平均。
+        if changed:
+            self._write_optional(":INIT:REST", "restart trace averaging")
 
     def clear_sa_display_state(self, blank_trace=True):
         """Clear SA status and remove old traces from the FieldFox display."""
@@ -376,14 +623,16 @@ class N9918AController:
             return False
 
         try:
+            # 手动清理时仪器面板可能被改过，先作废影子状态再完整下发。
+            self.scpi_state.invalidate("SA manual clear")
             self.device.write("*CLS")
-            self.device.query("INST:SEL 'SA';*OPC?")
-            self.device.write("INIT:CONT OFF")
-            self.device.write(":SENS:AMPL:UNIT DBUV")
+            self.select_mode()
+            self._write_setting("INIT:CONT OFF")
+            self._write_setting(":SENS:AMPL:UNIT DBUV")
             self.amplitude_unit = "DBUV"
             self._reset_trace_for_new_sweep()
             if blank_trace:
-                self.device.write(":TRAC1:TYPE BLAN")
+                self._write_setting(":TRAC1:TYPE BLAN")
             errors = self._check_scpi_errors("SA manual clear")
             return not errors
         except Exception as e:
@@ -393,14 +642,15 @@ class N9918AController:
     def _prepare_sa_screening_trace(self, clear_status=False):
         if clear_status:
             self.device.write("*CLS")
-        self.device.query("INST:SEL 'SA';*OPC?")
-        self.device.write("INIT:CONT OFF")
-        self.device.write(":SENS:AMPL:UNIT DBUV")
+        self.select_mode()
+        self._write_setting("INIT:CONT OFF")
+        self._write_setting(":SENS:AMPL:UNIT DBUV")
         self.amplitude_unit = "DBUV"
-        self._write_optional(":SENS:BAND:RES:AUTO OFF", "manual RBW")
-        self._write_optional(":SENS:BAND:VID:AUTO OFF", "manual VBW")
-        self.device.write(":SENS:DET POS")
-        self._write_optional(":SENS:AVER:COUN 1", "disable averaging")
+        self._write_setting(":SENS:BAND:RES:AUTO OFF", "manual RBW")
+        self._write_setting(":SENS:BAND:VID:AUTO OFF", "manual VBW")
+        self._write_setting(":SENS:DET POS")
+        self._write_setting(":SENS:AVER:COUN 1", "disable averaging")
+        self._apply_trace_format()
         self._reset_trace_for_new_sweep()
 
     def _query_float(self, command, default=None):
@@ -412,12 +662,60 @@ class N9918AController:
             pass
         return default
 
+    def _write_batch(self, commands):
+        """
+        一条消息下发多条设置命令，末尾 *OPC? 一次同步；仪器不接受拼接时逐条回退。
+        影子状态中未变化的设置不再下发，返回实际下发的命令列表。
+        """
+        pending = self.scpi_state.filter_writes(commands)
+        if not pending:
+            return []
+        try:
+            self.device.query(";".join(pending + ["*OPC?"]))
+            for command in pending:
+                self.scpi_state.record_write(command)
+            return pending
+        except Exception as exc:
+            print(f"[WARN] 批量配置失败，逐条下发: {exc}")
+        for command in pending:
+            try:
+                self.device.write(command)
+                self.scpi_state.record_write(command)
+            except Exception as exc:
+                print(f"[WARN] batched setting command failed ({command}): {exc}")
+        try:
+            self.device.query("*OPC?")
+        except Exception:
+            pass
+        return pending
+
+    def _query_floats(self, commands, defaults):
+        """一次拼接查询多个数值，响应按 ";" 拆分；失败时逐条查询。"""
+        try:
+            parts = str(self.device.query(";".join(commands))).strip().split(";")
+            if len(parts) == len(commands):
+                values = []
+                for part, default in zip(parts, defaults):
+                    try:
+                        value = float(part.strip())
+                    except ValueError:
+                        value = default
+                    values.append(value if value is not None and math.isfinite(value) else default)
+                return values
+        except Exception:
+            pass
+        return [self._query_float(command, default) for command, default in zip(commands, defaults)]
+
     def _refresh_actual_sa_settings(self):
-        start_freq = self._query_float(":SENS:FREQ:STAR?", self.start_freq)
-        stop_freq = self._query_float(":SENS:FREQ:STOP?", self.stop_freq)
-        n_points = self._query_float(":SENS:SWE:POIN?", self.n_points)
-        rbw = self._query_float(":SENS:BAND:RES?", self.rbw)
-        vbw = self._query_float(":SENS:BAND:VID?", self.vbw)
+        readback = [":SENS:FREQ:STAR?", ":SENS:FREQ:STOP?", ":SENS:SWE:POIN?", ":SENS:BAND:RES?", ":SENS:BAND:VID?"]
+        values = self._query_floats(
+            readback,
+            [self.start_freq, self.stop_freq, self.n_points, self.rbw, self.vbw],
+        )
+        for command, value in zip(readback, values):
+            if value is not None:
+                self.scpi_state.record(command, repr(float(value)))
+        start_freq, stop_freq, n_points, rbw, vbw = values
         if start_freq and stop_freq and stop_freq > start_freq:
             self.start_freq = start_freq
             self.stop_freq = stop_freq
@@ -429,9 +727,12 @@ class N9918AController:
             self.vbw = vbw
 
     def _estimate_sweep_time(self):
+        sweep_time = self.scpi_state.get_derived("SA_SWEEP_TIME")
+        if sweep_time:
+            return sweep_time
         sweep_time = self._query_float(":SENS:SWE:TIME?", None)
         if sweep_time and sweep_time > 0:
-            return sweep_time
+            return self.scpi_state.cache_derived("SA_SWEEP_TIME", self.SWEEP_TIME_SETTINGS, sweep_time)
         if self.start_freq and self.stop_freq:
             return max(0.5, (self.stop_freq - self.start_freq) / 1e9 * 3.0)
         return 1.0
@@ -439,33 +740,114 @@ class N9918AController:
     def _parse_numeric_csv(self, data):
         return [float(item.strip()) for item in str(data).replace("\n", "").split(",") if item.strip()]
 
+    def _fetch_trace_raw(self, command):
+        """
+        只做 VISA 传输：REAL,32 返回 query_binary_values 的数组，ASCII 返回原始字符串。
+
+        流水线采集时在 VISA 线程调用，解析交给 _parse_trace_raw() 在工作线程完成。
+        """
+        start = time.perf_counter()
+        if self.trace_format == "REAL32":
+            raw = self.device.query_binary_values(
+                command,
+                datatype="f",
+                is_big_endian=True,
+                container=np.array,
+            )
+            payload_bytes = len(raw) * 4
+            # IEEE 488.2 定长块: "#" + 长度位数 + 长度 + 数据 + 结束符。
+            n_bytes = payload_bytes + len(str(payload_bytes)) + 3
+        else:
+            self.device.write(command)
+            raw = self.device.read()
+            n_bytes = len(str(raw))
+        transfer_time = time.perf_counter() - start
+
+        stats = self.trace_transfer_stats
+        stats["reads"] += 1
+        stats["bytes"] += n_bytes
+        stats["transfer_time"] += transfer_time
+        return {
+            "format": self.trace_format,
+            "command": command,
+            "raw": raw,
+            "bytes": n_bytes,
+            "transfer_time": transfer_time,
+        }
+
+    def _parse_trace_raw(self, fetched):
+        """把 _fetch_trace_raw() 的结果解析为 float32 数组（REAL,32）或 float 列表（ASCII）。"""
+        start = time.perf_counter()
+        if fetched["format"] == "REAL32":
+            values = np.asarray(fetched["raw"], dtype=np.float32)
+        else:
+            values = self._parse_numeric_csv(fetched["raw"])
+        parse_time = time.perf_counter() - start
+
+        self.last_trace_transfer = {
+            "format": fetched["format"],
+            "command": fetched["command"],
+            "points": len(values),
+            "bytes": fetched["bytes"],
+            "transfer_time": fetched["transfer_time"],
+            "parse_time": parse_time,
+        }
+        self.trace_transfer_stats["parse_time"] += parse_time
+        return values
+
+    def _query_trace_values(self, command):
+        """
+        Read one trace query: REAL,32 IEEE block -> float32 array, ASCII -> float list.
+
+        Bytes, transfer time and parse time of every read are kept in
+        last_trace_transfer and accumulated into trace_transfer_stats.
+        """
+        return self._parse_trace_raw(self._fetch_trace_raw(command))
+
     def _build_frequency_axis(self):
-        try:
-            x_values = self._parse_numeric_csv(self.device.query(":TRAC1:XVAL?"))
-            if self.n_points and len(x_values) == self.n_points:
-                return x_values
-        except Exception:
-            pass
-        if not self.start_freq or not self.stop_freq or not self.n_points or self.n_points < 2:
-            raise ValueError("SA 频率轴参数不完整，请先配置 start/stop/points。")
-        freq_step = (self.stop_freq - self.start_freq) / (self.n_points - 1)
-        return [self.start_freq + i * freq_step for i in range(self.n_points)]
-
-    def _read_trace_amplitudes_dbuv(self):
-        self.device.write(":TRAC1:DATA?")
-        trace_data = self.device.read()
-        amplitudes = self._parse_numeric_csv(trace_data)
+        """频率轴按 start/stop/points 缓存在影子状态中，设置变化或作废前不再重复查询。"""
+        axis_key = (self.start_freq, self.stop_freq, self.n_points)
+        cached = self.scpi_state.get_derived("SA_FREQUENCY_AXIS")
+        if cached is not None and cached[0] == axis_key:
+            return cached[1]
+
+        frequencies = None
+        # REAL,32 会截断 GHz 频点精度；二进制模式下直接用回读的 start/stop/points 生成线性频率轴。
+        if self.trace_format == "ASCII":
+            try:
+                x_values = self._parse_numeric_csv(self.device.query(":TRAC1:XVAL?"))
+                if self.n_points and len(x_values) == self.n_points:
+                    frequencies = x_values
+            except Exception:
+                pass
+        if frequencies is None:
+            if not self.start_freq or not self.stop_freq or not self.n_points or self.n_points < 2:
+                raise ValueError("SA 频率轴参数不完整，请先配置 start/stop/points。")
+            freq_step = (self.stop_freq - self.start_freq) / (self.n_points - 1)
+            frequencies = [self.start_freq + i * freq_step for i in range(self.n_points)]
+        self.scpi_state.cache_derived("SA_FREQUENCY_AXIS", self.FREQUENCY_AXIS_SETTINGS, (axis_key, frequencies))
+        return frequencies
+
+    def _read_trace_amplitudes_dbuv(self, trace=1):
+        return self._correct_trace_amplitudes(self._query_trace_values(f":TRAC{int(trace)}:DATA?"))
+
+    def _correct_trace_amplitudes(self, amplitudes):
+        """检查点数并叠加修正量（线损/天线因子/开关损耗/前放）。"""
         if self.n_points and len(amplitudes) != self.n_points:
             raise ValueError(f"SA trace 点数不匹配：期望 {self.n_points}，实际 {len(amplitudes)}。")
         correction_total = self.correction_total_db()
         if correction_total:
-            amplitudes = [value + correction_total for value in amplitudes]
+            if isinstance(amplitudes, np.ndarray):
+                amplitudes += np.float32(correction_total)
+            else:
+                amplitudes = [value + correction_total for value in amplitudes]
         return amplitudes
 
-    def acquire_single_trace(self, reset_trace=True):
+    def _trigger_sweep(self, reset_trace=True):
+        """触发一次完整单次 sweep，并用 *OPC? 等待结束。"""
         if reset_trace:
             self._reset_trace_for_new_sweep()
-        self.device.write("INIT:CONT OFF")
+        self._write_setting("INIT:CONT OFF")
         try:
             self.device.query(":INIT:IMM;*OPC?")
         except Exception:
@@ -473,6 +855,9 @@ class N9918AController:
             wait_time = max(self._estimate_sweep_time() * 1.2, 1.0)
             print(f"[WAIT] 等待扫描完成 ({wait_time:.1f}秒)...")
             time.sleep(wait_time)
+
+    def acquire_single_trace(self, reset_trace=True):
+        self._trigger_sweep(reset_trace=reset_trace)
         frequencies = self._build_frequency_axis()
         amplitudes = self._read_trace_amplitudes_dbuv()
         return frequencies, amplitudes
@@ -512,42 +897,30 @@ class N9918AController:
             
         try:
             print(f"[CONFIG] 配置设备参数: {config_name}")
+            configure_start = time.perf_counter()
             self._prepare_sa_screening_trace(clear_status=True)
             
-            # Set frequency range
-            self.device.write(f":SENS:FREQ:STAR {start_freq}")
-            time.sleep(0.2)
-            self.device.write(f":SENS:FREQ:STOP {stop_freq}")
-            time.sleep(0.2)
+            # 可选设置（部分固件/选件不支持）单独下发，失败只告警，不能拖垮必需设置的批量消息。
+            changed = self._write_setting(":SENS:BAND:RES:AUTO OFF", "manual RBW")
+            changed = self._write_setting(":SENS:BAND:VID:AUTO OFF", "manual VBW") or changed
+            # 必需的 SENS 设置拼成一条消息，末尾 *OPC? 等待仪器处理完成，不再固定 sleep；
+            # 与影子状态相同的设置（重复应用同一配置）不会再次下发。
+            # Positive detector is the safer screening prescan choice for narrow peaks.
+            changed = bool(self._write_batch([
+                f":SENS:FREQ:STAR {start_freq}",
+                f":SENS:FREQ:STOP {stop_freq}",
+                f":SENS:SWE:POIN {n_points}",
+                f":SENS:BAND:RES {rbw}",
+                f":SENS:BAND:VID {vbw}",
+                ":SENS:DET POS",
+                ":SENS:POW:ATT 0",
+            ])) or changed
+            changed = self._write_setting(":SENS:POW:GAIN:STAT ON", "internal preamp") or changed
             print(f"[FREQ] 频率范围: {start_freq/1e6:.3f}MHz - {stop_freq/1e9:.3f}GHz")
-            
-            # Set number of points
-            self.device.write(f":SENS:SWE:POIN {n_points}")
-            time.sleep(0.2)
             print(f"[POINTS] 采样点数: {n_points}")
-            
-            # Set RBW and VBW
-            self._write_optional(":SENS:BAND:RES:AUTO OFF", "manual RBW")
-            self.device.write(f":SENS:BAND:RES {rbw}")
-            time.sleep(0.5)
-            self._write_optional(":SENS:BAND:VID:AUTO OFF", "manual VBW")
-            self.device.write(f":SENS:BAND:VID {vbw}")
-            time.sleep(0.5)
             print(f"[BAND]  RBW: {rbw}Hz, VBW: {vbw}Hz")
-            
-            # Positive detector is the safer screening prescan choice for narrow peaks.
-            self.device.write(":SENS:DET POS")
-            time.sleep(0.2)
             print("[DETECTOR] Detector: Positive Peak")
-            
-            # Set Internal Amplifier ON
-            self.device.write(":SENS:POW:GAIN:STAT ON")
-            time.sleep(0.2)
             print("[GAIN] 内部放大器: ON")
-            
-            # Set Internal Attenuator to 0dB
-            self.device.write(":SENS:POW:ATT 0")
-            time.sleep(0.2)
             print("[ATT] 内部衰减器: 0dB")
             
             # Store parameters
@@ -559,10 +932,14 @@ class N9918AController:
             self.current_config = config_name
             self.amplitude_unit = "DBUV"
             self._reset_trace_for_new_sweep()
-            self._refresh_actual_sa_settings()
+            if changed:
+                self._refresh_actual_sa_settings()
+            else:
+                print("[CONFIG] 仪器设置未变化，跳过下发与回读")
             self._check_scpi_errors("SA configure")
+            self.last_configure_latency = time.perf_counter() - configure_start
             
-            print("[OK] 参数配置完成! (连续扫描已暂停)")
+            print(f"[OK] 参数配置完成! (连续扫描已暂停，用时 {self.last_configure_latency * 1000:.0f} ms)")
             return True
             
         except Exception as e:
@@ -580,6 +957,8 @@ class N9918AController:
         try:
             self._prepare_sa_screening_trace(clear_status=True)
             frequencies, amplitudes_dBuv = self.acquire_single_trace(reset_trace=True)
+            if isinstance(amplitudes_dBuv, np.ndarray):
+                amplitudes_dBuv = amplitudes_dBuv.tolist()
             self._check_scpi_errors("SA single trace")
             return frequencies, amplitudes_dBuv
             
@@ -608,47 +987,83 @@ class N9918AController:
             "rbw": self.rbw,
             "vbw": self.vbw,
             "amplitude_unit": self.amplitude_unit,
+            "trace_format": self.trace_format,
             "sa_corrections": self.sa_corrections.copy(),
             "last_scpi_errors": list(self.last_scpi_errors),
+            "configure_latency_s": self.last_configure_latency,
+            "scpi_shadow": self.scpi_state.summary(),
         }
 
 
     
-    def get_emc_measurement_fast(self, duration_seconds=15, should_stop=None):
+    def get_emc_measurement_fast(self, duration_seconds=15, should_stop=None, keep_samples=True, acquisition_mode="PER_SWEEP", capture_to_disk=False):
         """
         快速EMC测量（采集时间序列数据，PC端计算多种模式）
+
+        检测器在采集循环中在线累加，停止即可得到结果；keep_samples=False 时
+        不保留原始采样，内存只与频点数相关。acquisition_mode="TRACE_HOLD" 时
+        改用仪器端 Max Hold / Average，只得到 PEAK 和 AVERAGE。
+        capture_to_disk=True（或传入目录路径）时，每次 sweep 写入
+        measurement_data/ 下的 EMCDiskSampleStore，适合多小时监测，
+        中断后可用 load_emc_capture() 重新打开。
         """
         if not self.connected:
             print("ERROR: Device not connected")
             return {}
+
+        acquisition_mode = str(acquisition_mode or "PER_SWEEP").upper()
+        if acquisition_mode not in self.ACQUISITION_MODES:
+            print(f"ERROR: Unknown acquisition mode '{acquisition_mode}'")
+            return {}
+        if acquisition_mode == "TRACE_HOLD":
+            return self.get_emc_trace_hold_measurement(duration_seconds, should_stop=should_stop)
         
         total_start_time = time.time()
         print(f"[RUN] 开始快速EMC测量 ({duration_seconds} 秒)")
         print("=" * 50)
         
         try:
-            # 1. 收集时间序列数据
-            time_series_data = self.collect_emc_time_series(duration_seconds, should_stop=should_stop)
+            # 1. 收集时间序列数据，同时在线累加检测器
+            accumulator = EMCDetectorAccumulator()
+            sample_store = None
+            if capture_to_disk:
+                sample_store = self._create_capture_store(capture_to_disk, duration_seconds)
+                print(f"   [SAVE] 磁盘采集目录: {sample_store.path}")
+            try:
+                time_series_data = self.collect_emc_time_series(
+                    duration_seconds,
+                    should_stop=should_stop,
+                    accumulator=accumulator,
+                    keep_samples=keep_samples,
+                    sample_store=sample_store,
+                )
+            finally:
+                if sample_store is not None:
+                    sample_store.close()
             
-            if not time_series_data:
+            if accumulator.sample_count == 0:
                 print("[ERROR] 未能收集到时间序列数据")
                 return {}
             
             collection_time = time.time() - total_start_time
             print(f"   [TIME]  数据采集用时: {collection_time:.1f} 秒")
-            print(f"   [DATA]  实际采样次数: {len(time_series_data)}")
+            print(f"   [DATA]  实际采样次数: {accumulator.sample_count}")
             
-            # 2. PC端计算多种检测器模式
+            # 2. 读取在线检测器结果
             print(f"\n[CALC] PC端计算EMC检测器模式...")
             calculation_start_time = time.time()
             
-            results = {}
-            detector_modes = ["PEAK", "QUASI_PEAK", "AVERAGE"]
+            detector_modes = list(EMC_DETECTOR_MODES)
+            results = accumulator.results(detector_modes)
+            quasi_peak_source = "streaming"
+            if (keep_samples or sample_store is not None) and len(time_series_data) > 1:
+                # 在线 QP 的下限用运行平均，保留了采样时按全程平均重算，与 calculate_emc_detectors() 一致
+                results["QUASI_PEAK"] = calculate_emc_detectors(time_series_data, ("QUASI_PEAK",))["QUASI_PEAK"]
+                quasi_peak_source = "samples"
             
             for mode in detector_modes:
-                frequencies, amplitudes = calculate_emc_detector_modes(time_series_data, mode)
+                frequencies, amplitudes = results.get(mode, (None, None))
                 if frequencies is not None and amplitudes is not None:
-                    results[mode] = (frequencies, amplitudes)
                     print(f"   [OK] {mode} 模式计算完成")
                     if amplitudes:
                         max_val = max(amplitudes)
@@ -662,34 +1077,42 @@ class N9918AController:
             total_time = time.time() - total_start_time
             
             # 添加采样数据（用于保存）
-            results["sampling_data"] = time_series_data
+            if keep_samples or sample_store is not None:
+                results["sampling_data"] = time_series_data
             
             # 添加采样信息
             results["sampling_info"] = {
-                "total_samples": len(time_series_data),
+                "total_samples": accumulator.sample_count,
                 "sample_duration": duration_seconds,
                 "collection_time": collection_time,
                 "calculation_time": calculation_time,
-                "data_points": len(time_series_data[0]['amplitudes']) if time_series_data else 0,
+                "data_points": accumulator.n_points,
                 "rbw": self.rbw if self.rbw else 100e3,
-                "start_time": time_series_data[0]['timestamp'] if time_series_data else 0,
-                "end_time": time_series_data[-1]['timestamp'] if time_series_data else 0,
+                "start_time": accumulator.first_timestamp,
+                "end_time": accumulator.last_timestamp,
+                "samples_kept": bool(keep_samples),
+                "quasi_peak_source": quasi_peak_source,
+                "acquisition_mode": "PER_SWEEP",
+                "collection": dict(self.last_collection_stats),
                 "amplitude_unit": self.amplitude_unit,
                 "corrections": self.sa_corrections.copy(),
                 "correction_total_db": self.correction_total_db(),
                 "screening_mode": True,
+                "trace_transfer": self.trace_transfer_summary(),
+                "capture_path": sample_store.path if sample_store is not None else None,
             }
             
             # 添加测量摘要
             results["measurement_summary"] = {
                 "total_duration": total_time,
                 "actual_measurement_time": duration_seconds,
-                "data_points": len(time_series_data[0]['amplitudes']) if time_series_data else 0,
-                "total_samples": len(time_series_data),
+                "data_points": accumulator.n_points,
+                "total_samples": accumulator.sample_count,
                 "modes_computed": detector_modes,
                 "measurement_time": time.strftime("%Y-%m-%d %H:%M:%S"),
                 "screening_mode": True,
                 "quasi_peak_estimated": True,
+                "acquisition_mode": "PER_SWEEP",
                 "limit_note": SCREENING_LIMIT_NOTE,
             }
             results["detector_notes"] = {
@@ -709,76 +1132,282 @@ class N9918AController:
             traceback.print_exc()
             return {}
 
-    def collect_emc_time_series(self, duration_seconds=15, should_stop=None):
+    def _create_capture_store(self, capture_to_disk, duration_seconds):
+        metadata = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "requested_duration_s": duration_seconds,
+            "config": self.current_config,
+            "start_freq": self.start_freq,
+            "stop_freq": self.stop_freq,
+            "rbw": self.rbw,
+            "vbw": self.vbw,
+            "amplitude_unit": self.amplitude_unit,
+            "corrections": self.sa_corrections.copy(),
+        }
+        if isinstance(capture_to_disk, (str, os.PathLike)):
+            return EMCDiskSampleStore(capture_to_disk, metadata=metadata, create=True)
+        # 目录名只精确到秒，同一秒内的多次采集加序号后缀，避免互相覆盖
+        base_path = os.path.join(
+            "measurement_data", f"emi_capture_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        )
+        suffix = 0
+        while True:
+            capture_path = base_path if suffix == 0 else f"{base_path}_{suffix}"
+            try:
+                return EMCDiskSampleStore(capture_path, metadata=metadata, create=True)
+            except FileExistsError:
+                suffix += 1
+
+    def _prepare_trace_hold(self, average_count):
+        """TRAC1 Max Hold、TRAC2 电压域平均，重启平均后开始连续扫描。"""
+        self._prepare_sa_screening_trace(clear_status=True)
+        self._write_setting(":TRAC1:TYPE MAXH")
+        self._write_setting(":TRAC2:TYPE AVG")
+        self._write_setting(":SENS:AVER:TYPE VOLT", "voltage averaging")
+        self._write_setting(f":SENS:AVER:COUN {int(average_count)}", "trace average count")
+        self._write_optional(":INIT:REST", "restart trace hold")
+        self._write_setting("INIT:CONT ON")
+
+    def get_emc_trace_hold_measurement(self, duration_seconds=15, should_stop=None):
+        """
+        仪器端 Max Hold / Average 采集：连续扫描 duration_seconds 秒，结束后
+        TRAC1（PEAK）与 TRAC2（AVERAGE）各读取一次，省去逐次 sweep 的传输。
+        不提供 QUASI_PEAK，需要 QP 估算请用 PER_SWEEP 模式。
+        """
+        if not self.connected:
+            print("ERROR: Device not connected")
+            return {}
+
+        total_start_time = time.time()
+        print(f"[RUN] 开始仪器端 Max Hold / Average 采集 ({duration_seconds} 秒)")
+        original_timeout = self.device.timeout
+        try:
+            self.reset_trace_transfer_stats()
+            sweep_time = self._estimate_sweep_time()
+            average_count = min(
+                self.TRACE_HOLD_MAX_AVERAGE_COUNT,
+                max(1, int(math.ceil(duration_seconds / max(sweep_time, 1e-3)))),
+            )
+            self.device.timeout = max(original_timeout or 0, int((sweep_time + 10.0) * 1000))
+            print(f"   [TIME]  仪器 sweep time: {sweep_time:.3f}s, 平均次数上限: {average_count}")
+            self._prepare_trace_hold(average_count)
+
+            start_time = time.time()
+            while time.time() - start_time < duration_seconds:
+                if should_stop and should_stop():
+                    print("   [STOP]  用户请求停止采样")
+                    break
+                time.sleep(min(0.5, max(0.0, duration_seconds - (time.time() - start_time))))
+            hold_duration = time.time() - start_time
+
+            # 停在完整 sweep 上再读 trace。
+            self._write_setting("INIT:CONT OFF")
+            try:
+                self.device.query("*OPC?")
+            except Exception:
+                time.sleep(max(sweep_time, 0.2))
+            errors = self._check_scpi_errors("SA trace hold")
+
+            collection_time = time.time() - total_start_time
+            calculation_start_time = time.time()
+            frequencies = self._build_frequency_axis()
+            peak = self._read_trace_amplitudes_dbuv(trace=1)
+            average = self._read_trace_amplitudes_dbuv(trace=2)
+            peak = [float(value) for value in peak]
+            average = [float(value) for value in average]
+            calculation_time = time.time() - calculation_start_time
+            total_time = time.time() - total_start_time
+            estimated_sweeps = max(1, int(hold_duration / sweep_time)) if sweep_time > 0 else 1
+            print(f"[OK] Max Hold / Average 采集完成，约 {estimated_sweeps} 次 sweep，用时 {total_time:.1f} 秒")
+        except Exception as e:
+            print(f"ERROR: 仪器端 Max Hold / Average 采集失败 - {e}")
+            self.scpi_state.invalidate("SA trace hold error")
+            self._write_optional("INIT:CONT OFF", "stop continuous sweep")
+            return {}
+        finally:
+            self.device.timeout = original_timeout
+
+        n_points = len(peak)
+        return {
+            "PEAK": (frequencies, peak),
+            "AVERAGE": (frequencies, average),
+            "sampling_info": {
+                "total_samples": estimated_sweeps,
+                "sample_duration": duration_seconds,
+                "collection_time": collection_time,
+                "calculation_time": calculation_time,
+                "data_points": n_points,
+                "rbw": self.rbw if self.rbw else 100e3,
+                "start_time": 0.0,
+                "end_time": hold_duration,
+                "amplitude_unit": self.amplitude_unit,
+                "corrections": self.sa_corrections.copy(),
+                "correction_total_db": self.correction_total_db(),
+                "screening_mode": True,
+                "samples_kept": False,
+                "acquisition_mode": "TRACE_HOLD",
+                "estimated_sweeps": estimated_sweeps,
+                "average_count": average_count,
+                "scpi_errors": errors,
+                "trace_transfer": self.trace_transfer_summary(),
+            },
+            "measurement_summary": {
+                "total_duration": total_time,
+                "actual_measurement_time": hold_duration,
+                "data_points": n_points,
+                "total_samples": estimated_sweeps,
+                "modes_computed": ["PEAK", "AVERAGE"],
+                "measurement_time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "screening_mode": True,
+                "quasi_peak_estimated": False,
+                "acquisition_mode": "TRACE_HOLD",
+                "limit_note": SCREENING_LIMIT_NOTE,
+            },
+            "detector_notes": {
+                "PEAK": "FieldFox trace 1 Max Hold over continuous positive-peak sweeps.",
+                "AVERAGE": "FieldFox trace 2 voltage-domain trace average; screening only.",
+            },
+        }
+
+    def collect_emc_time_series(self, duration_seconds=15, should_stop=None, accumulator=None, keep_samples=True, pipelined=None, schedule=None, sample_store=None):
         """
         稳定版时间序列数据采集 - 每个样本均等待完整单次 sweep。
+
+        accumulator（EMCDetectorAccumulator）会在每次 sweep 后更新；
+        keep_samples=True 时原始采样保存在 EMCSampleStore（float32，共享频率轴）中返回，
+        keep_samples=False 时不保存原始采样，返回空列表。
+        sample_store 不为 None 时（如 EMCDiskSampleStore）采样写入该存储并返回它。
+        pipelined=True（默认取 self.pipelined_acquisition）时，测量线程只负责
+        触发 sweep 和读取原始 trace，解析、修正和检测器更新在工作线程进行，
+        与下一次 sweep 重叠。
+        schedule（默认取 self.sweep_schedule）：
+          BACK_TO_BACK - 上一次 trace 读完立即触发下一次 sweep，采样次数是结果而非上限；
+          PACED        - 旧行为，按 max(sweep_time*1.05, 0.25)s 间隔采样并限制最大采样次数。
+        样本 timestamp 为 sweep 结束（*OPC? 返回）时刻，基于单调时钟，相对采集开始；
+        同时记录 sweep_start / sweep_end，供 QP 检测器使用真实 dt。
         """
         if not self.connected:
             print("ERROR: Device not connected")
             return []
+        if pipelined is None:
+            pipelined = self.pipelined_acquisition
+        schedule = str(schedule or self.sweep_schedule).upper()
+        if schedule not in self.SWEEP_SCHEDULES:
+            print(f"ERROR: Unknown sweep schedule '{schedule}'")
+            return []
+        paced = schedule == "PACED"
         
-        print(f"[LOOP] 开始时间序列数据采集 ({duration_seconds} 秒)")
+        print(f"[LOOP] 开始时间序列数据采集 ({duration_seconds} 秒, {'流水线' if pipelined else '串行'}, {schedule})")
         original_timeout = self.device.timeout
+        raw_queue = None
+        worker = None
         try:
             self._prepare_sa_screening_trace(clear_status=True)
+            self.reset_trace_transfer_stats()
             sweep_time = self._estimate_sweep_time()
-            sample_interval = max(sweep_time * 1.05, 0.25)
-            max_samples = max(1, int(duration_seconds / sample_interval))
+            sample_interval = max(sweep_time * 1.05, 0.25) if paced else 0.0
+            max_samples = max(1, int(duration_seconds / max(sweep_time * 1.05, 0.25)))
             self.device.timeout = max(original_timeout or 0, int((sweep_time + 10.0) * 1000))
             print(f"   [TIME]  仪器 sweep time: {sweep_time:.3f}s")
-            print(f"   [TIME]  采样间隔: {sample_interval:.3f}s, 目标采样次数: {max_samples}")
-
-            time_series_data = []
-            start_time = time.time()
+            if paced:
+                print(f"   [TIME]  采样间隔: {sample_interval:.3f}s, 目标采样次数: {max_samples}")
+            else:
+                print(f"   [TIME]  连续 sweep，预计采样次数: ~{max_samples}")
+
+            if sample_store is not None:
+                time_series_data = sample_store
+                keep_samples = True
+            else:
+                time_series_data = EMCSampleStore() if keep_samples else []
+            start_time = time.monotonic()
             sample_count = 0
             last_successful_time = start_time
+            last_progress_time = start_time
+            sweep_busy_time = 0.0
             consecutive_failures = 0
             max_consecutive_failures = 3
+            pipeline_errors = []
+            max_queue_depth = 0
+
+            def store_sample(timing, frequencies, amplitudes):
+                timestamp, sweep_start, sweep_end = timing
+                if accumulator is not None:
+                    accumulator.update(timestamp, amplitudes, frequencies)
+                if keep_samples:
+                    time_series_data.append(
+                        timestamp, amplitudes, frequencies, sweep_start=sweep_start, sweep_end=sweep_end
+                    )
+
+            if pipelined:
+                raw_queue = queue.Queue()
+
+                def process_raw_samples():
+                    while True:
+                        item = raw_queue.get()
+                        if item is None:
+                            break
+                        timing, frequencies, fetched = item
+                        try:
+                            amplitudes = self._correct_trace_amplitudes(self._parse_trace_raw(fetched))
+                            store_sample(timing, frequencies, amplitudes)
+                        except Exception as exc:
+                            pipeline_errors.append(str(exc))
+                            print(f"   [WARN]  trace 解析失败，丢弃本次采样: {exc}")
+
+                worker = threading.Thread(target=process_raw_samples, name="sa-trace-parser", daemon=True)
+                worker.start()
             
-            while time.time() - start_time < duration_seconds and sample_count < max_samples:
+            while time.monotonic() - start_time < duration_seconds and (not paced or sample_count < max_samples):
                 if should_stop and should_stop():
                     print("   [STOP]  用户请求停止采样")
                     break
 
-                sample_start_time = time.time()
+                sweep_start = time.monotonic()
                 try:
-                    frequencies, amplitudes = self.acquire_single_trace(reset_trace=True)
-                    read_duration = time.time() - sample_start_time
+                    self._trigger_sweep(reset_trace=True)
+                    sweep_end = time.monotonic()
+                    frequencies = self._build_frequency_axis()
+                    fetched = self._fetch_trace_raw(":TRAC1:DATA?")
+                    current_time = time.monotonic()
+                    read_duration = current_time - sweep_start
                     if read_duration > max(sweep_time * 3, 8.0):
                         print(f"   [WARN]  单次 sweep+读取耗时异常: {read_duration:.2f}s")
 
                     sample_count += 1
-                    current_time = time.time()
-                    time_series_data.append(
-                        {
-                            'timestamp': current_time - start_time,
-                            'frequencies': frequencies,
-                            'amplitudes': amplitudes,
-                        }
-                    )
+                    sweep_busy_time += sweep_end - sweep_start
+                    timing = (sweep_end - start_time, sweep_start - start_time, sweep_end - start_time)
+                    if pipelined:
+                        raw_queue.put((timing, frequencies, fetched))
+                        max_queue_depth = max(max_queue_depth, raw_queue.qsize())
+                    else:
+                        amplitudes = self._correct_trace_amplitudes(self._parse_trace_raw(fetched))
+                        store_sample(timing, frequencies, amplitudes)
                     consecutive_failures = 0
                     last_successful_time = current_time
 
-                    progress = (sample_count / max_samples) * 100
-                    if sample_count % 5 == 0 or sample_count <= 10:
+                    if sample_count <= 10 or current_time - last_progress_time >= 1.0:
+                        last_progress_time = current_time
                         elapsed = current_time - start_time
                         remaining = max(0.0, duration_seconds - elapsed)
+                        target = f"/{max_samples}" if paced else ""
                         print(
-                            f"   [DATA] 采样 #{sample_count}/{max_samples} ({progress:.1f}%) "
+                            f"   [DATA] 采样 #{sample_count}{target} "
                             f"已用时: {elapsed:.1f}s, 剩余: {remaining:.1f}s"
                         )
 
-                    next_sample_time = sample_start_time + sample_interval
-                    sleep_time = max(0.0, next_sample_time - time.time())
-                    while sleep_time > 0:
-                        if should_stop and should_stop():
-                            break
-                        time.sleep(min(sleep_time, 0.5))
-                        sleep_time = max(0.0, next_sample_time - time.time())
+                    if paced:
+                        next_sample_time = sweep_start + sample_interval
+                        sleep_time = max(0.0, next_sample_time - time.monotonic())
+                        while sleep_time > 0:
+                            if should_stop and should_stop():
+                                break
+                            time.sleep(min(sleep_time, 0.5))
+                            sleep_time = max(0.0, next_sample_time - time.monotonic())
 
                 except pyvisa.errors.VisaIOError as e:
                     consecutive_failures += 1
                     print(f"   [WARN]  VISA通信错误 (第{consecutive_failures}次): {e}")
+                    self.scpi_state.invalidate("SA sampling VISA error")
                     self._check_scpi_errors("SA sampling VISA error")
                     if consecutive_failures >= max_consecutive_failures:
                         print(f"   [ERROR] 连续通信失败{consecutive_failures}次，停止采样")
@@ -795,7 +1424,7 @@ class N9918AController:
                     time.sleep(0.5)
                 
                 # 检查是否长时间无响应
-                if time.time() - last_successful_time > max(30.0, sweep_time * 5):
+                if time.monotonic() - last_successful_time > max(30.0, sweep_time * 5):
                     print(f"   [ERROR] 设备长时间无响应，停止采样")
                     break
             
@@ -806,13 +1435,39 @@ class N9918AController:
                 self.device.timeout = original_timeout  # 恢复原始超时
             except:
                 print("   [WARN]  停止扫描时出现异常")
+
+            if worker is not None:
+                raw_queue.put(None)
+                worker.join()
             
-            print(f"[OK] 时间序列采集完成! 总采样: {len(time_series_data)} 次")
+            print(f"[OK] 时间序列采集完成! 总采样: {sample_count} 次")
+            actual_duration = last_successful_time - start_time
+            self.last_collection_stats = {
+                "pipelined": bool(pipelined),
+                "schedule": schedule,
+                "sweeps": sample_count,
+                "duration": actual_duration,
+                "sweeps_per_second": sample_count / actual_duration if actual_duration > 0 else 0.0,
+                "sample_interval": sample_interval,
+                "paced_sample_limit": max_samples,
+                "sweep_duty_cycle": sweep_busy_time / actual_duration if actual_duration > 0 else 0.0,
+                "max_queue_depth": max_queue_depth,
+                "dropped_samples": len(pipeline_errors),
+            }
             
-            if time_series_data:
-                actual_duration = time_series_data[-1]['timestamp']
+            if sample_count:
                 print(f"   [DATA] 实际采样时长: {actual_duration:.1f}s")
-                print(f"   [DATA] 平均采样间隔: {actual_duration/len(time_series_data):.2f}s")
+                print(f"   [DATA] 平均采样间隔: {actual_duration/sample_count:.2f}s")
+                print(f"   [DATA] sweep 占空比: {self.last_collection_stats['sweep_duty_cycle']:.1%}")
+                if pipeline_errors:
+                    print(f"   [WARN]  流水线丢弃 {len(pipeline_errors)} 次解析失败的采样")
+                transfer = self.trace_transfer_summary()
+                print(
+                    f"   [DATA] trace 传输 ({transfer['format']}): "
+                    f"{transfer['bytes_per_sample']:.0f} 字节/次, "
+                    f"传输 {transfer['transfer_time_per_sample_ms']:.2f}ms/次, "
+                    f"解析 {transfer['parse_time_per_sample_ms']:.3f}ms/次"
+                )
             
             return time_series_data
             
@@ -823,57 +1478,607 @@ class N9918AController:
                 self.device.timeout = original_timeout
             except:
                 pass
+            if worker is not None and worker.is_alive():
+                raw_queue.put(None)
+                worker.join()
             return []
 
-def calculate_emc_detector_modes(time_series_data, detector_type="QUASI_PEAK"):
+EMC_DETECTOR_MODES = ("PEAK", "QUASI_PEAK", "AVERAGE")
+
+
+class EMCSampleStore:
     """
-    改进的EMC检测器模式计算
+    长时间 EMI 采集的紧凑采样存储：共享一条频率轴，幅度存放在可增长的
+    float32 矩阵（samples x points）中，另有 timestamp / sweep_start / sweep_end 数组。
+
+    按下标或迭代访问时返回旧格式的 dict 视图
+    {'timestamp', 'sweep_start', 'sweep_end', 'frequencies', 'amplitudes'}，
+    save_emi_measurement_data() 和检测器函数无需修改即可使用。
     """
-    if not time_series_data:
-        return None, None
-    
-    print(f"   [DETECTOR] 计算 {detector_type} 模式...")
-    
+
+    def __init__(self, frequencies=None, initial_capacity=64):
+        self.frequencies = frequencies
+        self._capacity = max(1, int(initial_capacity))
+        self._count = 0
+        self._amplitudes = None
+        self._times = np.empty((self._capacity, 3), dtype=np.float64)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def n_points(self):
+        return 0 if self._amplitudes is None else self._amplitudes.shape[1]
+
+    @property
+    def _time_rows(self):
+        return self._times[:self._count]
+
+    @property
+    def timestamps(self):
+        return self._time_rows[:, 0]
+
+    @property
+    def amplitudes(self):
+        """float32 幅度矩阵视图（不复制）。"""
+        if self._amplitudes is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._amplitudes[:self._count]
+
+    @property
+    def nbytes(self):
+        amplitude_bytes = 0 if self._amplitudes is None else self._amplitudes.nbytes
+        return amplitude_bytes + self._times.nbytes
+
+    def _grow(self):
+        self._capacity *= 2
+        if self._amplitudes is not None:
+            amplitudes = np.empty((self._capacity, self._amplitudes.shape[1]), dtype=np.float32)
+            amplitudes[:self._count] = self._amplitudes[:self._count]
+            self._amplitudes = amplitudes
+        times = np.empty((self._capacity, 3), dtype=np.float64)
+        times[:self._count] = self._times[:self._count]
+        self._times = times
+
+    def append(self, timestamp, amplitudes, frequencies=None, sweep_start=None, sweep_end=None):
+        """加入一次 sweep（dBμV）；点数与频率轴不一致时忽略并返回 False。"""
+        amplitudes = np.asarray(amplitudes, dtype=np.float32)
+        if self._amplitudes is None:
+            if self.frequencies is None:
+                self.frequencies = frequencies
+            if self.frequencies is not None and len(self.frequencies) != amplitudes.size:
+                print(f"   [WARN] 跳过点数与频率轴不一致的采样: {amplitudes.size} != {len(self.frequencies)}")
+                return False
+            self._amplitudes = np.empty((self._capacity, amplitudes.size), dtype=np.float32)
+        elif amplitudes.size != self._amplitudes.shape[1]:
+            print(f"   [WARN] 跳过点数不一致的采样: {amplitudes.size} != {self._amplitudes.shape[1]}")
+            return False
+        if self._count == self._capacity:
+            self._grow()
+        timestamp = float(timestamp)
+        self._amplitudes[self._count] = amplitudes
+        self._times[self._count] = (
+            timestamp,
+            timestamp if sweep_start is None else float(sweep_start),
+            timestamp if sweep_end is None else float(sweep_end),
+        )
+        self._count += 1
+        return True
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("sample index out of range")
+        timestamp, sweep_start, sweep_end = self._time_rows[index].tolist()
+        return {
+            'timestamp': timestamp,
+            'sweep_start': sweep_start,
+            'sweep_end': sweep_end,
+            'frequencies': self.frequencies,
+            'amplitudes': self.amplitudes[index].tolist(),
+        }
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    def iter_chunks(self, chunk_size=256):
+        """按时间顺序分块产出 (timestamps, float64 矩阵)，每块最多 chunk_size 次采样。"""
+        timestamps = np.array(self.timestamps, dtype=np.float64)
+        order = np.argsort(timestamps, kind="stable")
+        in_order = bool(np.all(order == np.arange(len(order))))
+        amplitudes = self.amplitudes
+        chunk_size = max(1, int(chunk_size))
+        for start in range(0, len(order), chunk_size):
+            rows = slice(start, start + chunk_size) if in_order else order[start:start + chunk_size]
+            yield timestamps[rows], np.asarray(amplitudes[rows], dtype=np.float64)
+
+    def to_arrays(self):
+        """(frequencies, timestamps, float64 矩阵)，与 _stack_time_series() 的返回一致。"""
+        if self.n_points == 0:
+            n_points = 0 if self.frequencies is None else len(self.frequencies)
+            matrix = np.empty((0, n_points), dtype=np.float64)
+        else:
+            matrix = self.amplitudes.astype(np.float64)
+        return self.frequencies, self.timestamps.copy(), matrix
+
+
+class EMCDiskSampleStore(EMCSampleStore):
+    """
+    多小时 EMI 监测用的磁盘采样存储：每次 sweep 追加写入目录下的原始文件，
+    读取时通过 np.memmap 映射，内存占用与采集时长无关。
+
+    目录结构：
+      header.json     - 版本、点数、dtype、元数据、sample_count、closed 标记
+      frequencies.f64 - 频率轴（float64）
+      amplitudes.f32  - samples x points 幅度（float32，行优先）
+      times.f64       - samples x 3 (timestamp, sweep_start, sweep_end)
+
+    create=True 用于新采集，目录已存在时抛出 FileExistsError。默认对已存在的
+    目录重新打开采集：按两个数据文件中完整的行数恢复 sample_count，截掉崩溃
+    时写了一半的行，之后可以继续 append()。
+    """
+
+    FORMAT_VERSION = 1
+    HEADER_FILE = "header.json"
+    FREQUENCY_FILE = "frequencies.f64"
+    AMPLITUDE_FILE = "amplitudes.f32"
+    TIMES_FILE = "times.f64"
+
+    def __init__(self, path, metadata=None, create=False):
+        # 不调用父类构造：磁盘存储不需要内存中的幅度/时间缓冲区
+        self.frequencies = None
+        self._count = 0
+        self.path = os.path.abspath(path)
+        self.metadata = dict(metadata or {})
+        self.recovered = False
+        self._n_points = 0
+        self._amplitude_file = None
+        self._times_file = None
+        self._mapped = None
+        if create:
+            os.makedirs(self.path)
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            if os.path.exists(self._file(self.HEADER_FILE)):
+                self._reopen()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _write_header(self, closed=False):
+        header = {
+            "version": self.FORMAT_VERSION,
+            "n_points": self._n_points,
+            "amplitude_dtype": "float32",
+            "time_fields": ["timestamp", "sweep_start", "sweep_end"],
+            "sample_count": self._count,
+            "closed": bool(closed),
+            "updated": datetime.now().isoformat(timespec="seconds"),
+            "metadata": self.metadata,
+        }
+        temp_path = self._file(self.HEADER_FILE + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(header, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self._file(self.HEADER_FILE))
+
+    def _reopen(self):
+        with open(self._file(self.HEADER_FILE), encoding="utf-8") as f:
+            header = json.load(f)
+        if header.get("version") != self.FORMAT_VERSION:
+            raise ValueError(f"不支持的采集文件版本: {header.get('version')}")
+        self.metadata = header.get("metadata") or self.metadata
+        self._n_points = int(header["n_points"])
+        self.frequencies = np.fromfile(self._file(self.FREQUENCY_FILE), dtype=np.float64).tolist()
+        row_bytes = self._n_points * 4
+        amplitude_rows = os.path.getsize(self._file(self.AMPLITUDE_FILE)) // row_bytes if row_bytes else 0
+        time_rows = os.path.getsize(self._file(self.TIMES_FILE)) // 24
+        self._count = int(min(amplitude_rows, time_rows))
+        # 截掉崩溃时只写了一半的行，保证后续追加对齐
+        os.truncate(self._file(self.AMPLITUDE_FILE), self._count * row_bytes)
+        os.truncate(self._file(self.TIMES_FILE), self._count * 24)
+        self.recovered = not header.get("closed", False)
+        if self.recovered:
+            print(f"   [WARN] 采集 {self.path} 未正常关闭，已恢复 {self._count} 次采样")
+
+    @property
+    def n_points(self):
+        return self._n_points
+
+    @property
+    def disk_bytes(self):
+        return self._count * (self._n_points * 4 + 24)
+
+    @property
+    def nbytes(self):
+        """当前 memmap 映射的数据字节数（由操作系统按需换页，不占堆内存）；未映射时为 0。"""
+        if self._mapped is None:
+            return 0
+        return self._mapped[1].nbytes + self._mapped[2].nbytes
+
+    def _map(self, name, dtype, width):
+        if self._count == 0:
+            return np.empty((0, width), dtype=dtype)
+        if self._mapped is None or self._mapped[0] != self._count:
+            if self._amplitude_file is not None:
+                self._amplitude_file.flush()
+                self._times_file.flush()
+            self._mapped = (
+                self._count,
+                np.memmap(self._file(self.AMPLITUDE_FILE), dtype=np.float32, mode="r", shape=(self._count, self._n_points)),
+                np.memmap(self._file(self.TIMES_FILE), dtype=np.float64, mode="r", shape=(self._count, 3)),
+            )
+        return self._mapped[1] if name == self.AMPLITUDE_FILE else self._mapped[2]
+
+    @property
+    def amplitudes(self):
+        """只读 memmap 视图（samples x points，float32）。"""
+        return self._map(self.AMPLITUDE_FILE, np.float32, self._n_points)
+
+    @property
+    def _time_rows(self):
+        return self._map(self.TIMES_FILE, np.float64, 3)
+
+    def append(self, timestamp, amplitudes, frequencies=None, sweep_start=None, sweep_end=None):
+        """追加一次 sweep 并 flush；点数不一致时忽略并返回 False。"""
+        amplitudes = np.asarray(amplitudes, dtype=np.float32)
+        if self._n_points == 0:
+            if self.frequencies is None:
+                self.frequencies = frequencies
+            if self.frequencies is None or len(self.frequencies) != amplitudes.size:
+                print("   [WARN] 磁盘采集缺少一致的频率轴，跳过本次采样")
+                return False
+            self._n_points = amplitudes.size
+            np.asarray(self.frequencies, dtype=np.float64).tofile(self._file(self.FREQUENCY_FILE))
+            open(self._file(self.AMPLITUDE_FILE), "wb").close()
+            open(self._file(self.TIMES_FILE), "wb").close()
+            self._write_header()
+        elif amplitudes.size != self._n_points:
+            print(f"   [WARN] 跳过点数不一致的采样: {amplitudes.size} != {self._n_points}")
+            return False
+        if self._amplitude_file is None:
+            self._amplitude_file = open(self._file(self.AMPLITUDE_FILE), "ab")
+            self._times_file = open(self._file(self.TIMES_FILE), "ab")
+        timestamp = float(timestamp)
+        times = np.array(
+            [
+                timestamp,
+                timestamp if sweep_start is None else float(sweep_start),
+                timestamp if sweep_end is None else float(sweep_end),
+            ],
+            dtype=np.float64,
+        )
+        self._amplitude_file.write(amplitudes.tobytes())
+        self._times_file.write(times.tobytes())
+        self._amplitude_file.flush()
+        self._times_file.flush()
+        self._count += 1
+        return True
+
+    def close(self):
+        """关闭数据文件并在 header 中记录最终 sample_count。"""
+        self._mapped = None
+        for handle in (self._amplitude_file, self._times_file):
+            if handle is not None:
+                handle.close()
+        self._amplitude_file = self._times_file = None
+        if self._n_points:
+            self._write_header(closed=True)
+
+
+def _stack_time_series(time_series_data):
+    """Stack sample dicts into (frequencies, timestamps, samples x points dBuV matrix)."""
+    if isinstance(time_series_data, EMCSampleStore):
+        return time_series_data.to_arrays()
     frequencies = time_series_data[0]['frequencies']
     n_points = len(frequencies)
-    n_samples = len(time_series_data)
-    
+    samples = [sample for sample in time_series_data if len(sample['amplitudes']) == n_points]
+    if len(samples) != len(time_series_data):
+        print(f"   [WARN] 跳过 {len(time_series_data) - len(samples)} 次点数不一致的采样")
+    timestamps = np.array([float(sample['timestamp']) for sample in samples], dtype=np.float64)
+    if not samples:
+        return frequencies, timestamps, np.empty((0, n_points), dtype=np.float64)
+    matrix = np.vstack([np.asarray(sample['amplitudes'], dtype=np.float64) for sample in samples])
+    return frequencies, timestamps, matrix
+
+
+# CISPR 16 频段时间常数：(频段上限 MHz, 充电时间 s, 放电时间 s)
+QP_TIME_CONSTANTS = (
+    (0.15, 45e-3, 500e-3),
+    (30.0, 1e-3, 160e-3),
+    (float("inf"), 1e-3, 550e-6),
+)
+QP_DEFAULT_TIME_CONSTANTS = (1e-3, 160e-3)
+
+
+def quasi_peak_time_constants(frequencies):
+    """按频段掩码一次生成每个频点的 (rise_time, decay_time) 数组；frequencies 为 None 时用中频参数。"""
+    if frequencies is None:
+        return np.float64(QP_DEFAULT_TIME_CONSTANTS[0]), np.float64(QP_DEFAULT_TIME_CONSTANTS[1])
+    freq_mhz = np.asarray(frequencies, dtype=np.float64) / 1e6
+    edges = np.array([band[0] for band in QP_TIME_CONSTANTS])
+    band_index = np.searchsorted(edges, freq_mhz, side="right")
+    band_index = np.minimum(band_index, len(QP_TIME_CONSTANTS) - 1)
+    rise_table = np.array([band[1] for band in QP_TIME_CONSTANTS])
+    decay_table = np.array([band[2] for band in QP_TIME_CONSTANTS])
+    return rise_table[band_index], decay_table[band_index]
+
+
+def calculate_quasi_peak_array(times, matrix_dbuv, frequencies=None):
+    """
+    calculate_quasi_peak_value() 的数组版本：matrix_dbuv 为 samples x points，
+    一次对所有频点沿时间执行充放电递推，返回每个频点的 QP 估算值（dBμV）。
+    """
+    timestamps = np.asarray(times, dtype=np.float64)
+    matrix_dbuv = np.asarray(matrix_dbuv, dtype=np.float64)
+    if matrix_dbuv.ndim == 1:
+        matrix_dbuv = matrix_dbuv[:, np.newaxis]
+    if matrix_dbuv.shape[0] == 0:
+        return np.zeros(matrix_dbuv.shape[1])
+    if matrix_dbuv.shape[0] <= 1:
+        return matrix_dbuv[0].copy()
+
+    rise_time, decay_time = quasi_peak_time_constants(frequencies)
+
+    order = np.argsort(timestamps, kind="stable")
+    times = timestamps[order]
+    linear = np.power(10.0, matrix_dbuv[order] / 20.0)
+    avg_value = linear.mean(axis=0)
+    max_value = linear.max(axis=0)
+    min_allowed_floor = avg_value * 0.7
+
+    qp_value = linear[0].copy()
+    for i in range(1, len(times)):
+        dt = times[i] - times[i - 1]
+        if dt <= 0 or dt > 10.0:
+            continue
+        current_value = linear[i]
+        charged = qp_value + (1 - np.exp(-dt / rise_time)) * (current_value - qp_value)
+        decayed = np.maximum(
+            qp_value * np.exp(-dt / decay_time),
+            np.maximum(current_value, min_allowed_floor),
+        )
+        qp_value = np.where(current_value > qp_value, charged, decayed)
+
+    qp_value = np.minimum(np.maximum(qp_value, avg_value * 0.8), max_value)
+    return 20.0 * np.log10(np.maximum(qp_value, 1e-12))
+
+
+def calculate_emc_detectors(time_series_data, modes=EMC_DETECTOR_MODES):
+    """
+    一次堆叠全部采样（samples x points），向量化计算 PEAK / AVERAGE / QUASI_PEAK。
+
+    返回 {mode: (frequencies, amplitudes)}；AVERAGE 在电压域平均，
+    QUASI_PEAK 为软件估算值。
+    """
+    if not time_series_data:
+        return {}
+    if isinstance(time_series_data, EMCDiskSampleStore):
+        return calculate_emc_detectors_chunked(time_series_data, modes)
+
+    frequencies, timestamps, matrix = _stack_time_series(time_series_data)
+    n_samples, n_points = matrix.shape
     if n_samples == 0 or n_points == 0:
-        return None, None
-    
+        return {}
+
+    print(f"   [DETECTOR] 计算 {'/'.join(modes)} 模式...")
     print(f"       数据维度: {n_samples} 次采样 × {n_points} 个频率点")
-    
-    result_amplitudes = []
-    
-    for freq_idx in range(n_points):
-        # 收集该频率点的所有采样值
-        time_values = []
-        for sample in time_series_data:
-            if freq_idx < len(sample['amplitudes']):
-                time_values.append((sample['timestamp'], sample['amplitudes'][freq_idx]))
-        
-        if not time_values:
-            result_amplitudes.append(0)
-            continue
-        
-        times = [tv[0] for tv in time_values]
-        values = [tv[1] for tv in time_values]
-        
-        # 计算检测器值
-        if detector_type == "PEAK":
-            detector_value = max(values)
-        elif detector_type == "QUASI_PEAK":
+
+    results = {}
+    for mode in modes:
+        if mode == "PEAK":
+            values = matrix.max(axis=0)
+        elif mode == "QUASI_PEAK":
             # 软件估算准峰值，正式 QPD 应优先使用仪器 EMI Option 361。
-            current_freq = frequencies[freq_idx]
-            detector_value = calculate_quasi_peak_value(times, values, current_freq)
-        elif detector_type == "AVERAGE":
-            detector_value = linear_average_dbuv(values)
+            values = calculate_quasi_peak_array(timestamps, matrix, frequencies)
+        elif mode == "AVERAGE":
+            linear_mean = np.power(10.0, matrix / 20.0).mean(axis=0)
+            values = 20.0 * np.log10(np.maximum(linear_mean, 1e-12))
         else:
-            detector_value = values[-1] if values else 0
-        
-        result_amplitudes.append(detector_value)
-    
-    return frequencies, result_amplitudes
+            values = matrix[-1]
+        results[mode] = (frequencies, values.tolist())
+    return results
+
+
+def calculate_emc_detectors_chunked(sample_store, modes=EMC_DETECTOR_MODES, chunk_size=256):
+    """
+    calculate_emc_detectors() 的分块版本，用于 EMCDiskSampleStore 等大采集：
+    每次只把 chunk_size 次采样读入内存。QUASI_PEAK 需要全程平均作为下限，
+    因此分两遍：第一遍 PEAK/AVERAGE，第二遍沿时间递推充放电。
+    """
+    n_samples = len(sample_store)
+    n_points = sample_store.n_points
+    if n_samples == 0 or n_points == 0:
+        return {}
+    frequencies = sample_store.frequencies
+
+    print(f"   [DETECTOR] 分块计算 {'/'.join(modes)} 模式...")
+    print(f"       数据维度: {n_samples} 次采样 × {n_points} 个频率点, 每块 {chunk_size} 次")
+
+    peak = np.full(n_points, -np.inf)
+    linear_sum = np.zeros(n_points)
+    last_row = None
+    for _timestamps, chunk in sample_store.iter_chunks(chunk_size):
+        np.maximum(peak, chunk.max(axis=0), out=peak)
+        linear_sum += np.power(10.0, chunk / 20.0).sum(axis=0)
+        last_row = chunk[-1]
+    linear_mean = linear_sum / n_samples
+
+    quasi_peak = None
+    if "QUASI_PEAK" in modes:
+        if n_samples == 1:
+            quasi_peak = last_row.copy()
+        else:
+            rise_time, decay_time = quasi_peak_time_constants(frequencies)
+            min_allowed_floor = linear_mean * 0.7
+            qp_value = None
+            previous_time = None
+            for chunk_times, chunk in sample_store.iter_chunks(chunk_size):
+                linear = np.power(10.0, chunk / 20.0)
+                for current_time, current_value in zip(chunk_times, linear):
+                    if qp_value is None:
+                        qp_value = current_value.copy()
+                        previous_time = current_time
+                        continue
+                    dt = current_time - previous_time
+                    previous_time = current_time
+                    if dt <= 0 or dt > 10.0:
+                        continue
+                    charged = qp_value + (1 - np.exp(-dt / rise_time)) * (current_value - qp_value)
+                    decayed = np.maximum(
+                        qp_value * np.exp(-dt / decay_time),
+                        np.maximum(current_value, min_allowed_floor),
+                    )
+                    qp_value = np.where(current_value > qp_value, charged, decayed)
+            max_value = np.power(10.0, peak / 20.0)
+            qp_value = np.minimum(np.maximum(qp_value, linear_mean * 0.8), max_value)
+            quasi_peak = 20.0 * np.log10(np.maximum(qp_value, 1e-12))
+
+    results = {}
+    for mode in modes:
+        if mode == "PEAK":
+            values = peak
+        elif mode == "QUASI_PEAK":
+            values = quasi_peak
+        elif mode == "AVERAGE":
+            values = 20.0 * np.log10(np.maximum(linear_mean, 1e-12))
+        else:
+            values = last_row
+        results[mode] = (frequencies, values.tolist())
+    return results
+
+
+def load_emc_capture(path, modes=EMC_DETECTOR_MODES, chunk_size=256):
+    """
+    重新打开磁盘采集（包括未正常结束的采集），分块计算检测器，
+    返回与 get_emc_measurement_fast() 相同结构的结果字典。
+    """
+    store = EMCDiskSampleStore(path)
+    if len(store) == 0:
+        print(f"[ERROR] 采集 {path} 中没有完整的采样")
+        return {}
+    results = calculate_emc_detectors_chunked(store, modes, chunk_size=chunk_size)
+    timestamps = store.timestamps
+    metadata = store.metadata
+    results["sampling_data"] = store
+    results["sampling_info"] = {
+        "total_samples": len(store),
+        "data_points": store.n_points,
+        "rbw": metadata.get("rbw") or 100e3,
+        "start_time": float(timestamps[0]),
+        "end_time": float(timestamps[-1]),
+        "samples_kept": True,
+        "acquisition_mode": "PER_SWEEP",
+        "amplitude_unit": metadata.get("amplitude_unit", "DBUV"),
+        "corrections": metadata.get("corrections", DEFAULT_SA_CORRECTIONS.copy()),
+        "screening_mode": True,
+        "capture_path": store.path,
+        "recovered": store.recovered,
+    }
+    results["measurement_summary"] = {
+        "actual_measurement_time": float(timestamps[-1] - timestamps[0]),
+        "data_points": store.n_points,
+        "total_samples": len(store),
+        "modes_computed": list(modes),
+        "measurement_time": metadata.get("created"),
+        "screening_mode": True,
+        "quasi_peak_estimated": "QUASI_PEAK" in modes,
+        "acquisition_mode": "PER_SWEEP",
+        "limit_note": SCREENING_LIMIT_NOTE,
+    }
+    return results
+
+
+class EMCDetectorAccumulator:
+    """
+    在线检测器累加器：采集循环每次 sweep 调用 update()，内存只占 O(points)。
+
+    PEAK 为逐点最大值；AVERAGE 在电压域累加；QUASI_PEAK 保存充放电状态，
+    下限使用截至当前的运行平均，而 calculate_emc_detectors() 使用全程平均。
+    电平平稳时两者基本一致；电平随时间明显上升或下降时差异可达零点几 dB。
+    保留了原始采样时 get_emc_measurement_fast() 会用全程平均重算 QUASI_PEAK，
+    只有 keep_samples=False 的结果是这里的近似值。
+    """
+
+    def __init__(self, frequencies=None):
+        self.frequencies = frequencies
+        self.sample_count = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self._max_linear = None
+        self._sum_linear = None
+        self._qp_linear = None
+        self._rise_time = None
+        self._decay_time = None
+
+    @property
+    def n_points(self):
+        return 0 if self._max_linear is None else len(self._max_linear)
+
+    def _start(self, frequencies, linear):
+        self.frequencies = frequencies
+        self._rise_time, self._decay_time = quasi_peak_time_constants(frequencies)
+        self._max_linear = linear.copy()
+        self._sum_linear = linear.copy()
+        self._qp_linear = linear.copy()
+
+    def update(self, timestamp, amplitudes, frequencies=None):
+        """加入一次 sweep（dBμV）；点数不一致时忽略并返回 False。"""
+        linear = np.power(10.0, np.asarray(amplitudes, dtype=np.float64) / 20.0)
+        timestamp = float(timestamp)
+        if self._max_linear is None:
+            self._start(frequencies if frequencies is not None else self.frequencies, linear)
+            self.sample_count = 1
+            self.first_timestamp = self.last_timestamp = timestamp
+            return True
+        if len(linear) != len(self._max_linear):
+            print(f"   [WARN] 跳过点数不一致的采样: {len(linear)} != {len(self._max_linear)}")
+            return False
+
+        dt = timestamp - self.last_timestamp
+        np.maximum(self._max_linear, linear, out=self._max_linear)
+        self._sum_linear += linear
+        self.sample_count += 1
+        if 0 < dt <= 10.0:
+            floor = self._sum_linear * (0.7 / self.sample_count)
+            qp_value = self._qp_linear
+            charged = qp_value + (1 - np.exp(-dt / self._rise_time)) * (linear - qp_value)
+            decayed = np.maximum(qp_value * np.exp(-dt / self._decay_time), np.maximum(linear, floor))
+            self._qp_linear = np.where(linear > qp_value, charged, decayed)
+        self.last_timestamp = max(self.last_timestamp, timestamp)
+        return True
+
+    def results(self, modes=EMC_DETECTOR_MODES):
+        """返回与 calculate_emc_detectors() 相同结构的 {mode: (frequencies, amplitudes)}。"""
+        if self.sample_count == 0:
+            return {}
+        average = self._sum_linear / self.sample_count
+        results = {}
+        for mode in modes:
+            if mode == "PEAK":
+                linear = self._max_linear
+            elif mode == "QUASI_PEAK":
+                linear = self._qp_linear
+                if self.sample_count > 1:
+                    linear = np.minimum(np.maximum(linear, average * 0.8), self._max_linear)
+            elif mode == "AVERAGE":
+                linear = average
+            else:
+                continue
+            values = 20.0 * np.log10(np.maximum(linear, 1e-12))
+            results[mode] = (self.frequencies, values.tolist())
+        return results
+
+
+def calculate_emc_detector_modes(time_series_data, detector_type="QUASI_PEAK"):
+    """
+    单一检测器模式计算；多个模式请直接用 calculate_emc_detectors() 一次算完。
+    """
+    results = calculate_emc_detectors(time_series_data, modes=(detector_type,))
+    return results.get(detector_type, (None, None))
 
 
 def calculate_quasi_peak_value(times, values, frequency_hz=None):
@@ -982,9 +2187,12 @@ def save_emi_measurement_data(frequencies_dict, filename_prefix=None):
             saved_files.append(csv_filepath)
             print(f"[SAVE] {mode} 最终数据已保存: {csv_filepath}")
     
-    # 保存详细的采样数据（如果存在）
-    if "sampling_data" in frequencies_dict:
-        sampling_data = frequencies_dict["sampling_data"]
+    # 磁盘采集的原始采样已在采集目录中，不再展开为 CSV
+    sampling_data = frequencies_dict.get("sampling_data")
+    if isinstance(sampling_data, EMCDiskSampleStore):
+        print(f"[SAVE] 原始采样位于磁盘采集目录: {sampling_data.path} ({len(sampling_data)} 次)")
+        saved_files.append(sampling_data.path)
+    elif "sampling_data" in frequencies_dict:
         
         # 保存每次采样的详细数据
         detailed_filename = f"{filename_prefix}_all_samples_detailed.csv"
@@ -1057,32 +2265,152 @@ def get_fcc_ce_limits(freq_hz, detector_type="QUASI_PEAK"):
     info = get_emission_limit_info(freq_hz, detector_type=detector_type)
     return info["fcc_limit"], info["ce_limit"]
 
+def _limit_bounds(limit):
+    if limit is None:
+        return None, None
+    if isinstance(limit, (tuple, list)):
+        lower, upper = (tuple(limit) + (None, None))[:2]
+        return lower, upper
+    return limit, None
+
+
+def _sparse_table(values, reducer):
+    """按 2^k 窗口构建区间极值表，用于 O(1) 区间查询和向量化二分扩展。"""
+    table = [values]
+    width = 1
+    while width * 2 <= len(values):
+        previous = table[-1]
+        table.append(reducer(previous[:-width], previous[width:]))
+        width *= 2
+    return table
+
+
+def _peak_prominences_numpy(x, peaks):
+    """与 scipy.signal.peak_prominences(wlen=None) 相同口径的显著性计算。"""
+    n = len(x)
+    max_table = _sparse_table(x, np.maximum)
+    min_table = _sparse_table(x, np.minimum)
+    heights = x[peaks]
+
+    # 向两侧扩展，直到遇到比峰值更高的点
+    left = peaks.copy()
+    right = peaks.copy()
+    for level in range(len(max_table) - 1, -1, -1):
+        width = 1 << level
+        level_max = max_table[level]
+        start = left - width
+        valid = start >= 0
+        can_extend = valid & (level_max[np.where(valid, start, 0)] <= heights)
+        left = np.where(can_extend, start, left)
+        start = right + 1
+        valid = right + width <= n - 1
+        can_extend = valid & (level_max[np.where(valid, start, 0)] <= heights)
+        right = np.where(can_extend, right + width, right)
+
+    def range_min(lower, upper):
+        level = np.floor(np.log2(upper - lower + 1)).astype(np.int64)
+        result = np.empty(len(lower))
+        for value in np.unique(level):
+            mask = level == value
+            table = min_table[value]
+            result[mask] = np.minimum(table[lower[mask]], table[upper[mask] - (1 << value) + 1])
+        return result
+
+    left_min = range_min(left, peaks)
+    right_min = range_min(peaks, right)
+    return heights - np.maximum(left_min, right_min)
+
+
+def find_peaks_numpy(x, height=None, distance=None, prominence=None):
+    """
+    纯 NumPy 峰值检测，height/distance/prominence 与 scipy.signal.find_peaks 口径一致。
+
+    返回 (peaks, properties)，供缺少 scipy 的现场电脑使用。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    properties = {}
+    if len(x) < 3:
+        return np.array([], dtype=np.int64), properties
+
+    # 局部最大值：相等的平台取中点，两端平台不算峰
+    change = np.flatnonzero(np.diff(x) != 0) + 1
+    run_starts = np.concatenate(([0], change))
+    run_ends = np.concatenate((change - 1, [len(x) - 1]))
+    run_values = x[run_starts]
+    inner = np.arange(1, len(run_starts) - 1)
+    is_peak = (run_values[inner - 1] < run_values[inner]) & (run_values[inner + 1] < run_values[inner])
+    peak_runs = inner[is_peak]
+    peaks = (run_starts[peak_runs] + run_ends[peak_runs]) // 2
+
+    if height is not None:
+        lower, upper = _limit_bounds(height)
+        heights = x[peaks]
+        keep = np.ones(len(peaks), dtype=bool)
+        if lower is not None:
+            keep &= heights >= lower
+        if upper is not None:
+            keep &= heights <= upper
+        peaks = peaks[keep]
+        properties["peak_heights"] = heights[keep]
+
+    if distance is not None and len(peaks) > 1:
+        if distance < 1:
+            raise ValueError("`distance` must be greater or equal to 1")
+        distance = int(math.ceil(distance))
+        # 与 scipy 相同的贪心剔除：按高度从高到低（同一 argsort 顺序）保留峰，
+        # 用 searchsorted 找到其 ±distance 窗口内的峰一次性剔除，O(n log n)
+        lower_bounds = np.searchsorted(peaks, peaks - distance + 1, side="left")
+        upper_bounds = np.searchsorted(peaks, peaks + distance - 1, side="right")
+        keep = np.ones(len(peaks), dtype=bool)
+        for index in np.argsort(x[peaks])[::-1].tolist():
+            if not keep[index]:
+                continue
+            keep[lower_bounds[index]:upper_bounds[index]] = False
+            keep[index] = True
+        peaks = peaks[keep]
+        for key in properties:
+            properties[key] = properties[key][keep]
+
+    if prominence is not None:
+        lower, upper = _limit_bounds(prominence)
+        prominences = _peak_prominences_numpy(x, peaks) if len(peaks) else np.array([])
+        keep = np.ones(len(peaks), dtype=bool)
+        if lower is not None:
+            keep &= prominences >= lower
+        if upper is not None:
+            keep &= prominences <= upper
+        peaks = peaks[keep]
+        for key in properties:
+            properties[key] = properties[key][keep]
+        properties["prominences"] = prominences[keep]
+
+    return peaks.astype(np.int64), properties
+
+
 # 峰值检测函数
 def find_peaks_manual(data, distance=5, prominence=3):
     """
-    手动实现峰值检测
+    手动实现峰值检测：窗口内严格最大且高于均值 + prominence，按幅度降序返回。
     """
-    peaks = []
-    n = len(data)
-    
-    for i in range(1, n-1):
-        is_peak = True
-        for j in range(max(0, i-distance), i):
-            if data[j] >= data[i]:
-                is_peak = False
-                break
-        if not is_peak:
-            continue
-        for j in range(i+1, min(n, i+distance+1)):
-            if data[j] >= data[i]:
-                is_peak = False
-                break
-        
-        if is_peak and data[i] > np.mean(data) + prominence:
-            peaks.append(i)
-    
-    peaks.sort(key=lambda x: data[x], reverse=True)
-    return peaks
+    values = np.asarray(data, dtype=np.float64)
+    n = len(values)
+    if n < 3:
+        return []
+    distance = max(int(distance), 0)
+    if distance == 0:
+        candidates = np.arange(1, n - 1)
+    else:
+        # 左/右两侧各 distance 个点的最大值（不含自身）
+        padded = np.pad(values, distance, mode="constant", constant_values=-np.inf)
+        windows = np.lib.stride_tricks.sliding_window_view(padded, distance)
+        left_max = windows[:n].max(axis=1)
+        right_max = windows[distance + 1:distance + 1 + n].max(axis=1)
+        is_peak = (values > left_max) & (values > right_max)
+        is_peak[0] = is_peak[-1] = False
+        candidates = np.flatnonzero(is_peak)
+    candidates = candidates[values[candidates] > values.mean() + prominence]
+    order = np.argsort(-values[candidates], kind="stable")
+    return candidates[order].tolist()
 
 def post_process_peak_search(
     frequencies,
@@ -1107,7 +2435,7 @@ def post_process_peak_search(
     # 动态调整最小高度阈值
     min_height = mean_amp + dynamic_prominence * 0.3  # 进一步降低阈值以检测更多峰值
     
-    # 多级峰值检测；开发环境缺少 scipy 时退回手写算法，硬件环境仍建议安装 requirements。
+    # 多级峰值检测；缺少 scipy 时使用同口径的 NumPy 实现 find_peaks_numpy。
     if signal:
         primary_peaks, _ = signal.find_peaks(
             amplitudes,
@@ -1122,22 +2450,22 @@ def post_process_peak_search(
             height=mean_amp + 0.3  # 更低的高度要求
         )
     else:
-        primary_peaks = find_peaks_manual(amplitudes, distance=peak_distance, prominence=dynamic_prominence)
-        secondary_peaks = find_peaks_manual(
+        primary_peaks, _ = find_peaks_numpy(
+            amplitudes,
+            distance=peak_distance,
+            prominence=dynamic_prominence,
+            height=min_height
+        )
+        secondary_peaks, _ = find_peaks_numpy(
             amplitudes,
             distance=max(5, peak_distance // 4),
             prominence=max(0.3, dynamic_prominence * 0.3),
+            height=mean_amp + 0.3
         )
     
     # 第三级：检测超限连续区域，并用区域内最高点代表，避免一整段超限刷屏。
-    threshold_indices = []
-    for i in range(len(amplitudes)):
-        freq_hz = frequencies[i]
-        amp_dbuv = amplitudes[i]
-        fcc_limit, ce_limit = get_fcc_ce_limits(freq_hz, detector_type=detector_type)
-        
-        if amp_dbuv > fcc_limit or amp_dbuv > ce_limit:
-            threshold_indices.append(i)
+    limit_table = compile_limit_table(frequencies, detector_type=detector_type)
+    threshold_indices = limit_table.exceeding_indices(amplitudes)
     threshold_peaks = collapse_exceeding_regions(threshold_indices, amplitudes, frequencies)
     
     # 合并峰值并去重
@@ -1147,42 +2475,44 @@ def post_process_peak_search(
     if len(all_peaks) == 0:
         all_peaks = find_peaks_manual(amplitudes, distance=peak_distance//2, prominence=min_prominence*0.3)
     
-    # 计算每个峰值的重要性分数
-    peak_scores = []
-    for idx in all_peaks:
-        if idx < 0 or idx >= len(amplitudes):
-            continue
-            
-        amp_dbuv = amplitudes[idx]
-        freq_hz = frequencies[idx]
-        limit_info = get_emission_limit_info(freq_hz, detector_type=detector_type)
-        fcc_limit = limit_info["fcc_limit"]
-        ce_limit = limit_info["ce_limit"]
-        
-        # 计算裕量（相对于限值）
-        fcc_margin = amp_dbuv - fcc_limit
-        ce_margin = amp_dbuv - ce_limit
-        
-        # 峰值重要性评分（综合考虑幅度和裕量）
-        amplitude_score = (amp_dbuv - mean_amp) / std_amp if std_amp > 0 else 0
-        margin_score = max(fcc_margin, ce_margin, 0)  # 只考虑正裕量
-        prominence_score = 0
-        
-        # 计算相对于相邻点的显著性
-        if 1 <= idx < len(amplitudes) - 1:
-            left_diff = amp_dbuv - amplitudes[idx-1]
-            right_diff = amp_dbuv - amplitudes[idx+1]
-            prominence_score = min(left_diff, right_diff)
-        
-        # 对于超过限值的点给予更高的评分
-        exceed_bonus = 15 if (fcc_margin > 0 or ce_margin > 0) else 0  # 提高超限点的优先级
-        
-        # 综合评分
-        total_score = amplitude_score * 0.2 + margin_score * 0.5 + prominence_score * 0.2 + exceed_bonus
-        peak_scores.append((idx, total_score, amp_dbuv, fcc_margin, ce_margin, fcc_limit, ce_limit))
+    # 向量化计算每个峰值的重要性分数（候选顺序保持不变，排序用稳定排序）
+    amp_array = np.asarray(amplitudes, dtype=np.float64)
+    n_bins = len(amp_array)
+    candidates = np.asarray(all_peaks, dtype=np.int64)
+    candidates = candidates[(candidates >= 0) & (candidates < n_bins)]
+    if len(candidates) == 0:
+        return []
+    
+    amp_dbuv = amp_array[candidates]
+    fcc_limits = limit_table.fcc[candidates]
+    ce_limits = limit_table.ce[candidates]
+    
+    # 计算裕量（相对于限值）
+    fcc_margins = amp_dbuv - fcc_limits
+    ce_margins = amp_dbuv - ce_limits
+    exceeds = (fcc_margins > 0) | (ce_margins > 0)
+    
+    # 峰值重要性评分（综合考虑幅度和裕量）
+    if std_amp > 0:
+        amplitude_scores = (amp_dbuv - mean_amp) / std_amp
+    else:
+        amplitude_scores = np.zeros(len(candidates))
+    margin_scores = np.maximum(np.maximum(fcc_margins, ce_margins), 0)  # 只考虑正裕量
+    
+    # 计算相对于相邻点的显著性
+    interior = (candidates >= 1) & (candidates < n_bins - 1)
+    left = amp_array[np.clip(candidates - 1, 0, n_bins - 1)]
+    right = amp_array[np.clip(candidates + 1, 0, n_bins - 1)]
+    prominence_scores = np.where(interior, np.minimum(amp_dbuv - left, amp_dbuv - right), 0.0)
+    
+    # 对于超过限值的点给予更高的评分
+    exceed_bonus = np.where(exceeds, 15, 0)
+    
+    # 综合评分
+    scores = amplitude_scores * 0.2 + margin_scores * 0.5 + prominence_scores * 0.2 + exceed_bonus
     
     # 按重要性排序
-    peak_scores.sort(key=lambda x: x[1], reverse=True)
+    order = np.argsort(-scores, kind="stable")
     
     # 根据频率范围调整返回的峰值数量
     freq_range_mhz = (frequencies[-1] - frequencies[0]) / 1e6
@@ -1193,43 +2523,37 @@ def post_process_peak_search(
     else:  # 高于100MHz范围
         max_peaks = 50  # 增加峰值数量
     
-    # 确保包含所有超标的峰值
-    peak_results = []
-    exceed_peaks = []
-    normal_peaks = []
+    # 确保包含所有超标的峰值，再按分数补充正常峰值
+    exceed_order = order[exceeds[order]]
+    normal_order = order[~exceeds[order]]
+    remaining_slots = max_peaks - len(exceed_order)
+    selected = np.concatenate([exceed_order, normal_order[:remaining_slots]])
     
-    for idx, score, amp_dbuv, fcc_margin, ce_margin, fcc_limit, ce_limit in peak_scores:
+    # 只为最终入选的峰值构建字典
+    peak_results = []
+    for position in selected:
+        idx = int(candidates[position])
         freq_hz = frequencies[idx]
-        peak_data = {
+        limit_info = limit_table.band_info[int(limit_table.band_index[idx])]
+        fcc_margin = float(fcc_margins[position])
+        ce_margin = float(ce_margins[position])
+        peak_results.append({
             'frequency_hz': freq_hz,
             'frequency_mhz': freq_hz / 1e6,
-            'amplitude_dbuv': amp_dbuv,
-            'fcc_limit': fcc_limit,
-            'ce_limit': ce_limit,
+            'amplitude_dbuv': amplitudes[idx],
+            'fcc_limit': float(fcc_limits[position]),
+            'ce_limit': float(ce_limits[position]),
             'fcc_margin': fcc_margin,
             'ce_margin': ce_margin,
             'exceed_fcc': fcc_margin > 0,
             'exceed_ce': ce_margin > 0,
-            'importance_score': score,
+            'importance_score': float(scores[position]),
             'limit_unit': limit_info["unit"],
             'limit_measurement_type': limit_info["measurement_type"],
             'fcc_detector': limit_info["fcc_detector"],
             'ce_detector': limit_info["ce_detector"],
             'limit_note': limit_info["note"],
-        }
-        
-        # 确保所有超过限值的点都被包含
-        if fcc_margin > 0 or ce_margin > 0:
-            exceed_peaks.append(peak_data)
-        else:
-            normal_peaks.append(peak_data)
-    
-    # 首先添加所有超标的峰值
-    peak_results.extend(exceed_peaks)
-    
-    # 然后添加重要的正常峰值，直到达到最大数量
-    remaining_slots = max_peaks - len(peak_results)
-    peak_results.extend(normal_peaks[:remaining_slots])
+        })
     
     # 按频率排序以便显示
     peak_results.sort(key=lambda x: x['frequency_hz'])
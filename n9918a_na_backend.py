@@ -5,14 +5,21 @@
 from __future__ import annotations
 
 import csv
+import hashlib
 import json
 import math
+import os
 import time
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
 from typing import Callable, Iterable, List, Optional, Sequence, Tuple
 
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from scpi_state import SCPIShadowState, open_visa_resource
+
 try:
     import pyvisa
 except ImportError:  # pragma: no cover - depends on local hardware environment.
@@ -107,6 +114,32 @@ NA_PRESET_CONFIGS = {
     },
 }
 
+# SDATA: 只读复数 SDATA，本地换算 MLOG S11 dB；FDATA: 旧流程，FDATa 与 SDATA 各读一次。
+NA_S11_SOURCES = ("SDATA", "FDATA")
+# verify_fdata 时本地 S11 dB 与仪器 FDATa 允许的最大偏差
+FDATA_CHECK_TOLERANCE_DB = 0.05
+MIN_GAMMA_MAGNITUDE = 1e-10
+# 实时调试帧里 S11 曲线的最大点数（按分段最小值抽稀，保留谷值）
+NA_FRAME_TRACE_POINTS = 401
+# 预设默认 S11 掩模：理想频点 ±0.5% 内 S11 <= -10dB
+DEFAULT_MASK_HALF_WIDTH_RATIO = 0.005
+DEFAULT_MASK_MAX_S11_DB = -10.0
+# 校准缓存默认有效期：超过后需重新做 QuickCal（温漂、线缆移动）
+NA_CAL_CACHE_VALIDITY_S = 4 * 3600.0
+# N9918A 单次扫描最大点数；分段全扫宽默认切 4 段（共 40000 点，约 0.66MHz 分辨率）
+NA_MAX_POINTS = 10001
+NA_FULL_SPAN_SEGMENTS = 4
+# 自适应两段扫描：宽 IFBW 少点粗扫找候选谷，再用预设 IFBW 在每个谷附近细扫
+ADAPTIVE_MIN_COARSE_POINTS = 201
+ADAPTIVE_COARSE_POINTS_DIVISOR = 2
+ADAPTIVE_COARSE_IFBW_FACTOR = 10.0
+ADAPTIVE_MAX_COARSE_IFBW = 100e3
+ADAPTIVE_ZOOM_POINTS = 201
+ADAPTIVE_MAX_ZOOMS = 6
+ADAPTIVE_ZOOM_HALF_WIDTH_STEPS = 2
+# 只细扫粗扫 S11 不高于该值的谷（最深谷总会细扫），避免在噪声小谷上浪费扫描时间
+ADAPTIVE_ZOOM_MAX_S11_DB = -6.0
+
 SWITCH_POSITIONS = {
     "LOAD": {"B": 1, "C": 1},
     "OPEN": {"B": 2, "C": 1},
@@ -154,12 +187,102 @@ class N9918ANAError(RuntimeError):
         }
 
 
+class NACalibrationCache:
+    """
+    校准缓存索引：每个校准条件（起止频率/点数/IFBW）对应仪器上一个状态文件（含校准）。
+
+    仪器存储不提供可靠的文件时间，保存时间与预设信息记录在本地 JSON 索引；
+    超过 validity_s 的条目视为过期，lookup 不再返回。
+    """
+
+    def __init__(self, path, validity_s=NA_CAL_CACHE_VALIDITY_S):
+        self.path = Path(path)
+        self.validity_s = float(validity_s)
+        self._entries = {}
+        if self.path.exists():
+            try:
+                self._entries = json.loads(self.path.read_text(encoding="utf-8")).get("entries", {})
+            except (OSError, ValueError) as exc:
+                print(f"[WARN] 校准缓存索引无法读取，已忽略: {exc}")
+
+    @staticmethod
+    def key(config):
+        return f"{float(config['start_freq']):.0f}-{float(config['stop_freq']):.0f}-{int(config['points'])}-{float(config['ifbw']):.0f}"
+
+    @classmethod
+    def state_file(cls, config):
+        digest = hashlib.sha1(cls.key(config).encode("ascii")).hexdigest()[:8].upper()
+        return f"NACAL_{digest}.STA"
+
+    def lookup(self, config, now=None):
+        """返回有效期内的条目（附 age_s），没有或已过期时返回 None。"""
+        entry = self._entries.get(self.key(config))
+        if not entry:
+            return None
+        age_s = (time.time() if now is None else now) - entry["saved_at"]
+        if age_s > self.validity_s:
+            return None
+        return {**entry, "age_s": age_s, "valid_until": entry["saved_at"] + self.validity_s}
+
+    def store(self, config, preset_key, state_file, instrument=None):
+        entry = {
+            "preset_key": preset_key,
+            "state_file": state_file,
+            "start_freq": float(config["start_freq"]),
+            "stop_freq": float(config["stop_freq"]),
+            "points": int(config["points"]),
+            "ifbw": float(config["ifbw"]),
+            "instrument": instrument,
+            "saved_at": time.time(),
+        }
+        self._entries[self.key(config)] = entry
+        self._save()
+        return dict(entry)
+
+    def discard(self, config):
+        if self._entries.pop(self.key(config), None) is not None:
+            self._save()
+
+    def entries(self, now=None):
+        now = time.time() if now is None else now
+        return [
+            {**entry, "age_s": now - entry["saved_at"], "valid": now - entry["saved_at"] <= self.validity_s}
+            for entry in self._entries.values()
+        ]
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        temp_path.write_text(json.dumps({"entries": self._entries}, ensure_ascii=False, indent=2), encoding="utf-8")
+        temp_path.replace(self.path)
+
+
 class N9918ANAController:
     """PyVISA controller for FieldFox NA/S11 antenna measurements."""
 
-    def __init__(self, ip_address="192.168.20.233", timeout=30000):
+    def __init__(
+        self,
+        ip_address="192.168.20.233",
+        timeout=30000,
+        scpi_state: Optional[SCPIShadowState] = None,
+        s11_source: str = "SDATA",
+        data_format: str = "REAL64",
+        calibration_cache: Optional[NACalibrationCache] = None,
+    ):
         self.ip_address = ip_address
         self.timeout = timeout
+        # 优先 REAL,64 二进制块读取 FDATa/SDATA；连接时协商失败则回退 ASCII。
+        self.preferred_data_format = str(data_format or "ASCII").upper()
+        self.data_format = "ASCII"
+        self.last_data_transfers: List[dict] = []
+        self.data_transfer_stats = _empty_data_transfer_stats()
+        self.s11_source = str(s11_source or "SDATA").upper()
+        # 按需开启：SDATA 模式下额外读一次 FDATa，与本地换算的 S11 dB 对比
+        self.verify_fdata = False
+        self.last_fdata_check = None
+        # 设置后每次校准完成都把状态（含校准）存到仪器，同条件预设可直接召回
+        self.calibration_cache = calibration_cache
+        self.instrument_id = None
         self.rm = None
         self.device = None
         self.connected = False
@@ -171,15 +294,20 @@ class N9918ANAController:
         self.points = None
         self.ifbw = None
         self.last_switch_position = None
+        # 与 SA 控制器共用同一台仪器时应传入同一个 SCPIShadowState。
+        self.scpi_state = scpi_state if scpi_state is not None else SCPIShadowState()
 
     def connect(self):
         try:
             self.rm = pyvisa.ResourceManager()
-            self.device = self.rm.open_resource(f"TCPIP0::{self.ip_address}::inst0::INSTR")
+            self.device = open_visa_resource(self.rm, self.ip_address)
             self.device.timeout = self.timeout
             self._write("*CLS")
             device_id = self._query("*IDN?")
+            self.instrument_id = str(device_id).strip()
             self.connected = True
+            self.scpi_state.invalidate("NA connect")
+            self._select_data_format()
             self.select_mode()
             print(f"Connected to N9918A NA: {device_id}")
             return True
@@ -205,7 +333,67 @@ class N9918ANAController:
 
     def select_mode(self):
         self._require_connected()
-        return self._query('INST:SEL "NA";*OPC?')
+        response = None
+        if self.scpi_state.mode != "NA":
+            response = self._query('INST:SEL "NA";*OPC?')
+            self.scpi_state.set_mode("NA")
+        # FORM:DATA 为仪器全局设置，SA 侧可能切到了 REAL,32，每次进入 NA 按协商结果重新下发。
+        self._apply_data_format()
+        return response
+
+    def _select_data_format(self):
+        """Negotiate the FDATa/SDATA transfer format once per connection."""
+        self.data_format = "ASCII"
+        if self.preferred_data_format == "REAL64" and hasattr(self.device, "query_binary_values"):
+            try:
+                self._write("FORM:DATA REAL,64")
+                self._write("FORM:BORD NORM")
+                errors = self._read_scpi_errors()
+                if errors:
+                    print(f"[WARN] NA REAL,64 格式被拒绝，回退 ASCII: {' | '.join(errors)}")
+                else:
+                    self.data_format = "REAL64"
+                    self.scpi_state.record_write("FORM:DATA REAL,64")
+                    self.scpi_state.record_write("FORM:BORD NORM")
+            except Exception as exc:
+                print(f"[WARN] NA REAL,64 传输不可用，回退 ASCII: {exc}")
+        print(f"[FORMAT] NA 数据传输格式: {self.data_format}")
+        return self.data_format
+
+    def _apply_data_format(self):
+        if self.data_format == "REAL64":
+            self._write_setting("FORM:DATA REAL,64")
+            self._write_setting("FORM:BORD NORM")
+        else:
+            self._write_setting("FORM:DATA ASC,0")
+
+    def _read_scpi_errors(self):
+        errors = []
+        for _ in range(5):
+            response = str(self._query("SYST:ERR?")).strip()
+            if response.startswith("+0") or response.startswith("0,") or "No error" in response:
+                break
+            errors.append(response)
+        return errors
+
+    def reset_data_transfer_stats(self):
+        self.data_transfer_stats = _empty_data_transfer_stats()
+
+    def data_transfer_summary(self):
+        """Transfer cost of the last measurement's data reads plus running totals."""
+        stats = self.data_transfer_stats
+        reads = stats["reads"]
+        return {
+            "format": self.data_format,
+            "last_reads": [dict(item) for item in self.last_data_transfers],
+            "last_bytes": sum(item["bytes"] for item in self.last_data_transfers),
+            "last_transfer_time_ms": sum(item["transfer_time"] for item in self.last_data_transfers) * 1000.0,
+            "last_parse_time_ms": sum(item["parse_time"] for item in self.last_data_transfers) * 1000.0,
+            "reads": reads,
+            "total_bytes": stats["bytes"],
+            "transfer_time_per_read_ms": stats["transfer_time"] / reads * 1000.0 if reads else 0.0,
+            "parse_time_per_read_ms": stats["parse_time"] / reads * 1000.0 if reads else 0.0,
+        }
 
     def get_preset_configs(self):
         return NA_PRESET_CONFIGS
@@ -221,13 +409,17 @@ class N9918ANAController:
             config["ifbw"] = float(ifbw)
 
         self.select_mode()
-        self._write("CALC:PAR:DEF S11")
-        self._write("CALC:FORM MLOG")
-        self._write(f"SENS:FREQ:START {config['start_freq']}")
-        self._write(f"SENS:FREQ:STOP {config['stop_freq']}")
-        self._write(f"SENS:SWE:POIN {config['points']}")
-        self._write(f"BWID {config['ifbw']}")
-        self._query("INIT:CONT 0;*OPC?")
+        changed = [
+            self._write_setting("CALC:PAR:DEF S11"),
+            self._write_setting("CALC:FORM MLOG"),
+            self._write_setting(f"SENS:FREQ:START {config['start_freq']}"),
+            self._write_setting(f"SENS:FREQ:STOP {config['stop_freq']}"),
+            self._write_setting(f"SENS:SWE:POIN {config['points']}"),
+            self._write_setting(f"BWID {config['ifbw']}"),
+        ]
+        if any(changed) or self.scpi_state.get("INIT:CONT") != "0":
+            self._query("INIT:CONT 0;*OPC?")
+            self.scpi_state.record("INIT:CONT", "0")
 
         self.current_preset_key = preset_key
         self.current_config = config
@@ -273,55 +465,432 @@ class N9918ANAController:
         except N9918ANAError:
             raise
         except Exception as exc:
+            self.scpi_state.invalidate("NA calibration error")
             raise N9918ANAError(str(exc), step="CALIBRATION", last_scpi=self.last_scpi, switch_position=self.last_switch_position) from exc
 
+        cache_entry = self._store_calibration_state(emit) if self.calibration_cache is not None else None
         return {
             "complete": True,
+            "cached": False,
+            "cache_entry": cache_entry,
+            "events": events,
+            "last_scpi": self.last_scpi,
+            "switch_position": self.last_switch_position,
+        }
+
+    def _store_calibration_state(self, emit):
+        """把刚完成的校准连同仪器状态存成文件；失败只告警，不影响本次校准。"""
+        state_file = NACalibrationCache.state_file(self.current_config)
+        try:
+            self._write(f'MMEM:STOR:STAT "{state_file}"')
+            errors = self._read_scpi_errors()
+        except Exception as exc:
+            errors = [str(exc)]
+        if errors:
+            print(f"[WARN] NA 校准状态保存失败，本次校准不进缓存: {' | '.join(errors)}")
+            emit(CalibrationEvent("CACHE", "保存校准状态", "B2C2", self.last_scpi, False, " | ".join(errors)))
+            return None
+        entry = self.calibration_cache.store(self.current_config, self.current_preset_key, state_file, self.instrument_id)
+        emit(CalibrationEvent("CACHE", "保存校准状态", "B2C2", self.last_scpi, True, f"已存为 {state_file}"))
+        return entry
+
+    def recall_calibration(self, switch_controller=None, progress_callback=None):
+        """
+        当前预设在缓存有效期内有校准时，MMEM:LOAD:STAT 召回状态代替完整 QuickCal。
+        返回与 perform_calibration 同结构的结果；没有可用缓存、Switch 未连接或召回失败时返回 None。
+        """
+        self._require_connected()
+        if self.calibration_cache is None or not self.current_config:
+            return None
+        if switch_controller is None or not getattr(switch_controller, "connected", False):
+            # 召回后必须切到天线通道，Switch 不可用时退回完整校准流程
+            return None
+        entry = self.calibration_cache.lookup(self.current_config)
+        if entry is None:
+            return None
+        if entry.get("instrument") and self.instrument_id and entry["instrument"] != self.instrument_id:
+            # 状态文件存在另一台仪器上
+            return None
+
+        events = []
+
+        def emit(event):
+            events.append(event.as_dict())
+            if progress_callback:
+                progress_callback(event.as_dict())
+
+        config = self.current_config
+        try:
+            self._write(f'MMEM:LOAD:STAT "{entry["state_file"]}"')
+            self._query("*OPC?")
+            errors = self._read_scpi_errors()
+        except Exception as exc:
+            errors = [str(exc)]
+        # 召回会改写仪器上的全部设置，影子状态作废后按当前预设重新下发
+        self.scpi_state.invalidate("NA state recall")
+        if errors:
+            print(f"[WARN] NA 校准状态召回失败，需要重新校准: {' | '.join(errors)}")
+            self.calibration_cache.discard(config)
+            self.configure_preset(self.current_preset_key, points=config["points"], ifbw=config["ifbw"])
+            return None
+        emit(CalibrationEvent("RECALL", "召回缓存校准", self.last_switch_position or "--", f'MMEM:LOAD:STAT "{entry["state_file"]}"', True, f"{entry['age_s'] / 60:.0f} 分钟前保存"))
+        self.configure_preset(self.current_preset_key, points=config["points"], ifbw=config["ifbw"])
+        self._set_switch_position(switch_controller, "ANTENNA")
+        emit(CalibrationEvent("ANTENNA", "切到天线测量", "B2C2", None, True, "已切到天线通道"))
+        return {
+            "complete": True,
+            "cached": True,
+            "cache_entry": entry,
             "events": events,
             "last_scpi": self.last_scpi,
             "switch_position": self.last_switch_position,
         }
 
     def measure_s11(self, should_stop=None):
+        frequencies, s11_db, real, imag = self.acquire_s11(should_stop)
+        result = build_na_result(
+            frequencies,
+            s11_db,
+            real,
+            imag,
+            self.current_config,
+            self.current_preset_key,
+        )
+        result["s11_source"] = self.s11_source
+        result["data_transfer"] = self.data_transfer_summary()
+        if self.last_fdata_check is not None:
+            result["fdata_check"] = self.last_fdata_check
+        return result
+
+    def acquire_s11(self, should_stop=None):
+        """Trigger one sweep and read S11 without analysis: (frequencies, s11_db, real, imag)."""
         self._require_connected()
         if not self.current_config:
             raise N9918ANAError("Configure an NA preset before measurement.")
+        if self.s11_source not in NA_S11_SOURCES:
+            raise N9918ANAError(f"Unknown S11 data source: {self.s11_source}")
 
         self._check_stop(should_stop)
-        self._write("CALC:FORM MLOG")
-        self._query("INIT:IMM;*OPC?")
-        self._check_stop(should_stop)
-        fdata = self._query("CALC:DATA:FDATa?")
-        self._check_stop(should_stop)
-        sdata = self._query("CALC:DATA:SDATA?")
+        try:
+            if self.s11_source == "FDATA" or self.verify_fdata:
+                self._write_setting("CALC:FORM MLOG")
+            self._query("INIT:IMM;*OPC?")
+        except Exception:
+            self.scpi_state.invalidate("NA measurement error")
+            raise
+        return self._read_s11(should_stop)
 
-        s11_db = parse_float_csv(fdata)
-        real, imag = parse_complex_csv(sdata)
+    def _read_s11(self, should_stop=None):
+        """读取已完成 sweep 的 SDATA（按需加 FDATa），返回 (frequencies, s11_db, real, imag)。"""
+        read_fdata = self.s11_source == "FDATA" or self.verify_fdata
+        self.last_data_transfers = []
+        try:
+            self._check_stop(should_stop)
+            sdata = self._query_data_values("CALC:DATA:SDATA?")
+            fdata_db = None
+            if read_fdata:
+                self._check_stop(should_stop)
+                fdata_db = self._query_data_values("CALC:DATA:FDATa?")
+        except N9918ANAError:
+            raise
+        except Exception:
+            self.scpi_state.invalidate("NA measurement error")
+            raise
+
+        if len(sdata) % 2 != 0:
+            raise N9918ANAError(
+                "SDATA must contain real/imag pairs.",
+                step="MEASURE",
+                last_scpi=self.last_scpi,
+                switch_position=self.last_switch_position,
+            )
+        gamma = complex_from_interleaved(sdata)
+        real, imag = gamma.real, gamma.imag
         points = int(self.current_config["points"])
-        if len(s11_db) != points:
+        if gamma.size != points:
             raise N9918ANAError(
-                f"FDATa point count mismatch: expected {points}, got {len(s11_db)}",
+                f"SDATA point count mismatch: expected {points}, got {gamma.size} complex points",
                 step="MEASURE",
                 last_scpi=self.last_scpi,
                 switch_position=self.last_switch_position,
             )
-        if len(real) != points or len(imag) != points:
+        if fdata_db is not None and len(fdata_db) != points:
             raise N9918ANAError(
-                f"SDATA point count mismatch: expected {points}, got {len(real)} complex points",
+                f"FDATa point count mismatch: expected {points}, got {len(fdata_db)}",
                 step="MEASURE",
                 last_scpi=self.last_scpi,
                 switch_position=self.last_switch_position,
             )
 
+        if self.s11_source == "FDATA":
+            s11_db = fdata_db
+            self.last_fdata_check = None
+        else:
+            s11_db = s11_db_from_complex(real, imag)
+            self.last_fdata_check = check_s11_against_fdata(s11_db, fdata_db) if fdata_db is not None else None
+            if self.last_fdata_check and not self.last_fdata_check["ok"]:
+                print(
+                    f"[WARN] SDATA 换算 S11 与 FDATa 不一致: 最大偏差 "
+                    f"{self.last_fdata_check['max_deviation_db']:.4f} dB @ 点 {self.last_fdata_check['worst_index']}"
+                )
+
         frequencies = frequency_axis(self.current_config["start_freq"], self.current_config["stop_freq"], points)
-        return build_na_result(
+        return frequencies, s11_db, real, imag
+
+    def measure_s11_adaptive(self, should_stop=None, coarse_points=None, zoom_points=ADAPTIVE_ZOOM_POINTS, max_zooms=ADAPTIVE_MAX_ZOOMS):
+        """
+        两段自适应测量：粗扫（预设点数/2、IFBW x10）找候选谷，再在每个谷 ±2 个粗扫点距内
+        用预设 IFBW 细扫，拼接后交给 build_na_result。细扫窗口在预设频段内，沿用当前校准（仪器插值）。
+        """
+        self._require_connected()
+        if not self.current_config:
+            raise N9918ANAError("Configure an NA preset before measurement.")
+        config = self.current_config
+        start_freq, stop_freq = float(config["start_freq"]), float(config["stop_freq"])
+        coarse_points = int(coarse_points or max(ADAPTIVE_MIN_COARSE_POINTS, int(config["points"]) // ADAPTIVE_COARSE_POINTS_DIVISOR))
+        coarse_ifbw = min(float(config["ifbw"]) * ADAPTIVE_COARSE_IFBW_FACTOR, max(ADAPTIVE_MAX_COARSE_IFBW, float(config["ifbw"])))
+        sweeps = []
+        transfers = _empty_data_transfer_stats()
+
+        def acquire(start, stop, points, ifbw, kind):
+            started = time.perf_counter()
+            data = self._acquire_segment(start, stop, points, ifbw, should_stop)
+            sweeps.append(
+                {
+                    "kind": kind,
+                    "start_freq": start,
+                    "stop_freq": stop,
+                    "points": points,
+                    "ifbw": ifbw,
+                    "resolution_hz": (stop - start) / max(points - 1, 1),
+                    "acquire_ms": (time.perf_counter() - started) * 1000.0,
+                }
+            )
+            for item in self.last_data_transfers:
+                transfers["reads"] += 1
+                transfers["bytes"] += item["bytes"]
+            return data
+
+        try:
+            coarse = acquire(start_freq, stop_freq, coarse_points, coarse_ifbw, "coarse")
+            windows = adaptive_zoom_windows(coarse[0], coarse[1], start_freq, stop_freq, max_zooms=max_zooms)
+            zooms = [acquire(low, high, int(zoom_points), float(config["ifbw"]), "zoom") for low, high in windows]
+        finally:
+            # 恢复预设扫描设置，后续普通测量/实时调试不受影响
+            self._restore_preset_sweep()
+
+        frequencies, s11_db, real, imag = merge_na_sweeps(coarse, zooms)
+        result = build_na_result(
             frequencies,
             s11_db,
             real,
             imag,
-            self.current_config,
+            dict(config, points=len(frequencies)),
             self.current_preset_key,
         )
+        dense_resolution = (stop_freq - start_freq) / max(int(config["points"]) - 1, 1)
+        result["adaptive_sweep"] = {
+            "sweeps": sweeps,
+            "zoom_count": len(zooms),
+            "merged_points": len(frequencies),
+            "total_acquire_ms": sum(item["acquire_ms"] for item in sweeps),
+            "dense_points": int(config["points"]),
+            "dense_resolution_hz": dense_resolution,
+            "zoom_resolution_hz": min((item["resolution_hz"] for item in sweeps if item["kind"] == "zoom"), default=None),
+            "data_reads": transfers["reads"],
+            "data_bytes": transfers["bytes"],
+        }
+        result["s11_source"] = self.s11_source
+        return result
+
+    def _acquire_segment(self, start_freq, stop_freq, points, ifbw, should_stop=None):
+        """临时改扫描范围/点数/IFBW 采一次 S11；current_config 在返回前复原。"""
+        preset_config = self.current_config
+        self.current_config = self._apply_segment_settings(start_freq, stop_freq, points, ifbw)
+        try:
+            return self.acquire_s11(should_stop)
+        finally:
+            self.current_config = preset_config
+
+    def _apply_segment_settings(self, start_freq, stop_freq, points, ifbw):
+        self._write_setting(f"SENS:FREQ:START {start_freq:.0f}")
+        self._write_setting(f"SENS:FREQ:STOP {stop_freq:.0f}")
+        self._write_setting(f"SENS:SWE:POIN {int(points)}")
+        self._write_setting(f"BWID {ifbw:g}")
+        return dict(self.current_config, start_freq=round(start_freq), stop_freq=round(stop_freq), points=int(points), ifbw=ifbw)
+
+    def measure_s11_segmented(self, segments=NA_FULL_SPAN_SEGMENTS, points_per_segment=NA_MAX_POINTS, on_segment=None, should_stop=None):
+        """
+        分段高分辨率全扫宽：把预设频段按 segments x points_per_segment 的统一频率网格切段，
+        每段以仪器最大点数扫描并写入预分配的 NumPy 缓冲区。下一段的 INIT:IMM 先发出，
+        仪器扫描期间在本地分析刚读回的一段（增量谷值检测），on_segment(progress) 推送阶段结果；
+        全部完成后对拼接曲线运行一次完整 build_na_result。
+        """
+        self._require_connected()
+        if not self.current_config:
+            raise N9918ANAError("Configure an NA preset before measurement.")
+        config = self.current_config
+        segments = int(segments)
+        points_per_segment = int(points_per_segment)
+        if segments < 1 or not 2 <= points_per_segment <= NA_MAX_POINTS:
+            raise N9918ANAError(f"Segmented sweep needs >= 1 segment and 2..{NA_MAX_POINTS} points per segment.")
+        buffer = SegmentedS11Buffer(config["start_freq"], config["stop_freq"], segments, points_per_segment)
+        ifbw = float(config["ifbw"])
+        started = time.perf_counter()
+        segment_stats = []
+        first_progress_ms = None
+
+        def start_sweep(index):
+            low, high = buffer.segment_range(index)
+            segment_config = self._apply_segment_settings(low, high, points_per_segment, ifbw)
+            self._write("INIT:IMM")
+            return segment_config, time.perf_counter()
+
+        preset_config = config
+        try:
+            pending = start_sweep(0)
+            for index in range(segments):
+                segment_config, sweep_started = pending
+                self._check_stop(should_stop)
+                self._query("*OPC?")
+                self.current_config = segment_config
+                try:
+                    frequencies, s11_db, real, imag = self._read_s11(should_stop)
+                finally:
+                    self.current_config = preset_config
+                acquired = time.perf_counter()
+                # 先触发下一段扫描，本段的拼接与谷值检测与仪器扫描重叠
+                if index + 1 < segments:
+                    pending = start_sweep(index + 1)
+                buffer.add_segment(index, frequencies, s11_db, real, imag)
+                progress = buffer.progress()
+                analysed = time.perf_counter()
+                segment_stats.append(
+                    {
+                        "start_freq": segment_config["start_freq"],
+                        "stop_freq": segment_config["stop_freq"],
+                        "points": points_per_segment,
+                        "acquire_ms": (acquired - sweep_started) * 1000.0,
+                        "analysis_ms": (analysed - acquired) * 1000.0,
+                    }
+                )
+                progress["elapsed_ms"] = (analysed - started) * 1000.0
+                if first_progress_ms is None:
+                    first_progress_ms = progress["elapsed_ms"]
+                if on_segment:
+                    on_segment(progress)
+        except N9918ANAError:
+            raise
+        except Exception:
+            self.scpi_state.invalidate("NA segmented sweep error")
+            raise
+        finally:
+            self.current_config = preset_config
+            self._restore_preset_sweep()
+
+        result = build_na_result(
+            buffer.frequencies,
+            buffer.s11_db,
+            buffer.gamma.real,
+            buffer.gamma.imag,
+            dict(config, points=buffer.total_points),
+            self.current_preset_key,
+        )
+        result["segmented_sweep"] = {
+            "segments": segment_stats,
+            "points_per_segment": points_per_segment,
+            "total_points": buffer.total_points,
+            "resolution_hz": buffer.resolution_hz,
+            "buffer_bytes": buffer.nbytes,
+            "first_progress_ms": first_progress_ms,
+            "total_ms": (time.perf_counter() - started) * 1000.0,
+        }
+        result["s11_source"] = self.s11_source
+        return result
+
+    def _restore_preset_sweep(self):
+        config = self.current_config
+        self._write_setting(f"SENS:FREQ:START {config['start_freq']}")
+        self._write_setting(f"SENS:FREQ:STOP {config['stop_freq']}")
+        self._write_setting(f"SENS:SWE:POIN {config['points']}")
+        self._write_setting(f"BWID {config['ifbw']}")
+
+    def stream_s11(self, on_frame, should_stop=None, max_frames=None, acquire=None):
+        """
+        连续调试模式：循环 INIT:IMM;*OPC? + 数据读取，每帧只算 build_na_frame() 轻量摘要。
+
+        on_frame(frame, raw) 在采集线程中同步调用，raw 为 acquire_s11() 的原始数组，
+        冻结时交给 build_na_result() 做完整分析。acquire 可替换数据来源（演示模式）。
+        停止后返回已推送的帧数。
+        """
+        acquire = acquire or self.acquire_s11
+        frames = 0
+        previous = None
+        while not (max_frames and frames >= max_frames):
+            if should_stop and should_stop():
+                break
+            started = time.monotonic()
+            try:
+                raw = acquire(should_stop)
+            except N9918ANAError as exc:
+                if exc.step == "STOPPED":
+                    break
+                raise
+            frame = build_na_frame(raw[0], raw[1], self.current_config)
+            finished = time.monotonic()
+            frame.update(
+                {
+                    "seq": frames,
+                    "acquire_ms": round((finished - started) * 1000.0, 3),
+                    "frame_interval_ms": round((finished - previous) * 1000.0, 3) if previous is not None else None,
+                    "frame_rate_hz": round(1.0 / (finished - previous), 3) if previous is not None and finished > previous else None,
+                }
+            )
+            previous = finished
+            on_frame(frame, raw)
+            frames += 1
+        return frames
+
+    def _query_data_values(self, command):
+        """
+        Read one CALC:DATA query: REAL,64 IEEE block -> float64 array, ASCII -> parsed CSV.
+
+        Bytes, transfer time and parse time are appended to last_data_transfers
+        and accumulated into data_transfer_stats.
+        """
+        self.last_scpi = command
+        start = time.perf_counter()
+        if self.data_format == "REAL64":
+            raw = self.device.query_binary_values(command, datatype="d", is_big_endian=True, container=np.array)
+            payload_bytes = len(raw) * 8
+            # IEEE 488.2 定长块: "#" + 长度位数 + 长度 + 数据 + 结束符。
+            n_bytes = payload_bytes + len(str(payload_bytes)) + 3
+        else:
+            raw = self.device.query(command)
+            n_bytes = len(str(raw))
+        transfer_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if self.data_format == "REAL64":
+            values = np.asarray(raw, dtype=np.float64)
+        else:
+            values = np.asarray(parse_float_csv(raw), dtype=np.float64)
+        parse_time = time.perf_counter() - start
+
+        self.last_data_transfers.append({
+            "command": command,
+            "format": self.data_format,
+            "values": int(values.size),
+            "bytes": n_bytes,
+            "transfer_time": transfer_time,
+            "parse_time": parse_time,
+        })
+        stats = self.data_transfer_stats
+        stats["reads"] += 1
+        stats["bytes"] += n_bytes
+        stats["transfer_time"] += transfer_time
+        stats["parse_time"] += parse_time
+        return values
 
     def _set_switch_position(self, switch_controller, position_key):
         positions = SWITCH_POSITIONS[position_key]
@@ -341,6 +910,14 @@ class N9918ANAController:
         self.last_scpi = command
         return self.device.query(command)
 
+    def _write_setting(self, command):
+        """写入设置命令；共享影子状态中值未变化时跳过。"""
+        if not self.scpi_state.filter_writes([command]):
+            return False
+        self._write(command)
+        self.scpi_state.record_write(command)
+        return True
+
     @staticmethod
     def _check_stop(should_stop):
         if should_stop and should_stop():
@@ -358,6 +935,16 @@ def parse_float_csv(raw):
     return values
 
 
+def _empty_data_transfer_stats():
+    return {"reads": 0, "bytes": 0, "transfer_time": 0.0, "parse_time": 0.0}
+
+
+def complex_from_interleaved(values):
+    """SDATA 的 re,im 交错 float64 数组 -> complex128 数组（不复制）。"""
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    return values.view(np.complex128)
+
+
 def parse_complex_csv(raw):
     values = parse_float_csv(raw)
     if len(values) % 2 != 0:
@@ -365,6 +952,25 @@ def parse_complex_csv(raw):
     return values[0::2], values[1::2]
 
 
+def s11_db_from_complex(real, imag):
+    """由复数 Gamma 计算 MLOG S11 (dB) = 20·log10|Γ|，与仪器 CALC:FORM MLOG 的 FDATa 一致。"""
+    magnitude = np.hypot(np.asarray(real, dtype=float), np.asarray(imag, dtype=float))
+    return (20.0 * np.log10(np.maximum(magnitude, MIN_GAMMA_MAGNITUDE))).tolist()
+
+
+def check_s11_against_fdata(s11_db, fdata_db, tolerance_db=FDATA_CHECK_TOLERANCE_DB):
+    """比较本地换算的 S11 dB 与仪器 FDATa；返回最大偏差及是否在容差内。"""
+    deviation = np.abs(np.asarray(s11_db, dtype=float) - np.asarray(fdata_db, dtype=float))
+    worst = int(np.argmax(deviation)) if deviation.size else 0
+    max_deviation = float(deviation[worst]) if deviation.size else 0.0
+    return {
+        "max_deviation_db": round(max_deviation, 6),
+        "worst_index": worst,
+        "tolerance_db": tolerance_db,
+        "ok": bool(max_deviation <= tolerance_db),
+    }
+
+
 def frequency_axis(start_hz, stop_hz, points):
     points = int(points)
     if points <= 1:
@@ -374,34 +980,43 @@ def frequency_axis(start_hz, stop_hz, points):
 
 
 def find_s11_valleys(frequencies, s11_db, min_separation_points=4, max_valleys=None, min_prominence_db=0.3):
-    if not frequencies or not s11_db or len(frequencies) != len(s11_db):
+    if len(frequencies) == 0 or len(s11_db) != len(frequencies):
         return []
     if len(s11_db) < 3:
         idx = min(range(len(s11_db)), key=lambda i: s11_db[i])
         return [_valley_dict(frequencies, s11_db, idx, 0.0)]
 
-    candidates = []
-    window = max(3, min(40, len(s11_db) // 80 or 3))
-    for idx in range(1, len(s11_db) - 1):
-        if s11_db[idx] <= s11_db[idx - 1] and s11_db[idx] <= s11_db[idx + 1]:
-            left_max = max(s11_db[max(0, idx - window):idx] or [s11_db[idx]])
-            right_max = max(s11_db[idx + 1:min(len(s11_db), idx + window + 1)] or [s11_db[idx]])
-            prominence = min(left_max, right_max) - s11_db[idx]
-            candidates.append((idx, prominence, s11_db[idx]))
-
-    if not candidates:
+    values = np.asarray(s11_db, dtype=float)
+    n = values.size
+    window = max(3, min(40, n // 80 or 3))
+    # 局部极小值：不高于左右相邻点
+    indices = np.flatnonzero((values[1:-1] <= values[:-2]) & (values[1:-1] <= values[2:])) + 1
+    if indices.size == 0:
         idx = min(range(len(s11_db)), key=lambda i: s11_db[i])
-        candidates = [(idx, 0.0, s11_db[idx])]
+        candidates = (np.array([idx]), np.array([0.0]))
     else:
-        meaningful = [item for item in candidates if item[1] >= min_prominence_db]
-        if meaningful:
-            candidates = meaningful
-
-    candidates.sort(key=lambda item: (item[2], -item[1]))
+        # 左侧 window 点与右侧 window 点内的最大值（越界部分用 -inf 填充）
+        padding = np.full(window, -np.inf)
+        left_max = sliding_window_view(np.concatenate([padding, values]), window).max(axis=1)[indices]
+        right_max = sliding_window_view(np.concatenate([values, padding]), window).max(axis=1)[indices + 1]
+        prominences = np.minimum(left_max, right_max) - values[indices]
+        meaningful = prominences >= min_prominence_db
+        if meaningful.any():
+            indices, prominences = indices[meaningful], prominences[meaningful]
+        candidates = (indices, prominences)
+
+    indices, prominences = candidates
+    # 按 S11 升序、显著度降序挑选；lexsort 稳定，同值保持频率顺序
+    order = np.lexsort((-prominences, values[indices]))
+    blocked = np.zeros(n, dtype=bool)
+    reach = max(0, int(min_separation_points) - 1)
     selected = []
-    for idx, prominence, _value in candidates:
-        if all(abs(idx - prev_idx) >= min_separation_points for prev_idx, _ in selected):
-            selected.append((idx, prominence))
+    for idx, prominence in zip(indices[order].tolist(), prominences[order].tolist()):
+        if min_separation_points > 0 and blocked[idx]:
+            continue
+        selected.append((idx, prominence))
+        if min_separation_points > 0:
+            blocked[max(0, idx - reach):idx + reach + 1] = True
         if max_valleys and len(selected) >= max_valleys:
             break
 
@@ -448,6 +1063,15 @@ def vswr_from_s11_db(s11_db):
     return round((1.0 + gamma) / (1.0 - gamma), 4)
 
 
+def vswr_array_from_s11_db(s11_db):
+    """vswr_from_s11_db 的数组版本（不取整），全反射点为 NaN。"""
+    gamma = 10 ** (np.asarray(s11_db, dtype=float) / 20.0)
+    vswr = np.full(gamma.shape, np.nan)
+    finite = gamma < 0.999999
+    vswr[finite] = (1.0 + gamma[finite]) / (1.0 - gamma[finite])
+    return vswr
+
+
 def impedance_from_gamma(real, imag, reference_ohm=REFERENCE_IMPEDANCE_OHM):
     if real is None or imag is None:
         return None
@@ -483,55 +1107,119 @@ def metric_point(label, frequency_hz, s11_db, point_type=None):
 
 
 def calculate_bandwidth(frequencies, s11_db, valley_index, threshold_db):
-    if not frequencies or not s11_db or valley_index is None:
+    if len(frequencies) == 0 or len(s11_db) == 0 or valley_index is None:
         return _empty_bandwidth(threshold_db)
-    if s11_db[valley_index] > threshold_db:
-        return _empty_bandwidth(threshold_db)
-
-    left_hz = frequencies[0]
-    left_s11 = s11_db[0]
-    left_complete = False
-    for idx in range(valley_index, 0, -1):
-        inside = s11_db[idx] <= threshold_db
-        outside = s11_db[idx - 1] > threshold_db
-        if inside and outside:
-            left_hz = interpolate_x(frequencies[idx - 1], s11_db[idx - 1], frequencies[idx], s11_db[idx], threshold_db)
+    return calculate_bandwidths(frequencies, s11_db, [valley_index], [threshold_db])[0]
+
+
+def calculate_bandwidths(frequencies, s11_db, valley_indices, thresholds_db):
+    """批量计算带宽：valley_indices[i] 处按 thresholds_db[i] 向两侧找穿越点，结果与逐个调用一致。"""
+    values = np.asarray(s11_db, dtype=float)
+    starts = np.asarray(valley_indices, dtype=np.int64)
+    thresholds = np.asarray([np.nan if t is None else t for t in thresholds_db], dtype=float)
+    usable = values[starts] <= thresholds
+    left = np.full(starts.size, -1, dtype=np.int64)
+    right = np.full(starts.size, -1, dtype=np.int64)
+    if usable.any():
+        left[usable] = _first_threshold_crossings(values, starts[usable], thresholds[usable], -1)
+        right[usable] = _first_threshold_crossings(values, starts[usable], thresholds[usable], 1)
+
+    results = []
+    for i, (valley_index, threshold_db) in enumerate(zip(starts.tolist(), thresholds_db)):
+        if not usable[i]:
+            results.append(_empty_bandwidth(threshold_db))
+            continue
+        j = int(left[i])
+        if j >= 0:
+            left_hz = interpolate_x(frequencies[j], s11_db[j], frequencies[j + 1], s11_db[j + 1], threshold_db)
             left_s11 = threshold_db
             left_complete = True
-            break
-    else:
-        left_complete = frequencies[0] != frequencies[valley_index] and s11_db[0] <= threshold_db
-
-    right_hz = frequencies[-1]
-    right_s11 = s11_db[-1]
-    right_complete = False
-    for idx in range(valley_index, len(s11_db) - 1):
-        inside = s11_db[idx] <= threshold_db
-        outside = s11_db[idx + 1] > threshold_db
-        if inside and outside:
-            right_hz = interpolate_x(frequencies[idx], s11_db[idx], frequencies[idx + 1], s11_db[idx + 1], threshold_db)
+        else:
+            left_hz = frequencies[0]
+            left_s11 = s11_db[0]
+            left_complete = bool(frequencies[0] != frequencies[valley_index] and s11_db[0] <= threshold_db)
+        j = int(right[i])
+        if j >= 0:
+            right_hz = interpolate_x(frequencies[j], s11_db[j], frequencies[j + 1], s11_db[j + 1], threshold_db)
             right_s11 = threshold_db
             right_complete = True
-            break
+        else:
+            right_hz = frequencies[-1]
+            right_s11 = s11_db[-1]
+            right_complete = bool(frequencies[-1] != frequencies[valley_index] and s11_db[-1] <= threshold_db)
+        results.append({
+            "left_hz": left_hz,
+            "right_hz": right_hz,
+            "width_hz": max(0.0, right_hz - left_hz),
+            "left_s11_db": left_s11,
+            "right_s11_db": right_s11,
+            "left_return_loss_db": return_loss_from_s11_db(left_s11),
+            "right_return_loss_db": return_loss_from_s11_db(right_s11),
+            "left_vswr": vswr_from_s11_db(left_s11),
+            "right_vswr": vswr_from_s11_db(right_s11),
+            "complete": left_complete and right_complete,
+            "threshold_db": threshold_db,
+            "threshold_return_loss_db": return_loss_from_s11_db(threshold_db),
+            "threshold_vswr": vswr_from_s11_db(threshold_db),
+        })
+    return results
+
+
+def _first_threshold_crossings(values, starts, thresholds, direction):
+    """从每个起点向左(-1)/右(+1)找第一个穿越区间 [j, j+1]，返回 j，找不到为 -1。
+
+    左侧条件 values[j] > t >= values[j+1]，j 从 start-1 递减；右侧条件 values[j] <= t < values[j+1]，
+    j 从 start 递增。多个起点共用的阈值（绝对 -3/-10dB）先求出全部穿越点再二分查找；
+    其余起点同时按倍增窗口向外扫描，代价与穿越点距离成正比。
+    """
+    last = values.size - 2
+    found = np.full(starts.size, -1, dtype=np.int64)
+    if last < 0:
+        return found
+    shared = np.zeros(starts.size, dtype=bool)
+    unique, counts = np.unique(thresholds, return_counts=True)
+    for threshold in unique[counts > 1]:
+        members = np.flatnonzero(thresholds == threshold)
+        shared[members] = True
+        if direction < 0:
+            edges = np.flatnonzero((values[:-1] > threshold) & (values[1:] <= threshold))
+            pos = np.searchsorted(edges, starts[members]) - 1
+            found[members] = np.where(pos >= 0, edges[np.maximum(pos, 0)] if edges.size else -1, -1)
+        else:
+            edges = np.flatnonzero((values[:-1] <= threshold) & (values[1:] > threshold))
+            pos = np.searchsorted(edges, starts[members])
+            found[members] = np.where(pos < edges.size, edges[np.minimum(pos, edges.size - 1)] if edges.size else -1, -1)
+
+    # 起点一侧没有任何点高于阈值时不可能穿越，直接排除，避免整段扫描
+    if direction < 0:
+        reachable = np.fmax.accumulate(values)[np.maximum(starts - 1, 0)] > thresholds
+        reachable &= starts > 0
     else:
-        right_complete = frequencies[-1] != frequencies[valley_index] and s11_db[-1] <= threshold_db
-
-    complete = left_complete and right_complete
-    return {
-        "left_hz": left_hz,
-        "right_hz": right_hz,
-        "width_hz": max(0.0, right_hz - left_hz),
-        "left_s11_db": left_s11,
-        "right_s11_db": right_s11,
-        "left_return_loss_db": return_loss_from_s11_db(left_s11),
-        "right_return_loss_db": return_loss_from_s11_db(right_s11),
-        "left_vswr": vswr_from_s11_db(left_s11),
-        "right_vswr": vswr_from_s11_db(right_s11),
-        "complete": complete,
-        "threshold_db": threshold_db,
-        "threshold_return_loss_db": return_loss_from_s11_db(threshold_db),
-        "threshold_vswr": vswr_from_s11_db(threshold_db),
-    }
+        reachable = np.fmax.accumulate(values[::-1])[::-1][np.minimum(starts + 1, last + 1)] > thresholds
+        reachable &= starts <= last
+    pending = np.flatnonzero(~shared & reachable)
+    offset, width = 0, 16
+    while pending.size:
+        steps = offset + np.arange(width)
+        if direction < 0:
+            j = starts[pending, None] - 1 - steps
+            valid = j >= 0
+        else:
+            j = starts[pending, None] + steps
+            valid = j <= last
+        jj = np.clip(j, 0, last)
+        t = thresholds[pending, None]
+        if direction < 0:
+            hit = (values[jj] > t) & (values[jj + 1] <= t) & valid
+        else:
+            hit = (values[jj] <= t) & (values[jj + 1] > t) & valid
+        any_hit = hit.any(axis=1)
+        first = hit.argmax(axis=1)
+        found[pending[any_hit]] = j[any_hit, first[any_hit]]
+        pending = pending[~any_hit & valid[:, -1]]
+        offset += width
+        width *= 2
+    return found
 
 
 def _empty_bandwidth(threshold_db):
@@ -560,16 +1248,15 @@ def interpolate_x(x0, y0, x1, y1, target_y):
 
 
 def interpolate_series(frequencies, values, target_hz):
-    if target_hz is None or not frequencies or not values:
+    if target_hz is None or len(frequencies) == 0 or len(values) == 0:
         return None
     if target_hz <= frequencies[0]:
         return values[0]
     if target_hz >= frequencies[-1]:
         return values[-1]
-    for idx in range(1, len(frequencies)):
-        if frequencies[idx] >= target_hz:
-            return _interpolate_y(frequencies[idx - 1], values[idx - 1], frequencies[idx], values[idx], target_hz)
-    return values[-1]
+    # 第一个 >= target_hz 的频点，与逐点向后查找一致
+    idx = int(np.searchsorted(np.asarray(frequencies, dtype=float), target_hz, side="left"))
+    return _interpolate_y(frequencies[idx - 1], values[idx - 1], frequencies[idx], values[idx], target_hz)
 
 
 def _interpolate_y(x0, y0, x1, y1, target_x):
@@ -579,6 +1266,13 @@ def _interpolate_y(x0, y0, x1, y1, target_x):
     return y0 + ratio * (y1 - y0)
 
 
+BANDWIDTH_KEYS = ("absolute_3db", "absolute_10db", "relative_3db", "relative_10db")
+
+
+def _bandwidth_thresholds(valley_s11):
+    return (-3.0, -10.0, valley_s11 + 3.0, valley_s11 + 10.0)
+
+
 def calculate_all_bandwidths(frequencies, s11_db, valley):
     if not valley:
         return {
@@ -587,14 +1281,23 @@ def calculate_all_bandwidths(frequencies, s11_db, valley):
             "relative_3db": _empty_bandwidth(None),
             "relative_10db": _empty_bandwidth(None),
         }
-    valley_index = valley["index"]
-    valley_s11 = valley["s11_db"]
-    return {
-        "absolute_3db": calculate_bandwidth(frequencies, s11_db, valley_index, -3.0),
-        "absolute_10db": calculate_bandwidth(frequencies, s11_db, valley_index, -10.0),
-        "relative_3db": calculate_bandwidth(frequencies, s11_db, valley_index, valley_s11 + 3.0),
-        "relative_10db": calculate_bandwidth(frequencies, s11_db, valley_index, valley_s11 + 10.0),
-    }
+    return calculate_valley_bandwidths(frequencies, s11_db, [valley])[0]
+
+
+def calculate_valley_bandwidths(frequencies, s11_db, valleys):
+    """一次性计算多个谷值的四种带宽（绝对 -3/-10dB、相对 +3/+10dB）。"""
+    if not valleys:
+        return []
+    if len(frequencies) == 0 or len(s11_db) == 0:
+        return [calculate_all_bandwidths(frequencies, s11_db, None) for _ in valleys]
+    indices = []
+    thresholds = []
+    for valley in valleys:
+        indices += [valley["index"]] * len(BANDWIDTH_KEYS)
+        thresholds += _bandwidth_thresholds(valley["s11_db"])
+    flat = calculate_bandwidths(frequencies, s11_db, indices, thresholds)
+    step = len(BANDWIDTH_KEYS)
+    return [dict(zip(BANDWIDTH_KEYS, flat[i:i + step])) for i in range(0, len(flat), step)]
 
 
 def bandwidth_for_valley(frequencies, s11_db, valley):
@@ -669,8 +1372,8 @@ def build_smith_payload(
 
     return {
         "reference_ohm": REFERENCE_IMPEDANCE_OHM,
-        "real": [round(v, 8) for v in real],
-        "imag": [round(v, 8) for v in imag],
+        "real": np.asarray(real, dtype=float),
+        "imag": np.asarray(imag, dtype=float),
         "markers": markers,
     }
 
@@ -725,7 +1428,7 @@ def build_points_of_interest(frequencies, s11_db, primary_valley_with_index, ban
 
 def build_target_summary(frequencies, s11_db, config, primary_valley_with_index):
     target_hz = (config or {}).get("target_freq")
-    if target_hz is None or not frequencies or not s11_db:
+    if target_hz is None or len(frequencies) == 0 or len(s11_db) == 0:
         return None
     target_hz = float(target_hz)
     if target_hz < frequencies[0] or target_hz > frequencies[-1]:
@@ -787,7 +1490,7 @@ def build_target_summary(frequencies, s11_db, config, primary_valley_with_index)
 
 def build_target_window(frequencies, s11_db, config):
     target_hz = (config or {}).get("target_freq")
-    if target_hz is None or not frequencies or not s11_db:
+    if target_hz is None or len(frequencies) == 0 or len(s11_db) == 0:
         return []
     target_hz = float(target_hz)
     points = []
@@ -823,12 +1526,194 @@ def target_match_status(summary):
     return "bad"
 
 
-def build_na_result(frequencies, s11_db, real=None, imag=None, config=None, preset_key=None):
+class SegmentedS11Buffer:
+    """
+    分段全扫宽的拼接缓冲区：按 segments x points_per_segment 预分配 NumPy 数组
+    （频率/S11 float64 + Gamma complex128，每点 32 字节），段到达顺序写入。
+
+    每段写入后做增量谷值检测：只重新分析新段加上一段 context 点的回看区间，
+    离已写入末端不足 context 点的谷留到下一段到达再确认，最后一段写入后全部确认。
+    这里的谷值是阶段结果，最终以完整曲线上的 build_na_result 为准。
+    """
+
+    def __init__(self, start_freq, stop_freq, segments, points_per_segment):
+        self.segments = int(segments)
+        self.points_per_segment = int(points_per_segment)
+        self.total_points = self.segments * self.points_per_segment
+        self.grid = np.linspace(float(start_freq), float(stop_freq), self.total_points)
+        self.resolution_hz = float(self.grid[1] - self.grid[0]) if self.total_points > 1 else 0.0
+        self.frequencies = np.empty(self.total_points)
+        self.s11_db = np.empty(self.total_points)
+        self.gamma = np.empty(self.total_points, dtype=np.complex128)
+        self.filled = 0
+        # 与 build_na_result 的最小谷间距规则一致
+        self.min_separation_points = max(3, self.total_points // 400)
+        self.context = max(self.min_separation_points, 40)
+        self._confirmed_end = 0
+        self._valleys: List[dict] = []
+
+    @property
+    def nbytes(self):
+        return self.frequencies.nbytes + self.s11_db.nbytes + self.gamma.nbytes
+
+    def segment_range(self, index):
+        first = index * self.points_per_segment
+        return float(self.grid[first]), float(self.grid[first + self.points_per_segment - 1])
+
+    def add_segment(self, index, frequencies, s11_db, real, imag):
+        first = index * self.points_per_segment
+        if first != self.filled:
+            raise ValueError(f"分段必须按顺序写入: 期望第 {self.filled // self.points_per_segment} 段，收到第 {index} 段")
+        last = first + self.points_per_segment
+        self.frequencies[first:last] = frequencies
+        self.s11_db[first:last] = s11_db
+        self.gamma.real[first:last] = real
+        self.gamma.imag[first:last] = imag
+        self.filled = last
+        self._update_valleys(final=last == self.total_points)
+
+    def _update_valleys(self, final):
+        low = max(0, self._confirmed_end - self.context)
+        found = find_s11_valleys(
+            self.frequencies[low:self.filled],
+            self.s11_db[low:self.filled],
+            min_separation_points=self.min_separation_points,
+        )
+        limit = self.filled if final else self.filled - self.context
+        for valley in found:
+            index = low + valley["index"]
+            # 没有显著谷的区间 find_s11_valleys 会退回全部局部极小值，阶段结果里只保留显著谷
+            if self._confirmed_end <= index < limit and valley["prominence_db"] >= 0.3:
+                self._valleys.append({**valley, "index": index})
+        self._confirmed_end = max(self._confirmed_end, limit)
+
+    def progress(self):
+        valleys = [{key: value for key, value in valley.items() if key != "index"} for valley in self._valleys]
+        return {
+            "segment": self.filled // self.points_per_segment,
+            "segments": self.segments,
+            "points_done": self.filled,
+            "total_points": self.total_points,
+            "frequency_done_hz": float(self.frequencies[self.filled - 1]) if self.filled else None,
+            "valleys": valleys,
+            "primary_valley": min(valleys, key=lambda item: item["s11_db"]) if valleys else None,
+        }
+
+
+def adaptive_zoom_windows(frequencies, s11_db, start_freq, stop_freq, max_zooms=ADAPTIVE_MAX_ZOOMS, max_s11_db=ADAPTIVE_ZOOM_MAX_S11_DB):
+    """由粗扫曲线挑细扫窗口：最深的 max_zooms 个足够深的谷，各取 ±2 个粗扫点距，重叠窗口合并。"""
     frequencies = [float(v) for v in frequencies]
     s11_db = [float(v) for v in s11_db]
-    real = [float(v) for v in (real if real is not None else [0.0] * len(frequencies))]
-    imag = [float(v) for v in (imag if imag is not None else [0.0] * len(frequencies))]
+    valleys = find_s11_valleys(frequencies, s11_db, min_separation_points=3)
+    if not valleys:
+        return []
+    deepest = min(valleys, key=lambda item: item["s11_db"])
+    candidates = sorted(
+        (item for item in valleys if item is deepest or item["s11_db"] <= max_s11_db),
+        key=lambda item: item["s11_db"],
+    )[: max(1, int(max_zooms))]
+    step = (frequencies[-1] - frequencies[0]) / max(len(frequencies) - 1, 1)
+    half_width = ADAPTIVE_ZOOM_HALF_WIDTH_STEPS * step
+    windows = []
+    for low, high in sorted(
+        (max(start_freq, item["frequency_hz"] - half_width), min(stop_freq, item["frequency_hz"] + half_width))
+        for item in candidates
+    ):
+        if windows and low <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], high))
+        else:
+            windows.append((low, high))
+    return windows
+
+
+def merge_na_sweeps(coarse, zooms):
+    """粗扫与细扫拼成按频率排序的一条曲线：细扫窗口内的粗扫点由细扫点替换。返回 4 个 ndarray。"""
+    coarse = [np.asarray(values, dtype=float) for values in coarse]
+    keep = np.ones(coarse[0].size, dtype=bool)
+    parts = []
+    for zoom in zooms:
+        zoom = [np.asarray(values, dtype=float) for values in zoom]
+        # 窗口端点与粗扫点可能只差取整误差，半个细扫点距内的粗扫点一并丢弃
+        margin = 0.5 * (zoom[0][-1] - zoom[0][0]) / max(zoom[0].size - 1, 1)
+        keep &= (coarse[0] < zoom[0][0] - margin) | (coarse[0] > zoom[0][-1] + margin)
+        parts.append(zoom)
+    parts.append([values[keep] for values in coarse])
+    merged = [np.concatenate([part[column] for part in parts]) for column in range(4)]
+    order = np.argsort(merged[0], kind="stable")
+    return tuple(values[order] for values in merged)
+
+
+def build_na_frame(frequencies, s11_db, config=None, max_trace_points=NA_FRAME_TRACE_POINTS):
+    """实时调试用的轻量帧：主谷值、理想频点 S11、主谷值 -10dB 带宽和抽稀后的 S11 曲线。"""
+    freqs = np.asarray(frequencies, dtype=float)
+    values = np.asarray(s11_db, dtype=float)
+    if values.size == 0:
+        return {"points": 0, "primary_valley": None, "target": None, "bandwidth_10db": None, "trace": None}
+
+    valley_index = int(np.argmin(values))
+    primary = metric_point("中心谷", float(freqs[valley_index]), float(values[valley_index]), "center")
+    bandwidth = calculate_bandwidths(freqs.tolist(), values.tolist(), [valley_index], [-10.0])[0]
+
+    target = None
+    target_hz = (config or {}).get("target_freq")
+    if target_hz:
+        target = metric_point("理想频点", float(target_hz), float(np.interp(target_hz, freqs, values)), "target")
+
+    if values.size > max_trace_points:
+        per_bin = -(-values.size // max_trace_points)
+        padded = np.full(per_bin * -(-values.size // per_bin), np.inf)
+        padded[:values.size] = values
+        trace_index = np.arange(padded.size // per_bin) * per_bin + padded.reshape(-1, per_bin).argmin(axis=1)
+    else:
+        trace_index = np.arange(values.size)
+
+    return {
+        "points": int(values.size),
+        "primary_valley": primary,
+        "target": target,
+        "bandwidth_10db": {
+            "left_hz": bandwidth["left_hz"],
+            "right_hz": bandwidth["right_hz"],
+            "width_hz": bandwidth["width_hz"],
+            "complete": bandwidth["complete"],
+        },
+        "trace": {
+            "frequency_mhz": np.round(freqs[trace_index] / 1e6, 6).tolist(),
+            "s11_db": np.round(values[trace_index], 3).tolist(),
+        },
+        "timestamp": time.time(),
+    }
+
+
+class _StageTimer:
+    """Accumulates perf_counter laps into a caller-supplied dict; a no-op when timings is None."""
+
+    def __init__(self, timings: Optional[dict]):
+        self.timings = timings
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str) -> None:
+        if self.timings is None:
+            return
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + (now - self._last)
+        self._last = now
+
+
+def build_na_result(frequencies, s11_db, real=None, imag=None, config=None, preset_key=None, timings=None):
+    """
+    timings: optional dict that receives per-stage seconds (valleys, bandwidths, smith, ...).
+
+    曲线（series、smith real/imag）保持为 NumPy 数组，分段全扫宽的缓冲区不会被复制成 Python 列表；
+    JSON/CSV/报告输出前用 na_result_lists() 转换。
+    """
+    timer = _StageTimer(timings)
+    frequencies = np.asarray(frequencies, dtype=float)
+    s11_db = np.asarray(s11_db, dtype=float)
+    real = np.asarray(real, dtype=float) if real is not None else np.zeros(frequencies.size)
+    imag = np.asarray(imag, dtype=float) if imag is not None else np.zeros(frequencies.size)
     full_sweep = bool(config.get("full_sweep")) if config else False
+    timer.lap("inputs")
 
     max_valleys = None if full_sweep else 50
     valleys = find_s11_valleys(
@@ -837,9 +1722,11 @@ def build_na_result(frequencies, s11_db, real=None, imag=None, config=None, pres
         min_separation_points=max(3, len(frequencies) // 400),
         max_valleys=max_valleys,
     )
+    timer.lap("valleys")
     primary_with_index = min(valleys, key=lambda item: item["s11_db"]) if valleys else None
     primary = choose_primary_valley(valleys)
     bandwidths = calculate_all_bandwidths(frequencies, s11_db, primary_with_index)
+    timer.lap("bandwidths")
     points_of_interest = build_points_of_interest(frequencies, s11_db, primary_with_index, bandwidths)
     target_summary = build_target_summary(frequencies, s11_db, config, primary_with_index)
     target_window = build_target_window(frequencies, s11_db, config)
@@ -848,13 +1735,14 @@ def build_na_result(frequencies, s11_db, real=None, imag=None, config=None, pres
             1 if primary_with_index else 0,
             metric_point("理想频点", target_summary["target_frequency_hz"], target_summary["target_s11_db"], "target"),
         )
+    timer.lap("target")
 
     valleys_payload = []
-    for valley in valleys:
-        bw = bandwidth_for_valley(frequencies, s11_db, valley)
+    for valley, bw in zip(valleys, calculate_valley_bandwidths(frequencies, s11_db, valleys)):
         item = {k: v for k, v in valley.items() if k != "index"}
         item["bandwidths"] = bw
         valleys_payload.append(item)
+    timer.lap("valley_bandwidths")
 
     smith = build_smith_payload(
         frequencies,
@@ -866,14 +1754,15 @@ def build_na_result(frequencies, s11_db, real=None, imag=None, config=None, pres
         full_sweep=full_sweep,
         target_summary=target_summary,
     )
-    return {
+    timer.lap("smith")
+    result = {
         "config": config or {},
         "preset_key": preset_key,
         "series": {
-            "frequency_mhz": [round(freq / 1e6, 6) for freq in frequencies],
-            "s11_db": [round(value, 4) for value in s11_db],
-            "return_loss_db": [return_loss_from_s11_db(value) for value in s11_db],
-            "vswr": [vswr_from_s11_db(value) for value in s11_db],
+            "frequency_mhz": frequencies / 1e6,
+            "s11_db": s11_db,
+            "return_loss_db": -s11_db,
+            "vswr": vswr_array_from_s11_db(s11_db),
         },
         "smith": smith,
         "primary_valley": primary,
@@ -885,11 +1774,46 @@ def build_na_result(frequencies, s11_db, real=None, imag=None, config=None, pres
         "is_full_sweep": full_sweep,
         "measurement_time": time.strftime("%Y-%m-%d %H:%M:%S"),
     }
+    timer.lap("series")
+    return result
+
+
+def _rounded_list(values, digits):
+    if values is None or isinstance(values, list):
+        return values
+    return [None if value != value else round(value, digits) for value in np.asarray(values, dtype=float).tolist()]
+
+
+def _series_lists(series):
+    if isinstance(series.get("s11_db"), list):
+        return dict(series)
+    # 逐点用 Python round() 与旧版列表输出保持一致（np.round 在末位可能差 1e-4）
+    s11_values = np.asarray(series["s11_db"], dtype=float).tolist()
+    converted = {key: _rounded_list(values, 4) for key, values in series.items()}
+    converted["frequency_mhz"] = _rounded_list(series["frequency_mhz"], 6)
+    converted["s11_db"] = [round(value, 4) for value in s11_values]
+    converted["return_loss_db"] = [return_loss_from_s11_db(value) for value in s11_values]
+    converted["vswr"] = [vswr_from_s11_db(value) for value in s11_values]
+    return converted
+
+
+def na_result_lists(result):
+    """build_na_result 的浅拷贝，曲线数组转成取整后的列表（NaN 记为 None），供 JSON/CSV/报告使用。"""
+    if not result:
+        return result
+    converted = dict(result)
+    if result.get("series") is not None:
+        converted["series"] = _series_lists(result["series"])
+    if result.get("smith"):
+        smith = result["smith"]
+        converted["smith"] = dict(smith, real=_rounded_list(smith["real"], 8), imag=_rounded_list(smith["imag"], 8))
+    return converted
 
 
 def save_na_measurement_data(result, filename_prefix=None, output_dir="measurement_data"):
     if not result or not result.get("series"):
         raise ValueError("No NA result to save.")
+    result = na_result_lists(result)
     output = Path(output_dir)
     output.mkdir(exist_ok=True)
     if filename_prefix is None:
@@ -931,11 +1855,261 @@ def save_na_measurement_data(result, filename_prefix=None, output_dir="measureme
     return saved
 
 
+def default_s11_mask(config):
+    """预设默认掩模：理想频点 ±0.5% 内 S11 <= -10dB；没有理想频点（全扫宽）时为空。"""
+    target = (config or {}).get("target_freq")
+    if not target:
+        return []
+    half_width = float(target) * DEFAULT_MASK_HALF_WIDTH_RATIO
+    return [
+        {
+            "label": "目标频带",
+            "start_freq": float(target) - half_width,
+            "stop_freq": float(target) + half_width,
+            "max_s11_db": DEFAULT_MASK_MAX_S11_DB,
+        }
+    ]
+
+
+def normalize_s11_mask(mask, config=None):
+    """校验掩模段 [{start_freq, stop_freq, max_s11_db, label?}]，必须落在扫描范围内。"""
+    segments = []
+    for index, segment in enumerate(mask or []):
+        try:
+            start = float(segment["start_freq"])
+            stop = float(segment["stop_freq"])
+            limit = float(segment["max_s11_db"])
+        except (KeyError, TypeError, ValueError) as exc:
+            raise ValueError(f"S11 掩模第 {index + 1} 段缺少 start_freq/stop_freq/max_s11_db") from exc
+        if stop < start:
+            raise ValueError(f"S11 掩模第 {index + 1} 段 stop_freq 小于 start_freq")
+        if config and (start < config["start_freq"] or stop > config["stop_freq"]):
+            raise ValueError(f"S11 掩模第 {index + 1} 段超出扫描范围")
+        segments.append({"label": segment.get("label") or f"段 {index + 1}", "start_freq": start, "stop_freq": stop, "max_s11_db": limit})
+    return segments
+
+
+def evaluate_s11_mask(frequencies, s11_db, mask):
+    """按掩模判定 PASS/FAIL：每段取段内所有点及两端插值点，余量 = 上限 - S11。"""
+    freqs = np.asarray(frequencies, dtype=float)
+    values = np.asarray(s11_db, dtype=float)
+    segments = []
+    for segment in mask:
+        inside = (freqs >= segment["start_freq"]) & (freqs <= segment["stop_freq"])
+        edges = np.array([segment["start_freq"], segment["stop_freq"]])
+        seg_freqs = np.concatenate([freqs[inside], edges])
+        seg_values = np.concatenate([values[inside], np.interp(edges, freqs, values)])
+        margins = segment["max_s11_db"] - seg_values
+        worst = int(np.argmin(margins))
+        segments.append(
+            {
+                "label": segment["label"],
+                "pass": bool(margins[worst] >= 0),
+                "worst_margin_db": round(float(margins[worst]), 4),
+                "worst_frequency_hz": float(seg_freqs[worst]),
+            }
+        )
+    return {
+        "pass": all(item["pass"] for item in segments),
+        "worst_margin_db": min((item["worst_margin_db"] for item in segments), default=None),
+        "segments": segments,
+    }
+
+
+class NABatchSession:
+    """
+    产线批量会话：预设与校准固定，每台 DUT 追加一行紧凑结果，完整报告可稍后由原始数据补出。
+
+    目录结构：
+      header.json - 版本、预设、配置、S11 掩模、点数、元数据、closed 标记
+      units.jsonl - 每台一行：序号、序列号、PASS/FAIL、主谷值、理想频点 S11、-10dB 带宽、掩模余量、耗时
+      gamma.c64   - units x points 复数 Gamma（complex64，行优先）
+
+    对已存在的目录构造时重新打开会话：丢弃写了一半的 JSON 行，并按有效行数截断 gamma.c64。
+    """
+
+    FORMAT_VERSION = 1
+    HEADER_FILE = "header.json"
+    UNITS_FILE = "units.jsonl"
+    GAMMA_FILE = "gamma.c64"
+
+    def __init__(self, path, config=None, preset_key=None, mask=None, metadata=None):
+        self.path = Path(path)
+        self.config = dict(config or {})
+        self.preset_key = preset_key
+        self.mask = []
+        self.metadata = dict(metadata or {})
+        self.created = time.time()
+        self.recovered = False
+        self.closed = False
+        self._units: List[dict] = []
+        self.path.mkdir(parents=True, exist_ok=True)
+        if (self.path / self.HEADER_FILE).exists():
+            self._reopen()
+        else:
+            if not self.config:
+                raise ValueError("新建批量会话需要 NA 配置。")
+            self.mask = normalize_s11_mask(default_s11_mask(self.config) if mask is None else mask, self.config)
+            (self.path / self.UNITS_FILE).touch()
+            (self.path / self.GAMMA_FILE).touch()
+            self._write_header()
+        self.frequencies = frequency_axis(self.config["start_freq"], self.config["stop_freq"], self.n_points)
+
+    @property
+    def n_points(self) -> int:
+        return int(self.config["points"])
+
+    @property
+    def report_dir(self) -> Path:
+        return self.path / "reports"
+
+    def _write_header(self):
+        header = {
+            "version": self.FORMAT_VERSION,
+            "preset_key": self.preset_key,
+            "config": self.config,
+            "mask": self.mask,
+            "n_points": self.n_points,
+            "gamma_dtype": "complex64",
+            "created": self.created,
+            "unit_count": len(self._units),
+            "closed": self.closed,
+            "updated": datetime.now().isoformat(timespec="seconds"),
+            "metadata": self.metadata,
+        }
+        temp_path = self.path / (self.HEADER_FILE + ".tmp")
+        temp_path.write_text(json.dumps(header, ensure_ascii=False, indent=2), encoding="utf-8")
+        temp_path.replace(self.path / self.HEADER_FILE)
+
+    def _reopen(self):
+        header = json.loads((self.path / self.HEADER_FILE).read_text(encoding="utf-8"))
+        if header.get("version") != self.FORMAT_VERSION:
+            raise ValueError(f"不支持的批量会话版本: {header.get('version')}")
+        self.config = header["config"]
+        self.preset_key = header.get("preset_key")
+        self.mask = header.get("mask") or []
+        self.metadata = header.get("metadata") or self.metadata
+        self.created = header.get("created", self.created)
+
+        row_bytes = self.n_points * 8
+        gamma_rows = (self.path / self.GAMMA_FILE).stat().st_size // row_bytes
+        units = []
+        for line in (self.path / self.UNITS_FILE).read_text(encoding="utf-8").splitlines():
+            try:
+                unit = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            if unit.get("row") != len(units) or len(units) >= gamma_rows:
+                break
+            units.append(unit)
+        self._units = units
+        # 只保留两边都完整的行，保证后续追加对齐
+        (self.path / self.UNITS_FILE).write_text(
+            "".join(json.dumps(unit, ensure_ascii=False) + "\n" for unit in units), encoding="utf-8"
+        )
+        os.truncate(self.path / self.GAMMA_FILE, len(units) * row_bytes)
+        self.recovered = not header.get("closed", False)
+        if self.recovered:
+            print(f"[WARN] 批量会话 {self.path} 未正常结束，已恢复 {len(units)} 台记录")
+        self.closed = False
+
+    def record_unit(self, serial, frequencies, s11_db, real, imag, elapsed_s=None):
+        """判定并追加一台 DUT；返回写入 units.jsonl 的紧凑记录。"""
+        if self.closed:
+            raise ValueError("批量会话已结束。")
+        gamma = np.asarray(real, dtype=np.float64) + 1j * np.asarray(imag, dtype=np.float64)
+        if gamma.size != self.n_points:
+            raise ValueError(f"点数不一致: {gamma.size} != {self.n_points}")
+        frame = build_na_frame(frequencies, s11_db, self.config)
+        mask_result = evaluate_s11_mask(frequencies, s11_db, self.mask)
+        primary = frame["primary_valley"] or {}
+        target = frame["target"] or {}
+        serial = str(serial)
+        now = time.time()
+        record = {
+            "row": len(self._units),
+            "serial": serial,
+            "time": round(now, 3),
+            "timestamp": datetime.fromtimestamp(now).isoformat(timespec="seconds"),
+            "pass": mask_result["pass"],
+            "retest": any(unit["serial"] == serial for unit in self._units),
+            "primary_frequency_hz": primary.get("frequency_hz"),
+            "primary_s11_db": _round_or_none(primary.get("s11_db"), 4),
+            "target_s11_db": _round_or_none(target.get("s11_db"), 4),
+            "bandwidth_10db_hz": _round_or_none(frame["bandwidth_10db"]["width_hz"], 1),
+            "mask_worst_margin_db": mask_result["worst_margin_db"],
+            "mask_segments": mask_result["segments"],
+            "elapsed_ms": _round_or_none(elapsed_s * 1000.0 if elapsed_s is not None else None, 3),
+        }
+        # 先写 Gamma 再写 JSON 行：JSON 行是这台记录的提交点
+        with open(self.path / self.GAMMA_FILE, "ab") as handle:
+            handle.write(gamma.astype(np.complex64).tobytes())
+        with open(self.path / self.UNITS_FILE, "a", encoding="utf-8") as handle:
+            handle.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._units.append(record)
+        return record
+
+    def units(self):
+        return [dict(unit) for unit in self._units]
+
+    def unit_gamma(self, row):
+        return np.fromfile(self.path / self.GAMMA_FILE, dtype=np.complex64, count=self.n_points, offset=int(row) * self.n_points * 8)
+
+    def unit_result(self, row):
+        """由保存的 Gamma 重建一台的完整 build_na_result，供报告使用。"""
+        unit = self._units[int(row)]
+        gamma = self.unit_gamma(row).astype(np.complex128)
+        result = build_na_result(
+            self.frequencies,
+            s11_db_from_complex(gamma.real, gamma.imag),
+            gamma.real,
+            gamma.imag,
+            self.config,
+            self.preset_key,
+        )
+        result["dut_serial"] = unit["serial"]
+        result["mask_result"] = {"pass": unit["pass"], "segments": unit["mask_segments"]}
+        return result
+
+    def summary(self):
+        """通过率与产能：units_per_hour 按会话开始到最后一台的墙钟时间，cycle_units_per_hour 按单台测量耗时。"""
+        count = len(self._units)
+        passed = sum(1 for unit in self._units if unit["pass"])
+        elapsed = [unit["elapsed_ms"] for unit in self._units if unit.get("elapsed_ms")]
+        span_s = self._units[-1]["time"] - self.created if count else 0.0
+        mean_cycle_ms = sum(elapsed) / len(elapsed) if elapsed else None
+        return {
+            "path": str(self.path),
+            "preset_key": self.preset_key,
+            "mask": self.mask,
+            "units": count,
+            "passed": passed,
+            "failed": count - passed,
+            "pass_rate": passed / count if count else None,
+            "retests": sum(1 for unit in self._units if unit.get("retest")),
+            "units_per_hour": count / span_s * 3600.0 if count and span_s > 0 else None,
+            "mean_cycle_ms": mean_cycle_ms,
+            "cycle_units_per_hour": 3600000.0 / mean_cycle_ms if mean_cycle_ms else None,
+            "recovered": self.recovered,
+            "closed": self.closed,
+        }
+
+    def close(self):
+        self.closed = True
+        self._write_header()
+        return self.summary()
 
 
-def export_na_report(result, user_info=None, output_dir="reports"):
+def _round_or_none(value, digits):
+    return None if value is None else round(float(value), digits)
+
+
+def export_na_report(result, user_info=None, output_dir="reports", timings=None, filename=None):
+    """timings: optional dict that receives seconds per PDF page type (build + savefig)."""
+    timer = _StageTimer(timings)
     if not result or not result.get("series"):
         raise ValueError("No NA result to export.")
+    result = na_result_lists(result)
 
     try:
         import matplotlib
@@ -951,31 +2125,31 @@ def export_na_report(result, user_info=None, output_dir="reports"):
     output.mkdir(exist_ok=True)
     config = result.get("config") or {}
     label = config.get("label") or result.get("preset_key") or "NA"
-    filename = safe_filename(f"NA天线测量-{label}-{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf")
+    filename = safe_filename(filename or f"NA天线测量-{label}-{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf")
     path = output / filename
     font = _load_report_font(FontProperties)
     logo_path = Path(__file__).resolve().parent / "assets" / "m5logo2022.png"
+    timer.lap("pdf_setup")
 
-    with PdfPages(path) as pdf:
-        chart_pages = [
-            _build_na_summary_page(plt, result, user_info or {}, logo_path, font),
-            _build_na_s11_page(plt, result, logo_path, font),
-            _build_na_vswr_page(plt, result, logo_path, font),
-        ]
-        if not result.get("is_full_sweep"):
-            chart_pages.append(_build_na_smith_page(plt, result, logo_path, font))
-
-        for fig in chart_pages:
-            pdf.savefig(fig)
-            plt.close(fig)
-
-        for fig in _build_na_detail_pages(plt, result, user_info or {}, logo_path, font):
-            pdf.savefig(fig)
-            plt.close(fig)
+    page_builders = [
+        ("page_summary", lambda: [_build_na_summary_page(plt, result, user_info or {}, logo_path, font)]),
+        ("page_s11", lambda: [_build_na_s11_page(plt, result, logo_path, font)]),
+        ("page_vswr", lambda: [_build_na_vswr_page(plt, result, logo_path, font)]),
+    ]
+    if not result.get("is_full_sweep"):
+        page_builders.append(("page_smith", lambda: [_build_na_smith_page(plt, result, logo_path, font)]))
+    page_builders += [
+        ("page_details", lambda: _build_na_detail_pages(plt, result, user_info or {}, logo_path, font)),
+        ("page_valleys", lambda: _build_na_valley_pages(plt, result, logo_path, font)),
+    ]
 
-        for fig in _build_na_valley_pages(plt, result, logo_path, font):
-            pdf.savefig(fig)
-            plt.close(fig)
+    with PdfPages(path) as pdf:
+        for stage, build_pages in page_builders:
+            for fig in build_pages():
+                pdf.savefig(fig)
+                plt.close(fig)
+            timer.lap(stage)
+    timer.lap("pdf_close")
 
     return path
 
@@ -1,10 +1,12 @@
 import os
+import queue
 import re
 import tempfile
 import threading
 import time
 import math
 import random
+from datetime import datetime
 from pathlib import Path
 
 import matplotlib
@@ -14,7 +16,7 @@ import matplotlib.pyplot as plt
 
 from n9918a_backend import (
     N9918AController,
-    get_fcc_ce_limits,
+    compile_limit_table,
     linear_average_dbuv,
     post_process_peak_search,
     save_emi_measurement_data,
@@ -22,14 +24,21 @@ from n9918a_backend import (
     save_spectrum_data,
 )
 from n9918a_na_backend import (
+    NA_FULL_SPAN_SEGMENTS,
+    NA_MAX_POINTS,
     NA_PRESET_CONFIGS,
     N9918ANAController,
     N9918ANAError,
+    NABatchSession,
+    NACalibrationCache,
+    SegmentedS11Buffer,
     build_na_result,
     export_na_report,
     frequency_axis,
+    na_result_lists,
     save_na_measurement_data,
 )
+from scpi_state import SCPIShadowState
 
 ROOT = Path(__file__).resolve().parent
 try:
@@ -49,8 +58,14 @@ class SATestService:
     """Hardware workflow service shared by the web API."""
 
     def __init__(self, default_ip="192.168.20.233"):
-        self.controller = N9918AController(ip_address=default_ip)
-        self.na_controller = N9918ANAController(ip_address=default_ip)
+        # SA/NA 控制器操作同一台 FieldFox，共用一份 SCPI 影子状态。
+        self.scpi_state = SCPIShadowState()
+        self.controller = N9918AController(ip_address=default_ip, scpi_state=self.scpi_state)
+        # 每个校准条件的状态文件存在仪器上，本地只记索引与保存时间
+        self.na_cal_cache = NACalibrationCache(ROOT / "measurement_data" / "na_cal_cache.json")
+        self.na_controller = N9918ANAController(
+            ip_address=default_ip, scpi_state=self.scpi_state, calibration_cache=self.na_cal_cache
+        )
         self.switch_controller = MiniCircuitsSwitchController() if MiniCircuitsSwitchController else None
         self.lock = threading.RLock()
         self.stop_event = threading.Event()
@@ -75,6 +90,21 @@ class SATestService:
         self.na_result = None
         self.na_calibration = self._empty_na_calibration()
         self.na_last_report_path = None
+        # NA 实时调试：采集线程只推送轻量帧，冻结时才对最后一帧做完整分析。
+        self.na_live_condition = threading.Condition(self.lock)
+        self.na_live_active = False
+        self.na_live_frame = None
+        self.na_live_raw = None
+        # 分段全扫宽的阶段结果（已完成段数、已确认谷值）
+        self.na_segment_progress = None
+        # NA 产线批量：会话固定预设与校准，PDF 报告交给后台队列，不占测量节拍。
+        self.na_batch = None
+        self.na_batch_last_unit = None
+        self.na_report_queue = queue.Queue()
+        self.na_report_worker = None
+        self.na_report_stats = {"queued": 0, "pending": 0, "done": 0, "failed": 0, "last_error": None}
+        # pyplot 的全局 figure 状态不是线程安全的：后台报告队列与请求线程的 SA/NA 报告渲染串行执行
+        self.report_lock = threading.Lock()
 
         self.user_info = {
             "customer": "M5Stack",
@@ -143,6 +173,8 @@ class SATestService:
         with self.lock:
             if self.measurement_in_progress:
                 raise ServiceError("已有测量或校准正在进行，不能切换模式。")
+            if self.na_batch is not None and mode != self.current_mode:
+                raise ServiceError("NA 批量会话进行中，不能切换模式，请先结束批量。")
             if self.current_mode == mode and not self.switching_mode:
                 return self.mode_status()
             self.switching_mode = True
@@ -188,7 +220,7 @@ class SATestService:
                 raise ServiceError("无法连接 N9918A SA 控制器，模式切换失败。")
             return
         if self.controller.device:
-            self.controller.device.query("INST:SEL 'SA';*OPC?")
+            self.controller.select_mode()
 
     def _clear_sa_results_locked(self):
         self.current_frequencies = None
@@ -394,13 +426,16 @@ class SATestService:
         self._start_measurement_thread("单次扫描", self._run_single_measurement)
         return self.status()
 
-    def start_emi_measurement(self, duration_seconds):
+    def start_emi_measurement(self, duration_seconds, acquisition_mode="PER_SWEEP", capture_to_disk=False):
         duration_seconds = int(duration_seconds)
         if duration_seconds <= 0:
             raise ServiceError("测量时长必须大于 0。")
+        acquisition_mode = str(acquisition_mode or "PER_SWEEP").upper()
+        if acquisition_mode not in N9918AController.ACQUISITION_MODES:
+            raise ServiceError(f"未知采集模式：{acquisition_mode}")
         self._start_measurement_thread(
             f"EMI {duration_seconds} 秒采样",
-            lambda: self._run_emi_measurement(duration_seconds),
+            lambda: self._run_emi_measurement(duration_seconds, acquisition_mode, bool(capture_to_disk)),
         )
         return self.status()
 
@@ -493,19 +528,26 @@ class SATestService:
                 self.measurement_in_progress = False
                 self.measurement_kind = None
 
-    def _run_emi_measurement(self, duration_seconds):
+    def _run_emi_measurement(self, duration_seconds, acquisition_mode="PER_SWEEP", capture_to_disk=False):
         if self.demo_mode:
             try:
                 time.sleep(0.4)
                 results = self._generate_demo_results(duration_seconds)
-                frequencies, amplitudes = results["QUASI_PEAK"]
-                peaks = post_process_peak_search(frequencies, amplitudes, detector_type="QUASI_PEAK")
+                if acquisition_mode == "TRACE_HOLD":
+                    results.pop("QUASI_PEAK", None)
+                    results.pop("sampling_data", None)
+                    results["measurement_summary"]["modes_computed"] = ["PEAK", "AVERAGE"]
+                    results["measurement_summary"]["quasi_peak_estimated"] = False
+                results["measurement_summary"]["acquisition_mode"] = acquisition_mode
+                display_mode = "QUASI_PEAK" if "QUASI_PEAK" in results else "PEAK"
+                frequencies, amplitudes = results[display_mode]
+                peaks = post_process_peak_search(frequencies, amplitudes, detector_type=display_mode)
                 with self.lock:
                     self.emi_results = results
                     self.current_frequencies = frequencies
                     self.current_amplitudes = amplitudes
                     self.current_peaks = peaks
-                    self.current_detector_mode = "QUASI_PEAK"
+                    self.current_detector_mode = display_mode
                     self.last_ai_result = ""
                     self.progress_message = f"演示 EMI {duration_seconds} 秒采样完成"
             finally:
@@ -518,6 +560,8 @@ class SATestService:
             results = self.controller.get_emc_measurement_fast(
                 duration_seconds,
                 should_stop=self.stop_event.is_set,
+                acquisition_mode=acquisition_mode,
+                capture_to_disk=capture_to_disk,
             )
             if not results:
                 raise ServiceError("EMI 测量未返回有效数据。")
@@ -625,15 +669,32 @@ class SATestService:
     def na_presets(self):
         return self.na_controller.get_preset_configs()
 
-    def na_configure(self, preset_key, points=None, ifbw=None):
+    def na_configure(self, preset_key, points=None, ifbw=None, verify_fdata=None, use_cal_cache=True, cal_cache_validity_s=None):
         if preset_key not in NA_PRESET_CONFIGS:
             raise ServiceError(f"未知 NA 天线预设: {preset_key}")
+        validity_s = None
+        if cal_cache_validity_s is not None:
+            try:
+                validity_s = float(cal_cache_validity_s)
+            except (TypeError, ValueError) as exc:
+                raise ServiceError("校准缓存有效期必须是秒数。") from exc
+            if validity_s < 0:
+                raise ServiceError("校准缓存有效期不能为负数。")
         with self.lock:
             if self.measurement_in_progress:
                 raise ServiceError("已有测量或校准正在进行，请先等待完成。")
+            if self.na_batch is not None:
+                raise ServiceError("NA 批量会话进行中，预设已锁定，请先结束批量。")
+            # 忙碌检查通过后才改控制器选项，避免影响正在运行的测量
+            if verify_fdata is not None:
+                # 默认只读 SDATA；开启后每次测量额外读 FDATa 做一致性校验
+                self.na_controller.verify_fdata = bool(verify_fdata)
+            if validity_s is not None:
+                self.na_cal_cache.validity_s = validity_s
             self.progress_message = "正在配置 NA 天线测量..."
             self.last_error = None
 
+        recalled = None
         if self.demo_mode:
             config = self._apply_na_preset_fields(preset_key, points=points, ifbw=ifbw)
         else:
@@ -643,6 +704,9 @@ class SATestService:
                 self.switch_mode("NA")
             try:
                 config = self.na_controller.configure_preset(preset_key, points=points, ifbw=ifbw)
+                if use_cal_cache:
+                    switch = self.switch_controller if self.switch_controller and self.switch_controller.connected else None
+                    recalled = self.na_controller.recall_calibration(switch)
             except N9918ANAError as exc:
                 raise ServiceError(str(exc)) from exc
 
@@ -652,9 +716,16 @@ class SATestService:
             self.na_config = config
             self.na_result = None
             self.na_calibration = self._empty_na_calibration()
-            self.progress_message = "NA 配置完成"
+            if recalled:
+                self.na_calibration.update(recalled)
+                self.progress_message = f"NA 配置完成，已召回 {recalled['cache_entry']['age_s'] / 60:.0f} 分钟前的校准"
+            else:
+                self.progress_message = "NA 配置完成"
         return self.na_result_payload()
 
+    def na_calibration_cache_status(self):
+        return {"validity_s": self.na_cal_cache.validity_s, "entries": self.na_cal_cache.entries()}
+
     def _apply_na_preset_fields(self, preset_key, points=None, ifbw=None):
         config = dict(NA_PRESET_CONFIGS[preset_key])
         if points:
@@ -677,6 +748,8 @@ class SATestService:
                 raise ServiceError("请先切换到 NA 天线测量模式。")
             if not self.na_config:
                 raise ServiceError("请先选择并应用 NA 天线预设。")
+            if self.na_batch is not None:
+                raise ServiceError("NA 批量会话进行中，校准已锁定，请先结束批量。")
             self.stop_event.clear()
             self.measurement_in_progress = True
             self.measurement_kind = "NA 自动校准"
@@ -756,33 +829,63 @@ class SATestService:
                 self.measurement_kind = None
         return self.na_result_payload()
 
-    def start_na_measurement(self):
-        with self.lock:
-            if self.measurement_in_progress:
-                raise ServiceError("已有测量或校准正在进行，请先停止或等待完成。")
-            if self.current_mode != "NA":
-                raise ServiceError("请先切换到 NA 天线测量模式。")
-            if not self.na_config:
-                raise ServiceError("请先选择并应用 NA 天线预设。")
-            if not self.na_calibration.get("complete"):
-                raise ServiceError("请先完成 NA 自动校准。")
-            if not self.demo_mode and not self.na_controller.connected:
-                raise ServiceError("请先连接 N9918A。")
+    def _check_na_measurement_ready_locked(self):
+        if self.measurement_in_progress:
+            raise ServiceError("已有测量或校准正在进行，请先停止或等待完成。")
+        if self.current_mode != "NA":
+            raise ServiceError("请先切换到 NA 天线测量模式。")
+        if not self.na_config:
+            raise ServiceError("请先选择并应用 NA 天线预设。")
+        if not self.na_calibration.get("complete"):
+            raise ServiceError("请先完成 NA 自动校准。")
+        if not self.demo_mode and not self.na_controller.connected:
+            raise ServiceError("请先连接 N9918A。")
 
+    def start_na_measurement(self, adaptive=False, segmented=False):
+        """
+        adaptive=True: 粗扫找谷后只在谷附近细扫，拼接成一条曲线分析。
+        segmented=True: 全扫宽按仪器最大点数分段扫描，每段完成即更新阶段谷值。
+        """
+        with self.lock:
+            self._check_na_measurement_ready_locked()
+            if segmented and not self.na_config.get("full_sweep"):
+                raise ServiceError("分段高分辨率扫描只用于全扫宽预设。")
             self.stop_event.clear()
             self.measurement_in_progress = True
-            self.measurement_kind = "NA 天线测量"
-            self.progress_message = "NA 天线测量运行中"
+            if segmented:
+                self.measurement_kind = "NA 分段全扫宽"
+            else:
+                self.measurement_kind = "NA 自适应测量" if adaptive else "NA 天线测量"
+            self.progress_message = f"{self.measurement_kind}运行中"
             self.last_error = None
-            self.measurement_thread = threading.Thread(target=self._run_na_measurement, daemon=True)
+            self.na_segment_progress = None
+            self.measurement_thread = threading.Thread(
+                target=self._run_na_measurement, args=(bool(adaptive), bool(segmented)), daemon=True
+            )
             self.measurement_thread.start()
         return self.na_result_payload()
 
-    def _run_na_measurement(self):
+    def _publish_na_segment(self, progress):
+        with self.lock:
+            self.na_segment_progress = progress
+            self.progress_message = (
+                f"NA 分段全扫宽 {progress['segment']}/{progress['segments']} 段，"
+                f"已发现 {len(progress['valleys'])} 个谷"
+            )
+
+    def _run_na_measurement(self, adaptive=False, segmented=False):
         try:
-            if self.demo_mode:
+            if self.demo_mode and segmented:
+                result = self._generate_na_demo_segmented_result()
+            elif self.demo_mode:
                 time.sleep(0.25)
                 result = self._generate_na_demo_result()
+            elif segmented:
+                result = self.na_controller.measure_s11_segmented(
+                    on_segment=self._publish_na_segment, should_stop=self.stop_event.is_set
+                )
+            elif adaptive:
+                result = self.na_controller.measure_s11_adaptive(should_stop=self.stop_event.is_set)
             else:
                 result = self.na_controller.measure_s11(should_stop=self.stop_event.is_set)
             with self.lock:
@@ -797,14 +900,309 @@ class SATestService:
                 self.measurement_in_progress = False
                 self.measurement_kind = None
 
+    def start_na_live(self):
+        with self.lock:
+            self._check_na_measurement_ready_locked()
+            self.stop_event.clear()
+            self.measurement_in_progress = True
+            self.measurement_kind = "NA 实时调试"
+            self.progress_message = "NA 实时调试运行中"
+            self.last_error = None
+            self.na_live_active = True
+            self.na_live_frame = None
+            self.na_live_raw = None
+            self.measurement_thread = threading.Thread(target=self._run_na_live, daemon=True)
+            self.measurement_thread.start()
+        return self.na_result_payload()
+
+    def _run_na_live(self):
+        try:
+            acquire = self._acquire_na_demo_frame if self.demo_mode else None
+            frames = self.na_controller.stream_s11(self._publish_na_frame, should_stop=self.stop_event.is_set, acquire=acquire)
+            with self.lock:
+                self.progress_message = f"NA 实时调试已停止，共 {frames} 帧"
+        except Exception as exc:
+            with self.lock:
+                self.last_error = str(exc)
+                self.progress_message = "NA 实时调试失败"
+        finally:
+            with self.na_live_condition:
+                self.na_live_active = False
+                self.measurement_in_progress = False
+                self.measurement_kind = None
+                self.na_live_condition.notify_all()
+
+    def _publish_na_frame(self, frame, raw):
+        with self.na_live_condition:
+            self.na_live_frame = frame
+            self.na_live_raw = raw
+            self.na_live_condition.notify_all()
+
+    def _acquire_na_demo_frame(self, should_stop=None):
+        time.sleep(0.05)
+        # 谷值随时间缓慢漂移，模拟现场调匹配元件
+        drift = math.sin(time.monotonic() * 0.8)
+        frequencies, s11_db, real, imag, _config = self._generate_na_demo_arrays(center_shift_ratio=0.004 * drift)
+        return frequencies, s11_db, real, imag
+
+    def na_live_frames(self, after_seq=-1, heartbeat_s=10.0):
+        """
+        实时帧生成器：只产出比 after_seq 新的最新帧（消费慢时自动跳帧），
+        heartbeat_s 内没有新帧时产出 None 作心跳，实时模式结束后返回。
+        """
+        def has_new_frame():
+            return self.na_live_frame is not None and self.na_live_frame["seq"] > after_seq
+
+        while True:
+            with self.na_live_condition:
+                self.na_live_condition.wait_for(lambda: has_new_frame() or not self.na_live_active, timeout=heartbeat_s)
+                frame = self.na_live_frame if has_new_frame() else None
+                active = self.na_live_active
+            if frame is not None:
+                after_seq = frame["seq"]
+                yield frame
+            elif not active:
+                return
+            else:
+                yield None
+
+    def freeze_na_live(self):
+        """停止实时调试，对最后一帧原始数据运行完整 build_na_result 分析。"""
+        with self.lock:
+            if not self.na_live_active:
+                # stop_event 与其他测量共用，非实时调试时不能触发
+                raise ServiceError("实时调试未在运行，请先开始实时调试。")
+            thread = self.measurement_thread
+        self.stop_event.set()
+        thread.join(timeout=max(5.0, self.na_controller.timeout / 1000.0))
+        with self.lock:
+            raw = self.na_live_raw
+            frame = self.na_live_frame
+            config = self.na_controller.current_config or self.na_config
+        if raw is None:
+            raise ServiceError("没有可冻结的实时帧，请先开始实时调试。")
+
+        frequencies, s11_db, real, imag = raw
+        result = build_na_result(frequencies, s11_db, real, imag, config, self.na_config_key)
+        result["live_frame_seq"] = frame["seq"]
+        with self.lock:
+            self.na_result = result
+            self.progress_message = f"已冻结第 {frame['seq'] + 1} 帧并完成完整分析"
+        return self.na_result_payload()
+
+    def start_na_batch(self, mask=None, generate_reports=True, metadata=None):
+        """开始产线批量会话：锁定当前预设与校准，mask 缺省为预设默认掩模。"""
+        with self.lock:
+            self._check_na_measurement_ready_locked()
+            if self.na_batch is not None:
+                raise ServiceError("已有批量会话进行中，请先结束。")
+            config = dict(self.na_controller.current_config or self.na_config)
+            if self.demo_mode:
+                config["points"] = len(self._generate_na_demo_arrays()[0])
+            if mask is None and config.get("full_sweep"):
+                raise ServiceError("全扫宽预设没有默认 S11 掩模，请提供 mask。")
+            path = ROOT / "measurement_data" / f"na_batch_{self.na_config_key}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            session_metadata = {
+                "user_info": self.user_info.copy(),
+                "demo_mode": self.demo_mode,
+                **(metadata or {}),
+            }
+            try:
+                session = NABatchSession(path, config, self.na_config_key, mask=mask, metadata=session_metadata)
+            except ValueError as exc:
+                raise ServiceError(str(exc)) from exc
+            session.generate_reports = bool(generate_reports)
+            self.na_batch = session
+            self.na_batch_last_unit = None
+            self.progress_message = f"NA 批量会话已开始: {path.name}"
+        print(f"[BATCH] NA 批量会话: {path}")
+        return self.na_batch_status()
+
+    def measure_na_batch_unit(self, serial):
+        """同步测量一台 DUT：采集、掩模判定、追加到会话文件，报告入后台队列。"""
+        serial = str(serial or "").strip()
+        if not serial:
+            raise ServiceError("请输入 DUT 序列号。")
+        with self.lock:
+            session = self.na_batch
+            if session is None:
+                raise ServiceError("请先开始 NA 批量会话。")
+            self._check_na_measurement_ready_locked()
+            self._check_na_batch_config_locked(session)
+            self.stop_event.clear()
+            self.measurement_in_progress = True
+            self.measurement_kind = "NA 批量测量"
+            self.progress_message = f"NA 批量测量: {serial}"
+            self.last_error = None
+        try:
+            start_time = time.perf_counter()
+            if self.demo_mode:
+                frequencies, s11_db, real, imag = self._acquire_na_demo_frame()
+            else:
+                frequencies, s11_db, real, imag = self.na_controller.acquire_s11(should_stop=self.stop_event.is_set)
+            unit = session.record_unit(serial, frequencies, s11_db, real, imag, elapsed_s=time.perf_counter() - start_time)
+        except (N9918ANAError, ValueError, OSError) as exc:
+            with self.lock:
+                self.last_error = str(exc)
+                self.progress_message = f"NA 批量测量失败: {serial}"
+            raise ServiceError(f"NA 批量测量失败: {exc}") from exc
+        finally:
+            with self.lock:
+                self.measurement_in_progress = False
+                self.measurement_kind = None
+
+        if session.generate_reports:
+            self._enqueue_na_report(session, unit)
+        with self.lock:
+            self.na_batch_last_unit = unit
+            self.progress_message = f"{serial}: {'PASS' if unit['pass'] else 'FAIL'}"
+        return self.na_batch_status()
+
+    def _check_na_batch_config_locked(self, session):
+        """仪器当前扫描条件必须与会话锁定的一致，否则掩模和 gamma.c64 会混入其他频段。"""
+        current = self.na_controller.current_config or {}
+        # 演示数据的点数由演示生成器决定（全扫宽上限 5001），只比较频率与 IFBW
+        keys = ("start_freq", "stop_freq", "ifbw") if self.demo_mode else ("start_freq", "stop_freq", "points", "ifbw")
+        mismatched = [key for key in keys if current.get(key) is None or float(current[key]) != float(session.config[key])]
+        if mismatched:
+            raise ServiceError(f"仪器扫描设置与批量会话不一致（{', '.join(mismatched)}），请结束批量后重新开始。")
+
+    def stop_na_batch(self):
+        """结束批量会话；已排队的报告继续在后台生成。"""
+        with self.lock:
+            session = self.na_batch
+            if session is None:
+                raise ServiceError("没有进行中的 NA 批量会话。")
+            if self.measurement_kind == "NA 批量测量":
+                raise ServiceError("批量测量进行中，请等待当前 DUT 完成。")
+            summary = session.close()
+            self.na_batch = None
+            self.progress_message = f"NA 批量会话结束，共 {summary['units']} 台"
+        print(
+            f"[BATCH] NA 批量会话结束: {summary['units']} 台, PASS {summary['passed']}, "
+            f"{summary['units_per_hour'] or 0:.0f} 台/小时"
+        )
+        return {"summary": summary, "reports": self._na_report_stats()}
+
+    def na_batch_status(self):
+        with self.lock:
+            session = self.na_batch
+            last_unit = self.na_batch_last_unit
+        return {
+            "active": session is not None,
+            "summary": session.summary() if session else None,
+            "last_unit": last_unit,
+            "reports": self._na_report_stats(),
+        }
+
+    def _na_report_stats(self):
+        with self.lock:
+            return dict(self.na_report_stats)
+
+    def _enqueue_na_report(self, session, unit):
+        with self.lock:
+            self.na_report_stats["queued"] += 1
+            self.na_report_stats["pending"] += 1
+            if self.na_report_worker is None or not self.na_report_worker.is_alive():
+                self.na_report_worker = threading.Thread(target=self._run_na_report_queue, daemon=True)
+                self.na_report_worker.start()
+            user_info = self.user_info.copy()
+        self.na_report_queue.put((session, unit["row"], unit["serial"], user_info))
+
+    def _run_na_report_queue(self):
+        while True:
+            session, row, serial, user_info = self.na_report_queue.get()
+            try:
+                with self.report_lock:
+                    export_na_report(
+                        session.unit_result(row),
+                        user_info={**user_info, "remark": f"DUT SN: {serial}"},
+                        output_dir=session.report_dir,
+                        filename=f"{row:05d}_{serial}.pdf",
+                    )
+                with self.lock:
+                    self.na_report_stats["done"] += 1
+            except Exception as exc:
+                with self.lock:
+                    self.na_report_stats["failed"] += 1
+                    self.na_report_stats["last_error"] = f"{serial}: {exc}"
+                print(f"[WARN] NA 批量报告生成失败 {serial}: {exc}")
+            finally:
+                with self.lock:
+                    self.na_report_stats["pending"] -= 1
+                self.na_report_queue.task_done()
+
     def _generate_na_demo_result(self):
+        frequencies, s11_db, real, imag, config = self._generate_na_demo_arrays()
+        return build_na_result(frequencies, s11_db, real, imag, config, self.na_config_key)
+
+    def _generate_na_demo_arrays(self, center_shift_ratio=0.0):
         config = dict(self.na_config or NA_PRESET_CONFIGS["ANT_433"])
         points = int(config.get("points") or 2001)
         if config.get("full_sweep"):
             points = min(points, 5001)
         frequencies = frequency_axis(config["start_freq"], config["stop_freq"], points)
+        s11_db, real, imag = self._demo_na_curve(frequencies, config, center_shift_ratio)
+        return frequencies, s11_db, real, imag, config
+
+    def _generate_na_demo_segmented_result(self, segments=NA_FULL_SPAN_SEGMENTS, points_per_segment=NA_MAX_POINTS):
+        """演示模式的分段全扫宽：演示曲线按分段网格逐段写入缓冲区，每段推送阶段谷值。"""
+        config = dict(self.na_config)
+        buffer = SegmentedS11Buffer(config["start_freq"], config["stop_freq"], segments, points_per_segment)
+        started = time.perf_counter()
+        segment_stats = []
+        first_progress_ms = None
+        for index in range(segments):
+            if self.stop_event.is_set():
+                raise ServiceError("NA 分段全扫宽已停止。")
+            sweep_started = time.perf_counter()
+            time.sleep(0.05)
+            first = index * points_per_segment
+            frequencies = buffer.grid[first:first + points_per_segment].tolist()
+            s11_db, real, imag = self._demo_na_curve(frequencies, config)
+            acquired = time.perf_counter()
+            buffer.add_segment(index, frequencies, s11_db, real, imag)
+            progress = buffer.progress()
+            analysed = time.perf_counter()
+            segment_stats.append(
+                {
+                    "start_freq": frequencies[0],
+                    "stop_freq": frequencies[-1],
+                    "points": points_per_segment,
+                    "acquire_ms": (acquired - sweep_started) * 1000.0,
+                    "analysis_ms": (analysed - acquired) * 1000.0,
+                }
+            )
+            progress["elapsed_ms"] = (analysed - started) * 1000.0
+            if first_progress_ms is None:
+                first_progress_ms = progress["elapsed_ms"]
+            self._publish_na_segment(progress)
+
+        result = build_na_result(
+            buffer.frequencies,
+            buffer.s11_db,
+            buffer.gamma.real,
+            buffer.gamma.imag,
+            dict(config, points=buffer.total_points),
+            self.na_config_key,
+        )
+        result["segmented_sweep"] = {
+            "segments": segment_stats,
+            "points_per_segment": points_per_segment,
+            "total_points": buffer.total_points,
+            "resolution_hz": buffer.resolution_hz,
+            "buffer_bytes": buffer.nbytes,
+            "first_progress_ms": first_progress_ms,
+            "total_ms": (time.perf_counter() - started) * 1000.0,
+        }
+        return result
+
+    def _demo_na_curve(self, frequencies, config, center_shift_ratio=0.0):
         s11_db = []
-        centers = self._demo_na_centers(config)
+        centers = [
+            (center_mhz * (1.0 + center_shift_ratio), depth_db, width_mhz)
+            for center_mhz, depth_db, width_mhz in self._demo_na_centers(config)
+        ]
         for freq in frequencies:
             mhz = freq / 1e6
             baseline = -2.2 + 0.8 * math.sin(math.log10(max(mhz, 0.001)) * 3.1)
@@ -815,14 +1213,14 @@ class SATestService:
 
         real = []
         imag = []
-        span = max(frequencies[-1] - frequencies[0], 1)
+        # 相位按整个预设频段展开，分段生成时各段拼接连续
+        span = max(config["stop_freq"] - config["start_freq"], 1)
         for freq, db in zip(frequencies, s11_db):
             mag = min(0.98, max(0.02, 10 ** (db / 20)))
-            phase = -math.pi + 2 * math.pi * ((freq - frequencies[0]) / span)
+            phase = -math.pi + 2 * math.pi * ((freq - config["start_freq"]) / span)
             real.append(mag * math.cos(phase))
             imag.append(mag * math.sin(phase))
-
-        return build_na_result(frequencies, s11_db, real, imag, config, self.na_config_key)
+        return s11_db, real, imag
 
     @staticmethod
     def _demo_na_centers(config):
@@ -862,7 +1260,7 @@ class SATestService:
 
     def na_result_payload(self):
         with self.lock:
-            result = self.na_result or {}
+            result = na_result_lists(self.na_result) or {}
             status = {
                 "current_mode": self.current_mode,
                 "connected": self.controller.connected or self.na_controller.connected,
@@ -877,6 +1275,10 @@ class SATestService:
                 "error": self.last_error,
                 "last_report": str(self.na_last_report_path) if self.na_last_report_path else None,
                 "demo_mode": self.demo_mode,
+                "live_active": self.na_live_active,
+                "live_frames": self.na_live_frame["seq"] + 1 if self.na_live_frame else 0,
+                "batch_active": self.na_batch is not None,
+                "segment_progress": self.na_segment_progress if self.measurement_in_progress else None,
             }
             return {
                 "status": status,
@@ -891,6 +1293,8 @@ class SATestService:
                 "config": result.get("config") or self.na_config,
                 "is_full_sweep": bool(result.get("is_full_sweep") or (self.na_config or {}).get("full_sweep")),
                 "measurement_time": result.get("measurement_time"),
+                "adaptive_sweep": result.get("adaptive_sweep"),
+                "segmented_sweep": result.get("segmented_sweep"),
             }
 
     def save_na_data(self):
@@ -910,7 +1314,8 @@ class SATestService:
         if not result:
             raise ServiceError("没有可导出的 NA 测量结果。")
         try:
-            report_path = export_na_report(result, user_info=project_info, output_dir=ROOT / "reports")
+            with self.report_lock:
+                report_path = export_na_report(result, user_info=project_info, output_dir=ROOT / "reports")
         except ImportError as exc:
             raise ServiceError("缺少 NA 报告依赖，请先在 visa 环境运行 `pip install -r requirements.txt`。") from exc
         except OSError as exc:
@@ -951,9 +1356,15 @@ class SATestService:
     def _series_payload_locked(self):
         if not self.current_frequencies or not self.current_amplitudes:
             return None
+        limit_table = compile_limit_table(
+            self.current_frequencies,
+            detector_type=self.current_detector_mode or "QUASI_PEAK",
+        )
         return {
             "frequency_mhz": [round(freq / 1e6, 6) for freq in self.current_frequencies],
             "amplitude_dbuv": [round(value, 3) for value in self.current_amplitudes],
+            "fcc_limit_dbuv": [round(value, 3) for value in limit_table.fcc.tolist()],
+            "ce_limit_dbuv": [round(value, 3) for value in limit_table.ce.tolist()],
         }
 
     def _modes_payload_locked(self):
@@ -1068,7 +1479,8 @@ class SATestService:
                 print(f"[REPORT] AI analysis completed in {time.perf_counter() - ai_start:.2f}s")
 
         graph_start = time.perf_counter()
-        graph_path = self._render_graph_png()
+        with self.report_lock:
+            graph_path = self._render_graph_png()
         print(f"[REPORT] SA graph rendered in {time.perf_counter() - graph_start:.2f}s")
         reports_dir = ROOT / "reports"
         reports_dir.mkdir(exist_ok=True)
@@ -1145,13 +1557,10 @@ class SATestService:
         fig, ax = plt.subplots(figsize=(12, 7))
         ax.semilogx(freq_mhz, amplitudes, color="#175c7f", linewidth=1.2, label="测量曲线")
 
-        fcc_limits = []
-        ce_limits = []
         detector_mode = getattr(self, "current_detector_mode", "QUASI_PEAK")
-        for freq in frequencies:
-            fcc_limit, ce_limit = get_fcc_ce_limits(freq, detector_type=detector_mode)
-            fcc_limits.append(fcc_limit)
-            ce_limits.append(ce_limit)
+        limit_table = compile_limit_table(frequencies, detector_type=detector_mode)
+        fcc_limits = limit_table.fcc
+        ce_limits = limit_table.ce
         ax.semilogx(freq_mhz, fcc_limits, color="#d95032", linewidth=1, linestyle="--", label="FCC 筛查限值")
         ax.semilogx(freq_mhz, ce_limits, color="#287a3e", linewidth=1, linestyle="--", label="CE 筛查限值")
 
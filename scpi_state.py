@@ -0,0 +1,139 @@
+# scpi_state.py
+"""SCPI helpers shared by the SA and NA controllers: VISA resource naming and a shadow copy of FieldFox settings."""
+
+from __future__ import annotations
+
+import math
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+
+def visa_resource_name(address: str) -> str:
+    """'192.168.0.124' -> VXI-11 INSTR resource; full resource names such as
+    'TCPIP0::127.0.0.1::5025::SOCKET' (raw socket / simulator) pass through."""
+    address = str(address).strip()
+    if "::" in address:
+        return address
+    return f"TCPIP0::{address}::inst0::INSTR"
+
+
+def open_visa_resource(resource_manager, address: str):
+    """Open the resource; raw SOCKET sessions have no END indicator, so use '\\n' terminators."""
+    resource_name = visa_resource_name(address)
+    device = resource_manager.open_resource(resource_name)
+    if resource_name.upper().endswith("::SOCKET"):
+        device.read_termination = "\n"
+        device.write_termination = "\n"
+    return device
+
+
+def _normalize_header(header: str) -> str:
+    header = header.strip().upper()
+    if header.endswith("?"):
+        header = header[:-1]
+    return header.lstrip(":")
+
+
+def split_scpi_setting(command: str) -> Tuple[str, str]:
+    """':SENS:FREQ:STAR 30000000.0' -> ('SENS:FREQ:STAR', '30000000.0')."""
+    parts = command.strip().split(None, 1)
+    header = _normalize_header(parts[0]) if parts else ""
+    value = parts[1].strip() if len(parts) > 1 else ""
+    return header, value
+
+
+def _same_value(left: Any, right: Any) -> bool:
+    if left is None or right is None:
+        return False
+    try:
+        left_float = float(left)
+        right_float = float(right)
+    except (TypeError, ValueError):
+        return str(left).strip().strip("'\"").upper() == str(right).strip().strip("'\"").upper()
+    if math.isnan(left_float) or math.isnan(right_float):
+        return False
+    return left_float == right_float or math.isclose(left_float, right_float, rel_tol=1e-9, abs_tol=1e-12)
+
+
+class SCPIShadowState:
+    """
+    Last value written to / read from the instrument for each SCPI setting.
+
+    Writes whose value already matches the shadow are skipped, and derived
+    data (e.g. a frequency axis) is cached until one of its source settings
+    changes. The shadow cannot see front-panel changes, so callers must call
+    invalidate() explicitly on mode switches, reconnects and SCPI/VISA errors.
+    """
+
+    def __init__(self):
+        self.mode: Optional[str] = None
+        self.values: Dict[str, str] = {}
+        self.derived: Dict[str, Tuple[Tuple[str, ...], Any]] = {}
+        self.stats = {"writes": 0, "skipped_writes": 0, "derived_hits": 0, "invalidations": 0}
+        self.last_invalidation: Optional[str] = None
+
+    def invalidate(self, reason: str = "") -> None:
+        """Forget every shadowed setting and derived value."""
+        self.mode = None
+        self.values.clear()
+        self.derived.clear()
+        self.stats["invalidations"] += 1
+        self.last_invalidation = reason or None
+
+    def set_mode(self, mode: str) -> None:
+        """Record the instrument mode; switching mode drops all shadowed settings."""
+        mode = str(mode).upper()
+        if self.mode != mode:
+            self.invalidate(f"mode switch to {mode}")
+            self.mode = mode
+
+    def get(self, header: str) -> Optional[str]:
+        return self.values.get(_normalize_header(header))
+
+    def needs_write(self, command: str) -> bool:
+        header, value = split_scpi_setting(command)
+        return not _same_value(self.values.get(header), value)
+
+    def record(self, header: str, value: Any) -> None:
+        """Store a written or read-back value and drop derived data that depends on it."""
+        header = _normalize_header(header)
+        value = str(value).strip()
+        if not _same_value(self.values.get(header), value):
+            for key, (depends_on, _value) in list(self.derived.items()):
+                if header in depends_on:
+                    del self.derived[key]
+        self.values[header] = value
+
+    def record_write(self, command: str) -> None:
+        header, value = split_scpi_setting(command)
+        self.record(header, value)
+
+    def filter_writes(self, commands: Iterable[str]) -> list:
+        """Return only the setting commands that would change the instrument."""
+        pending = []
+        for command in commands:
+            if self.needs_write(command):
+                pending.append(command)
+                self.stats["writes"] += 1
+            else:
+                self.stats["skipped_writes"] += 1
+        return pending
+
+    def cache_derived(self, key: str, depends_on: Iterable[str], value: Any) -> Any:
+        self.derived[key] = (tuple(_normalize_header(header) for header in depends_on), value)
+        return value
+
+    def get_derived(self, key: str) -> Any:
+        entry = self.derived.get(key)
+        if entry is None:
+            return None
+        self.stats["derived_hits"] += 1
+        return entry[1]
+
+    def summary(self) -> dict:
+        return {
+            "mode": self.mode,
+            "settings": len(self.values),
+            "derived": sorted(self.derived),
+            "last_invalidation": self.last_invalidation,
+            **self.stats,
+        }
@@ -1,4 +1,5 @@
 import json
+import math
 import os
 import sys
 import tempfile
@@ -8,26 +9,48 @@ import unittest
 from unittest.mock import patch
 from pathlib import Path
 
+import numpy as np
+
 ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(ROOT))
 
 from chat import ChatBot, sys_prompt
 import n9918a_backend
+import n9918a_na_backend
 from n9918a_backend import (
     N9918AController,
     collapse_contiguous_indices,
     dbm_to_dbuv,
     dbuv_to_dbm,
+    calculate_emc_detectors,
+    compile_limit_table,
+    find_peaks_numpy,
+    calculate_quasi_peak_array,
+    calculate_quasi_peak_value,
+    EMCDetectorAccumulator,
+    EMCDiskSampleStore,
+    EMCSampleStore,
     get_emission_limit_info,
     get_fcc_ce_limits,
     linear_average_dbuv,
+    load_emc_capture,
     post_process_peak_search,
+    save_emi_measurement_data,
 )
 from n9918a_na_backend import (
     NA_PRESET_CONFIGS,
     N9918ANAController,
+    N9918ANAError,
+    NABatchSession,
+    NACalibrationCache,
+    SegmentedS11Buffer,
     build_na_result,
+    calculate_all_bandwidths,
+    calculate_valley_bandwidths,
+    evaluate_s11_mask,
+    find_s11_valleys,
     frequency_axis,
+    na_result_lists,
 )
 import web_app
 from web_app import app
@@ -46,6 +69,12 @@ class FakeVisaDevice:
 
     def write(self, command):
         self.commands.append(("write", command))
+        for part in command.split(";"):
+            self._apply(part.strip())
+
+    def _apply(self, command):
+        if not command:
+            return
         upper = command.upper()
         parts = command.split()
         if upper.startswith(":SENS:FREQ:STAR") and len(parts) >= 2:
@@ -63,6 +92,19 @@ class FakeVisaDevice:
 
     def query(self, command):
         self.commands.append(("query", command))
+        if ";" not in command:
+            return self._answer(command)
+        # 分号拼接的多条命令：设置类命令生效，查询类命令的回答用 ";" 连接。
+        answers = []
+        for part in command.split(";"):
+            part = part.strip()
+            if part.endswith("?"):
+                answers.append(self._answer(part))
+            elif part:
+                self._apply(part)
+        return ";".join(answers)
+
+    def _answer(self, command):
         if command == "*IDN?":
             return "Fake,N9918A,0,1"
         if command == "SYST:ERR?":
@@ -97,6 +139,13 @@ class FakeVisaDevice:
         pass
 
 
+class FakeBinaryVisaDevice(FakeVisaDevice):
+    def query_binary_values(self, command, datatype="f", is_big_endian=False, container=list):
+        self.commands.append(("query_binary", command))
+        values = np.arange(1, self.n_points + 1, dtype=">f4" if is_big_endian else "<f4")
+        return container(values)
+
+
 class FakeResourceManager:
     last_device = None
 
@@ -126,6 +175,75 @@ class FakeSwitch:
         self.calls.append((switch_name, position))
 
 
+def legacy_post_process_peak_search(frequencies, amplitudes, peak_distance=30, min_prominence=2, detector_type="QUASI_PEAK"):
+    """逐点计算的原始实现（基线提交），用于校验向量化版本；需要 scipy。"""
+    signal = n9918a_backend.signal
+    mean_amp = np.mean(amplitudes)
+    std_amp = np.std(amplitudes)
+    dynamic_prominence = max(min_prominence, std_amp * 0.2)
+    min_height = mean_amp + dynamic_prominence * 0.3
+    primary_peaks, _ = signal.find_peaks(amplitudes, distance=peak_distance, prominence=dynamic_prominence, height=min_height)
+    secondary_peaks, _ = signal.find_peaks(
+        amplitudes,
+        distance=max(5, peak_distance // 4),
+        prominence=max(0.3, dynamic_prominence * 0.3),
+        height=mean_amp + 0.3,
+    )
+    threshold_indices = []
+    for i in range(len(amplitudes)):
+        fcc_limit, ce_limit = get_fcc_ce_limits(frequencies[i], detector_type=detector_type)
+        if amplitudes[i] > fcc_limit or amplitudes[i] > ce_limit:
+            threshold_indices.append(i)
+    threshold_peaks = n9918a_backend.collapse_exceeding_regions(threshold_indices, amplitudes, frequencies)
+    all_peaks = list(set(list(primary_peaks) + list(secondary_peaks) + threshold_peaks))
+
+    peak_scores = []
+    for idx in all_peaks:
+        amp_dbuv = amplitudes[idx]
+        limit_info = get_emission_limit_info(frequencies[idx], detector_type=detector_type)
+        fcc_limit = limit_info["fcc_limit"]
+        ce_limit = limit_info["ce_limit"]
+        fcc_margin = amp_dbuv - fcc_limit
+        ce_margin = amp_dbuv - ce_limit
+        amplitude_score = (amp_dbuv - mean_amp) / std_amp if std_amp > 0 else 0
+        margin_score = max(fcc_margin, ce_margin, 0)
+        prominence_score = 0
+        if 1 <= idx < len(amplitudes) - 1:
+            prominence_score = min(amp_dbuv - amplitudes[idx - 1], amp_dbuv - amplitudes[idx + 1])
+        exceed_bonus = 15 if (fcc_margin > 0 or ce_margin > 0) else 0
+        total_score = amplitude_score * 0.2 + margin_score * 0.5 + prominence_score * 0.2 + exceed_bonus
+        peak_scores.append((idx, total_score, amp_dbuv, fcc_margin, ce_margin, fcc_limit, ce_limit))
+    peak_scores.sort(key=lambda x: x[1], reverse=True)
+
+    freq_range_mhz = (frequencies[-1] - frequencies[0]) / 1e6
+    max_peaks = 25 if freq_range_mhz < 1 else 40 if freq_range_mhz < 100 else 50
+    exceed_peaks = []
+    normal_peaks = []
+    for idx, score, amp_dbuv, fcc_margin, ce_margin, fcc_limit, ce_limit in peak_scores:
+        peak_data = {
+            "frequency_hz": frequencies[idx],
+            "frequency_mhz": frequencies[idx] / 1e6,
+            "amplitude_dbuv": amp_dbuv,
+            "fcc_limit": fcc_limit,
+            "ce_limit": ce_limit,
+            "fcc_margin": fcc_margin,
+            "ce_margin": ce_margin,
+            "exceed_fcc": fcc_margin > 0,
+            "exceed_ce": ce_margin > 0,
+            "importance_score": score,
+            # 基线沿用循环最后一个峰的 limit_info；测试频谱落在同一限值频段，元数据一致
+            "limit_unit": limit_info["unit"],
+            "limit_measurement_type": limit_info["measurement_type"],
+            "fcc_detector": limit_info["fcc_detector"],
+            "ce_detector": limit_info["ce_detector"],
+            "limit_note": limit_info["note"],
+        }
+        (exceed_peaks if fcc_margin > 0 or ce_margin > 0 else normal_peaks).append(peak_data)
+    peak_results = exceed_peaks + normal_peaks[:max_peaks - len(exceed_peaks)]
+    peak_results.sort(key=lambda x: x["frequency_hz"])
+    return peak_results
+
+
 class WebAppSmokeTest(unittest.TestCase):
     def setUp(self):
         self.client = app.test_client()
@@ -470,6 +588,147 @@ class WebAppSmokeTest(unittest.TestCase):
                     if reports_dir.exists() and not any(reports_dir.iterdir()):
                         reports_dir.rmdir()
 
+    def test_na_configure_rejected_while_busy_keeps_controller_options(self):
+        service = web_app.service
+        verify_fdata = service.na_controller.verify_fdata
+        validity_s = service.na_cal_cache.validity_s
+        service.measurement_in_progress = True
+        try:
+            rejected = self.client.post(
+                "/api/na/configure",
+                json={"preset_key": "ANT_433", "verify_fdata": not verify_fdata, "cal_cache_validity_s": 1},
+            ).get_json()
+        finally:
+            service.measurement_in_progress = False
+        self.assertFalse(rejected["ok"])
+        self.assertEqual(service.na_controller.verify_fdata, verify_fdata)
+        self.assertEqual(service.na_cal_cache.validity_s, validity_s)
+
+    def test_na_demo_segmented_sweep_fills_full_span_buffer(self):
+        self.client.post("/api/demo/load", json={"duration_seconds": 15})
+        self.client.post("/api/mode", json={"mode": "NA"})
+        self.assertFalse(self.client.post("/api/na/measure", json={"segmented": True}).get_json()["ok"])
+        self.client.post("/api/na/configure", json={"preset_key": "ANT_FULL"})
+        self.client.post("/api/na/calibrate")
+        self.poll_until_idle()
+
+        started = self.client.post("/api/na/measure", json={"segmented": True}).get_json()
+        self.assertTrue(started["ok"], started)
+        self.poll_until_idle(timeout=20.0)
+        data = self.client.get("/api/na/result").get_json()["data"]
+        self.assertIsNone(data["status"]["error"])
+        sweep = data["segmented_sweep"]
+        self.assertEqual(len(sweep["segments"]), 4)
+        self.assertEqual(sweep["total_points"], 40004)
+        self.assertEqual(len(data["series"]["frequency_mhz"]), 40004)
+        self.assertTrue(any(abs(valley["frequency_mhz"] - 2450.0) < 5 for valley in data["valleys"]))
+
+    def test_na_live_mode_streams_frames_and_freezes_full_result(self):
+        self.client.post("/api/demo/load", json={"duration_seconds": 15})
+        self.client.post("/api/mode", json={"mode": "NA"})
+        self.client.post("/api/na/configure", json={"preset_key": "ANT_433"})
+        self.client.post("/api/na/calibrate")
+        self.poll_until_idle()
+
+        started = self.client.post("/api/na/live/start").get_json()
+        self.assertTrue(started["ok"], started)
+        self.assertTrue(started["data"]["status"]["live_active"])
+        frames = []
+        for frame in web_app.service.na_live_frames(heartbeat_s=2.0):
+            self.assertIsNotNone(frame)
+            frames.append(frame)
+            if len(frames) == 3:
+                break
+        self.assertEqual([frame["seq"] for frame in frames], sorted({frame["seq"] for frame in frames}))
+        live = frames[-1]
+        self.assertAlmostEqual(live["primary_valley"]["frequency_mhz"], 433.0, delta=5.0)
+        self.assertIsNotNone(live["target"])
+        self.assertGreater(live["bandwidth_10db"]["width_hz"], 0)
+        self.assertLessEqual(len(live["trace"]["s11_db"]), n9918a_na_backend.NA_FRAME_TRACE_POINTS)
+
+        frozen = self.client.post("/api/na/live/freeze").get_json()
+        self.assertTrue(frozen["ok"], frozen)
+        self.assertFalse(frozen["data"]["status"]["live_active"])
+        self.assertTrue(frozen["data"]["series"]["s11_db"])
+        self.assertTrue(frozen["data"]["valleys"])
+        self.assertGreaterEqual(web_app.service.na_result["live_frame_seq"], live["seq"])
+        # 实时调试已停止：不能再冻结旧帧，也不能触发共用的 stop_event
+        web_app.service.stop_event.clear()
+        self.assertFalse(self.client.post("/api/na/live/freeze").get_json()["ok"])
+        self.assertFalse(web_app.service.stop_event.is_set())
+
+        stream = self.client.get("/api/na/live/stream?after=1000000")
+        try:
+            self.assertEqual(stream.mimetype, "text/event-stream")
+            self.assertIn(b"event: end", stream.get_data())
+        finally:
+            stream.close()
+
+    def test_na_batch_session_records_units_and_queues_reports(self):
+        self.client.post("/api/demo/load", json={"duration_seconds": 15})
+        self.client.post("/api/mode", json={"mode": "NA"})
+        self.client.post("/api/na/configure", json={"preset_key": "ANT_433"})
+        self.client.post("/api/na/calibrate")
+        self.poll_until_idle()
+
+        def fake_report(result, user_info=None, output_dir="reports", filename=None):
+            Path(output_dir).mkdir(exist_ok=True)
+            path = Path(output_dir) / filename
+            path.write_text(f"{result['dut_serial']} {user_info['remark']}", encoding="utf-8")
+            return path
+
+        with tempfile.TemporaryDirectory() as tmp, patch("sa_test_service.ROOT", Path(tmp)), patch(
+            "sa_test_service.export_na_report", side_effect=fake_report
+        ), patch("builtins.print"):
+            started = self.client.post("/api/na/batch/start").get_json()
+            self.assertTrue(started["ok"], started)
+            session_path = Path(started["data"]["summary"]["path"])
+            self.assertEqual(started["data"]["summary"]["mask"][0]["max_s11_db"], -10.0)
+            self.assertFalse(self.client.post("/api/na/batch/measure", json={"serial": " "}).get_json()["ok"])
+            # 会话期间预设、校准和模式都锁定
+            self.assertFalse(self.client.post("/api/na/configure", json={"preset_key": "ANT_5G"}).get_json()["ok"])
+            self.assertFalse(self.client.post("/api/na/calibrate").get_json()["ok"])
+            self.assertFalse(self.client.post("/api/mode", json={"mode": "SA"}).get_json()["ok"])
+            self.assertEqual(web_app.service.na_config_key, "ANT_433")
+            with patch.object(web_app.service.na_controller, "current_config", dict(NA_PRESET_CONFIGS["ANT_5G"])):
+                rejected = self.client.post("/api/na/batch/measure", json={"serial": "SN999"}).get_json()
+            self.assertFalse(rejected["ok"])
+            self.assertIn("start_freq", rejected["error"])
+
+            for serial in ("SN001", "SN002", "SN001"):
+                measured = self.client.post("/api/na/batch/measure", json={"serial": serial}).get_json()
+                self.assertTrue(measured["ok"], measured)
+            unit = measured["data"]["last_unit"]
+            self.assertTrue(unit["pass"])
+            self.assertTrue(unit["retest"])
+            self.assertGreater(unit["mask_worst_margin_db"], 0)
+            self.assertAlmostEqual(unit["primary_frequency_hz"] / 1e6, 433.0, delta=5.0)
+
+            stopped = self.client.post("/api/na/batch/stop").get_json()["data"]
+            web_app.service.na_report_queue.join()
+            self.assertEqual(web_app.service.na_batch_status()["reports"]["pending"], 0)
+            summary = stopped["summary"]
+            self.assertEqual((summary["units"], summary["passed"], summary["retests"]), (3, 3, 1))
+            self.assertGreater(summary["units_per_hour"], 0)
+            self.assertGreater(summary["cycle_units_per_hour"], 0)
+            self.assertEqual(web_app.service.na_batch_status()["reports"]["done"], 3)
+            self.assertEqual(sorted(path.name for path in (session_path / "reports").iterdir()), ["00000_SN001.pdf", "00001_SN002.pdf", "00002_SN001.pdf"])
+            self.assertEqual(len((session_path / "units.jsonl").read_text(encoding="utf-8").splitlines()), 3)
+
+            # 写了一半的记录在重新打开时被丢弃，完整记录可重建完整结果
+            with open(session_path / "units.jsonl", "a", encoding="utf-8") as handle:
+                handle.write('{"row": 3, "serial": "SN0')
+            reopened = NABatchSession(session_path)
+            self.assertEqual([item["serial"] for item in reopened.units()], ["SN001", "SN002", "SN001"])
+            rebuilt = reopened.unit_result(1)
+            self.assertEqual(rebuilt["dut_serial"], "SN002")
+            self.assertAlmostEqual(rebuilt["primary_valley"]["frequency_hz"], reopened.units()[1]["primary_frequency_hz"], delta=1e3)
+
+            strict = [{"label": "strict", "start_freq": 430e6, "stop_freq": 436e6, "max_s11_db": -40.0}]
+            verdict = evaluate_s11_mask(reopened.frequencies, rebuilt["series"]["s11_db"], strict)
+            self.assertFalse(verdict["pass"])
+            self.assertLess(verdict["worst_margin_db"], 0)
+
 
 class BackendRegressionTest(unittest.TestCase):
     def test_sa_scpi_query_strings_are_valid(self):
@@ -497,6 +756,278 @@ class BackendRegressionTest(unittest.TestCase):
         self.assertIn(":TRAC1:DATA?", commands)
         self.assertFalse(any("[WARN]" in command for command in commands))
 
+    def test_sa_trace_uses_real32_block_transfer_when_supported(self):
+        controller = N9918AController(ip_address="192.0.2.1")
+        controller.device = FakeBinaryVisaDevice()
+        controller.connected = True
+        self.assertEqual(controller._select_trace_format(), "REAL32")
+        controller.start_freq = 1
+        controller.stop_freq = 3
+        controller.n_points = 3
+        controller.set_sa_corrections(cable_loss_db=0.5)
+
+        frequencies, amplitudes = controller.acquire_single_trace(reset_trace=True)
+        self.assertEqual(amplitudes.dtype.name, "float32")
+        self.assertEqual(amplitudes.tolist(), [1.5, 2.5, 3.5])
+        self.assertEqual(frequencies, [1.0, 2.0, 3.0])
+        commands = [command for _kind, command in controller.device.commands]
+        self.assertIn("FORM:DATA REAL,32", commands)
+        self.assertIn(("query_binary", ":TRAC1:DATA?"), controller.device.commands)
+        self.assertNotIn(":TRAC1:XVAL?", commands)
+        self.assertEqual(controller.last_trace_transfer["bytes"], len("#212") + 3 * 4 + 1)
+        summary = controller.trace_transfer_summary()
+        self.assertEqual(summary["format"], "REAL32")
+        self.assertEqual(summary["reads"], 1)
+
+        ascii_controller = N9918AController(ip_address="192.0.2.1", trace_format="ASCII")
+        ascii_controller.device = FakeBinaryVisaDevice()
+        ascii_controller.connected = True
+        self.assertEqual(ascii_controller._select_trace_format(), "ASCII")
+
+    def test_sa_pipelined_collection_matches_serial_samples(self):
+        results = {}
+        for pipelined in (False, True):
+            controller = N9918AController(ip_address="192.0.2.1", trace_format="ASCII")
+            controller.device = FakeVisaDevice()
+            controller.connected = True
+            controller.start_freq, controller.stop_freq, controller.n_points = 1, 3, 3
+            controller.set_sa_corrections(cable_loss_db=1.0)
+            accumulator = EMCDetectorAccumulator()
+            samples = controller.collect_emc_time_series(0.6, accumulator=accumulator, pipelined=pipelined)
+            stats = controller.last_collection_stats
+            self.assertEqual(stats["pipelined"], pipelined)
+            self.assertEqual(stats["sweeps"], len(samples))
+            self.assertEqual(accumulator.sample_count, len(samples))
+            self.assertGreater(len(samples), 0)
+            results[pipelined] = samples[0]["amplitudes"]
+        self.assertEqual(results[True], results[False])
+        self.assertEqual(results[True], [2.0, 3.0, 4.0])
+
+    def test_sa_back_to_back_schedule_is_not_capped_by_sample_interval(self):
+        controller = N9918AController(ip_address="192.0.2.1", trace_format="ASCII")
+        controller.device = FakeVisaDevice()
+        controller.connected = True
+        controller.start_freq, controller.stop_freq, controller.n_points = 1, 3, 3
+
+        paced = controller.collect_emc_time_series(0.6, pipelined=False, schedule="PACED")
+        paced_stats = dict(controller.last_collection_stats)
+        samples = controller.collect_emc_time_series(0.6, pipelined=False)
+        stats = controller.last_collection_stats
+        self.assertEqual(paced_stats["schedule"], "PACED")
+        self.assertLessEqual(len(paced), paced_stats["paced_sample_limit"])
+        self.assertEqual(stats["schedule"], "BACK_TO_BACK")
+        self.assertGreater(len(samples), stats["paced_sample_limit"])
+        starts = [sample["sweep_start"] for sample in samples]
+        self.assertEqual(starts, sorted(starts))
+        for sample in samples:
+            self.assertLessEqual(sample["sweep_start"], sample["sweep_end"])
+            self.assertEqual(sample["timestamp"], sample["sweep_end"])
+        self.assertEqual(controller.collect_emc_time_series(0.1, schedule="SOMETIMES"), [])
+
+    def test_fieldfox_simulator_serves_sa_and_na_over_scpi_socket(self):
+        from fieldfox_simulator import FieldFoxSimulator, FieldFoxSimulatorServer, SimulatorResourceManager
+        from scpi_state import SCPIShadowState
+
+        simulator = FieldFoxSimulator(time_scale=0.01, latency_s=0.001, jitter_s=0.001)
+        fake_pyvisa = types.SimpleNamespace(ResourceManager=SimulatorResourceManager, errors=FakePyVisa.errors)
+        with FieldFoxSimulatorServer(port=0, simulator=simulator) as server, \
+                patch.object(n9918a_backend, "pyvisa", fake_pyvisa), \
+                patch.object(n9918a_na_backend, "pyvisa", fake_pyvisa):
+            shared = SCPIShadowState()
+            sa_controller = N9918AController(ip_address=server.resource_name, scpi_state=shared)
+            self.assertTrue(sa_controller.connect())
+            self.assertEqual(sa_controller.trace_format, "REAL32")
+            self.assertTrue(sa_controller.configure_settings("EMC_30MHz_1GHz"))
+            self.assertAlmostEqual(sa_controller._estimate_sweep_time(), simulator.sweep_time(), places=6)
+            frequencies, amplitudes = sa_controller.acquire_single_trace()
+            self.assertEqual(len(amplitudes), sa_controller.n_points)
+            emitter_index = min(range(len(frequencies)), key=lambda i: abs(frequencies[i] - 175e6))
+            self.assertGreater(amplitudes[emitter_index], sorted(amplitudes)[len(amplitudes) // 2] + 15)
+            self.assertEqual(sa_controller._check_scpi_errors("simulator"), [])
+            simulator.inject_error(-222, "Data out of range")
+            self.assertEqual(sa_controller._check_scpi_errors("simulator"), ['-222,"Data out of range"'])
+
+            na_controller = N9918ANAController(ip_address=server.resource_name, scpi_state=shared)
+            self.assertTrue(na_controller.connect())
+            self.assertEqual(simulator.mode, "NA")
+            self.assertEqual(na_controller.data_format, "REAL64")
+            na_controller.configure_preset("ANT_433", points=401)
+            result = na_controller.measure_s11()
+            self.assertAlmostEqual(result["primary_valley"]["frequency_hz"], 433.92e6, delta=2e6)
+            sa_controller.disconnect()
+            na_controller.disconnect()
+        self.assertGreater(simulator.stats["sweeps"], 1)
+
+    def test_na_real64_block_transfer_matches_ascii_and_falls_back(self):
+        from fieldfox_simulator import FieldFoxSimulator, SimulatedVisaResource
+
+        simulator = FieldFoxSimulator(time_scale=0.0, seed=7)
+        controller = N9918ANAController(ip_address="192.0.2.1")
+        controller.device = SimulatedVisaResource(simulator)
+        controller.connected = True
+        with patch("builtins.print"):
+            self.assertEqual(controller._select_data_format(), "REAL64")
+        controller.configure_preset("ANT_433", points=201)
+        controller.verify_fdata = True
+        binary = controller.measure_s11()
+
+        transfer = binary["data_transfer"]
+        self.assertEqual(transfer["format"], "REAL64")
+        self.assertEqual([item["command"] for item in transfer["last_reads"]], ["CALC:DATA:SDATA?", "CALC:DATA:FDATa?"])
+        self.assertEqual(transfer["last_reads"][0]["bytes"], 201 * 16 + len(str(201 * 16)) + 3)
+        self.assertEqual(transfer["reads"], 2)
+        self.assertTrue(binary["fdata_check"]["ok"])
+
+        simulator.inject_error(-224, "Illegal parameter value")
+        with patch("builtins.print"):
+            self.assertEqual(controller._select_data_format(), "ASCII")
+        controller.select_mode()
+        self.assertEqual(simulator.data_format, "ASC")
+        ascii_result = controller.measure_s11()
+        self.assertEqual(ascii_result["data_transfer"]["format"], "ASCII")
+        self.assertLess(
+            abs(ascii_result["primary_valley"]["frequency_hz"] - binary["primary_valley"]["frequency_hz"]),
+            2e6,
+        )
+
+    def test_na_calibration_cache_recalls_state_per_preset(self):
+        from fieldfox_simulator import FieldFoxSimulator, SimulatedVisaResource
+
+        simulator = FieldFoxSimulator(time_scale=0.0)
+        with tempfile.TemporaryDirectory() as tmp, patch("builtins.print"):
+            cache = NACalibrationCache(Path(tmp) / "na_cal_cache.json")
+            controller = N9918ANAController(ip_address="192.0.2.1", calibration_cache=cache)
+            controller.device = SimulatedVisaResource(simulator)
+            controller.connected = True
+            switch = FakeSwitch()
+
+            controller.configure_preset("ANT_2450")
+            self.assertIsNone(controller.recall_calibration(switch))
+            calibrated = controller.perform_calibration(switch)
+            self.assertFalse(calibrated["cached"])
+            self.assertEqual(calibrated["events"][-1]["step"], "CACHE")
+            self.assertIn(NACalibrationCache.state_file(controller.current_config), simulator.state_files)
+
+            controller.configure_preset("ANT_5G")
+            self.assertIsNone(controller.recall_calibration(switch))
+            controller.perform_calibration(switch)
+
+            controller.configure_preset("ANT_2450")
+            # Switch 不可用时不召回，由调用方走完整校准
+            self.assertIsNone(controller.recall_calibration(None))
+            switch.connected = False
+            self.assertIsNone(controller.recall_calibration(switch))
+            switch.connected = True
+            switch.calls.clear()
+            recalled = controller.recall_calibration(switch)
+            self.assertTrue(recalled["cached"])
+            self.assertEqual(recalled["cache_entry"]["preset_key"], "ANT_2450")
+            self.assertEqual(switch.calls, [("B", 2), ("C", 2)])
+            self.assertEqual(float(simulator.settings["NA"]["FREQ:STAR"]), NA_PRESET_CONFIGS["ANT_2450"]["start_freq"])
+            self.assertEqual(controller.measure_s11()["config"]["label"], NA_PRESET_CONFIGS["ANT_2450"]["label"])
+
+            # 索引持久化；过期或仪器上文件丢失时不召回，后者同时清掉索引
+            reloaded = NACalibrationCache(cache.path, validity_s=0.0)
+            self.assertEqual(len(reloaded.entries()), 2)
+            self.assertIsNone(reloaded.lookup(controller.current_config, now=time.time() + 1.0))
+            simulator.state_files.clear()
+            self.assertIsNone(controller.recall_calibration(switch))
+            self.assertEqual([entry["preset_key"] for entry in cache.entries()], ["ANT_5G"])
+            self.assertEqual(simulator.errors, [])
+
+    def test_na_adaptive_sweep_zooms_on_valleys_in_less_sweep_time(self):
+        from fieldfox_simulator import FieldFoxSimulator, SimulatedVisaResource
+
+        simulator = FieldFoxSimulator(time_scale=0.0)
+        controller = N9918ANAController(ip_address="192.0.2.1")
+        controller.device = SimulatedVisaResource(simulator)
+        controller.connected = True
+        with patch("builtins.print"):
+            controller._select_data_format()
+        controller.configure_preset("ANT_FULL")
+        dense = controller.measure_s11()
+        adaptive = controller.measure_s11_adaptive()
+        truth_freqs, truth_s11, _real, _imag = controller._acquire_segment(850e6, 1000e6, 3001, 10e3)
+        truth = truth_freqs[min(range(len(truth_s11)), key=truth_s11.__getitem__)]
+        controller._restore_preset_sweep()
+
+        sweep = adaptive["adaptive_sweep"]
+        self.assertEqual(sweep["sweeps"][0]["kind"], "coarse")
+        self.assertGreaterEqual(sweep["zoom_count"], 3)
+        self.assertLess(sweep["zoom_resolution_hz"], sweep["dense_resolution_hz"] / 5)
+        # FieldFox 扫描时间近似正比于 points/IFBW
+        sweep_cost = sum(item["points"] / item["ifbw"] for item in sweep["sweeps"])
+        self.assertLess(sweep_cost, 0.5 * dense["config"]["points"] / dense["config"]["ifbw"])
+        frequencies = adaptive["series"]["frequency_mhz"]
+        self.assertEqual(len(frequencies), sweep["merged_points"])
+        self.assertTrue(all(low < high for low, high in zip(frequencies, frequencies[1:])))
+        self.assertLess(
+            abs(adaptive["primary_valley"]["frequency_hz"] - truth),
+            abs(dense["primary_valley"]["frequency_hz"] - truth),
+        )
+        self.assertEqual(float(simulator.settings["NA"]["FREQ:STAR"]), 30e3)
+        self.assertEqual(int(simulator.settings["NA"]["SWE:POIN"]), 5001)
+        self.assertEqual(float(simulator.settings["NA"]["BWID"]), 10e3)
+        self.assertEqual(len(controller.measure_s11()["series"]["s11_db"]), 5001)
+
+    def test_na_segmented_full_span_streams_valleys_per_segment(self):
+        from fieldfox_simulator import FieldFoxSimulator, SimulatedVisaResource
+
+        simulator = FieldFoxSimulator(time_scale=0.0)
+        controller = N9918ANAController(ip_address="192.0.2.1")
+        controller.device = SimulatedVisaResource(simulator)
+        controller.connected = True
+        with patch("builtins.print"):
+            controller._select_data_format()
+        controller.configure_preset("ANT_FULL")
+        progress = []
+        result = controller.measure_s11_segmented(segments=3, points_per_segment=4001, on_segment=progress.append)
+
+        self.assertEqual([item["segment"] for item in progress], [1, 2, 3])
+        self.assertEqual(progress[-1]["points_done"], 12003)
+        # 第一段结束时已能给出低频段的谷
+        self.assertTrue(any(abs(valley["frequency_mhz"] - 434.0) < 5 for valley in progress[0]["valleys"]))
+        final_valleys = [round(valley["frequency_mhz"]) for valley in result["valleys"]]
+        self.assertEqual([round(valley["frequency_mhz"]) for valley in progress[-1]["valleys"]], final_valleys)
+
+        sweep = result["segmented_sweep"]
+        self.assertEqual(sweep["total_points"], 12003)
+        self.assertEqual(sweep["buffer_bytes"], 12003 * 32)
+        self.assertEqual(len(result["series"]["frequency_mhz"]), 12003)
+        frequencies = result["series"]["frequency_mhz"]
+        self.assertTrue(all(low < high for low, high in zip(frequencies, frequencies[1:])))
+        self.assertAlmostEqual(sweep["resolution_hz"], (26.5e9 - 30e3) / 12002)
+        self.assertEqual(int(simulator.settings["NA"]["SWE:POIN"]), 5001)
+        self.assertEqual(simulator.errors, [])
+
+        with self.assertRaises(N9918ANAError):
+            controller.measure_s11_segmented(points_per_segment=20001)
+        buffer = SegmentedS11Buffer(1e6, 2e6, 2, 11)
+        with self.assertRaises(ValueError):
+            buffer.add_segment(1, [0.0] * 11, [0.0] * 11, [0.0] * 11, [0.0] * 11)
+
+    def test_sa_trace_hold_mode_reads_each_trace_once(self):
+        controller = N9918AController(ip_address="192.0.2.1", trace_format="ASCII")
+        controller.device = FakeVisaDevice()
+        controller.connected = True
+        controller.start_freq = 1
+        controller.stop_freq = 3
+        controller.n_points = 3
+
+        results = controller.get_emc_measurement_fast(0.2, acquisition_mode="TRACE_HOLD")
+        self.assertEqual(set(results) & {"PEAK", "QUASI_PEAK", "AVERAGE"}, {"PEAK", "AVERAGE"})
+        self.assertEqual(results["PEAK"][1], [1.0, 2.0, 3.0])
+        self.assertEqual(results["sampling_info"]["acquisition_mode"], "TRACE_HOLD")
+        commands = [command for _kind, command in controller.device.commands]
+        self.assertIn(":TRAC1:TYPE MAXH", commands)
+        self.assertIn(":TRAC2:TYPE AVG", commands)
+        self.assertIn(":SENS:AVER:TYPE VOLT", commands)
+        self.assertLess(commands.index("INIT:CONT ON"), commands.index(":TRAC1:DATA?"))
+        self.assertEqual(commands.count(":TRAC1:DATA?"), 1)
+        self.assertEqual(commands.count(":TRAC2:DATA?"), 1)
+        self.assertNotIn(":INIT:IMM;*OPC?", commands)
+        self.assertEqual(controller.get_emc_measurement_fast(0.2, acquisition_mode="BOGUS"), {})
+
     def test_sa_config_applies_screening_trace_setup(self):
         previous_pyvisa = n9918a_backend.pyvisa
         n9918a_backend.pyvisa = FakePyVisa
@@ -515,6 +1046,83 @@ class BackendRegressionTest(unittest.TestCase):
         self.assertIn(":TRAC1:TYPE CLRW", commands)
         self.assertIn("SYST:ERR?", commands)
 
+    def test_sa_configure_batches_settings_and_readback(self):
+        controller = N9918AController(ip_address="192.0.2.1", trace_format="ASCII")
+        controller.device = FakeVisaDevice()
+        controller.connected = True
+        with patch.object(n9918a_backend.time, "sleep") as sleep:
+            self.assertTrue(controller.configure_settings("MF_150kHz_30MHz"))
+        sleep.assert_not_called()
+
+        queries = [command for kind, command in controller.device.commands if kind == "query"]
+        batch = [command for command in queries if command.startswith(":SENS:FREQ:STAR ")]
+        self.assertEqual(len(batch), 1)
+        self.assertTrue(batch[0].endswith(";*OPC?"))
+        self.assertIn(";:SENS:BAND:VID 30000.0;", batch[0])
+        # 可选设置不进入必需的批量消息
+        self.assertNotIn("AUTO OFF", batch[0])
+        self.assertNotIn("GAIN:STAT", batch[0])
+        self.assertIn(":SENS:FREQ:STAR?;:SENS:FREQ:STOP?;:SENS:SWE:POIN?;:SENS:BAND:RES?;:SENS:BAND:VID?", queries)
+        self.assertEqual((controller.start_freq, controller.stop_freq, controller.n_points), (150e3, 30e6, 1501))
+        self.assertEqual((controller.rbw, controller.vbw), (10e3, 30e3))
+        self.assertIsNotNone(controller.get_current_status()["configure_latency_s"])
+
+    def test_sa_configure_tolerates_unsupported_optional_settings(self):
+        class NoPreampDevice(FakeVisaDevice):
+            def write(self, command):
+                if "GAIN:STAT" in command or "AUTO OFF" in command:
+                    raise RuntimeError("-113 Undefined header")
+                super().write(command)
+
+        controller = N9918AController(ip_address="192.0.2.1", trace_format="ASCII")
+        controller.device = NoPreampDevice()
+        controller.connected = True
+        with patch("builtins.print") as fake_print:
+            self.assertTrue(controller.configure_settings("MF_150kHz_30MHz"))
+        warnings = [call.args[0] for call in fake_print.call_args_list if "[WARN]" in str(call.args[0])]
+        self.assertTrue(any("internal preamp" in warning for warning in warnings))
+        self.assertFalse(any("批量配置失败" in warning for warning in warnings))
+        queries = [command for kind, command in controller.device.commands if kind == "query"]
+        self.assertTrue(any(command.startswith(":SENS:FREQ:STAR ") for command in queries))
+        self.assertEqual((controller.start_freq, controller.stop_freq, controller.n_points), (150e3, 30e6, 1501))
+
+    def test_scpi_shadow_state_skips_redundant_writes(self):
+        from scpi_state import SCPIShadowState
+
+        shared = SCPIShadowState()
+        controller = N9918AController(ip_address="192.0.2.1", trace_format="ASCII", scpi_state=shared)
+        controller.device = FakeVisaDevice()
+        controller.connected = True
+        self.assertTrue(controller.configure_settings("EMC_30MHz_1GHz"))
+        controller.device.commands.clear()
+        controller.device.read = lambda: ",".join(["1"] * 2001)
+
+        self.assertTrue(controller.configure_settings("EMC_30MHz_1GHz"))
+        controller.acquire_single_trace(reset_trace=True)
+        controller.acquire_single_trace(reset_trace=True)
+        commands = [command for _kind, command in controller.device.commands]
+        self.assertFalse(any(command.startswith(":SENS:FREQ:STAR") for command in commands))
+        self.assertNotIn("INST:SEL 'SA';*OPC?", commands)
+        self.assertNotIn(":TRAC1:TYPE CLRW", commands)
+        self.assertEqual(commands.count(":TRAC1:XVAL?"), 1)
+        self.assertEqual(commands.count(":INIT:IMM;*OPC?"), 2)
+
+        na_controller = N9918ANAController(ip_address="192.0.2.1", scpi_state=shared)
+        na_controller.device = FakeVisaDevice()
+        na_controller.connected = True
+        na_controller.select_mode()
+        self.assertEqual(shared.mode, "NA")
+        controller.device.commands.clear()
+        self.assertTrue(controller.configure_settings("EMC_30MHz_1GHz"))
+        commands = [command for _kind, command in controller.device.commands]
+        self.assertIn("INST:SEL 'SA';*OPC?", commands)
+        self.assertTrue(any(command.startswith(":SENS:FREQ:STAR 30000000.0;") for command in commands))
+
+        controller.device.query = lambda command: "-113,\"Undefined header\"" if command == "SYST:ERR?" else "1"
+        controller._check_scpi_errors("test")
+        self.assertIsNone(shared.mode)
+        self.assertEqual(shared.values, {})
+
     def test_sa_manual_clear_blanks_fieldfox_trace(self):
         previous_pyvisa = n9918a_backend.pyvisa
         n9918a_backend.pyvisa = FakePyVisa
@@ -558,6 +1166,282 @@ class BackendRegressionTest(unittest.TestCase):
         exceeded = [peak for peak in peaks if peak["exceed_fcc"] or peak["exceed_ce"]]
         self.assertEqual([round(peak["frequency_mhz"]) for peak in exceeded], [31, 100])
 
+    def test_emc_detector_engine_computes_all_modes_in_one_pass(self):
+        frequencies = [30e6, 100e6, 300e6]
+        samples = [
+            {"timestamp": 0.0, "frequencies": frequencies, "amplitudes": [20.0, 40.0, 10.0]},
+            {"timestamp": 0.5, "frequencies": frequencies, "amplitudes": [0.0, 42.0, 30.0]},
+            {"timestamp": 1.0, "frequencies": frequencies, "amplitudes": [10.0, 38.0, 20.0]},
+        ]
+        results = calculate_emc_detectors(samples)
+
+        self.assertEqual(set(results), {"PEAK", "QUASI_PEAK", "AVERAGE"})
+        self.assertIs(results["PEAK"][0], frequencies)
+        self.assertEqual(results["PEAK"][1], [20.0, 42.0, 30.0])
+        for index in range(3):
+            column = [sample["amplitudes"][index] for sample in samples]
+            self.assertAlmostEqual(results["AVERAGE"][1][index], linear_average_dbuv(column), places=9)
+            self.assertLessEqual(results["QUASI_PEAK"][1][index], results["PEAK"][1][index] + 1e-9)
+
+    def test_emc_detector_accumulator_matches_batch_engine(self):
+        frequencies = [100e3, 10e6, 300e6, 2e9]
+        rng = np.random.default_rng(11)
+        worst_qp = 0.0
+        for trial in range(40):
+            count = int(rng.integers(2, 60))
+            times = rng.uniform(0.001, 0.3, count).cumsum()
+            amplitudes = rng.uniform(0.0, 80.0, (count, len(frequencies)))
+            if trial % 2:
+                # 电平随时间漂移时运行平均与全程平均相差最大
+                amplitudes += np.linspace(-20.0, 20.0, count)[:, None]
+            samples = [
+                {"timestamp": float(timestamp), "frequencies": frequencies, "amplitudes": row.tolist()}
+                for timestamp, row in zip(times, amplitudes)
+            ]
+            accumulator = EMCDetectorAccumulator()
+            for sample in samples:
+                accumulator.update(sample["timestamp"], sample["amplitudes"], sample["frequencies"])
+            self.assertFalse(accumulator.update(times[-1] + 1.0, [1.0, 2.0]))
+
+            streaming = accumulator.results()
+            with patch("builtins.print"):
+                batch = calculate_emc_detectors(samples)
+            self.assertEqual(accumulator.sample_count, count)
+            for mode in ("PEAK", "AVERAGE"):
+                for left, right in zip(streaming[mode][1], batch[mode][1]):
+                    self.assertAlmostEqual(left, right, places=9)
+            for left, peak in zip(streaming["QUASI_PEAK"][1], streaming["PEAK"][1]):
+                self.assertLessEqual(left, peak + 1e-9)
+            worst_qp = max(worst_qp, max(abs(left - right) for left, right in zip(streaming["QUASI_PEAK"][1], batch["QUASI_PEAK"][1])))
+        # 在线 QP 以运行平均为下限，只是近似值（见 EMCDetectorAccumulator 说明）
+        self.assertGreater(worst_qp, 0.0)
+        self.assertLess(worst_qp, 0.5)
+
+    def test_emc_fast_measurement_recomputes_exact_qp_from_kept_samples(self):
+        frequencies = [100e3, 10e6, 300e6]
+        rng = np.random.default_rng(5)
+        rows = rng.uniform(0.0, 80.0, (30, 3)) + np.linspace(-20.0, 20.0, 30)[:, None]
+
+        def fake_collect(duration_seconds, should_stop=None, accumulator=None, keep_samples=True, sample_store=None):
+            store = EMCSampleStore() if keep_samples else []
+            for index, row in enumerate(rows):
+                accumulator.update(0.05 * index, row.tolist(), frequencies)
+                if keep_samples:
+                    store.append(0.05 * index, row.tolist(), frequencies)
+            return store
+
+        controller = N9918AController(ip_address="192.0.2.1")
+        controller.connected = True
+        with patch.object(controller, "collect_emc_time_series", side_effect=fake_collect), patch("builtins.print"):
+            kept = controller.get_emc_measurement_fast(1.0)
+            streamed = controller.get_emc_measurement_fast(1.0, keep_samples=False)
+            batch = calculate_emc_detectors(kept["sampling_data"])
+        self.assertEqual(kept["sampling_info"]["quasi_peak_source"], "samples")
+        self.assertEqual(kept["QUASI_PEAK"][1], batch["QUASI_PEAK"][1])
+        self.assertEqual(streamed["sampling_info"]["quasi_peak_source"], "streaming")
+        self.assertNotEqual(streamed["QUASI_PEAK"][1], batch["QUASI_PEAK"][1])
+
+    def test_emc_sample_store_keeps_dict_view_and_detector_results(self):
+        frequencies = [100e3, 10e6, 300e6]
+        samples = [
+            {"timestamp": 0.25 * index, "frequencies": frequencies,
+             "amplitudes": [20.0 + index % 3, 30.5 - index % 4, 40.0 + (index % 5) * 0.5]}
+            for index in range(12)
+        ]
+        store = EMCSampleStore(initial_capacity=2)
+        for sample in samples:
+            self.assertTrue(store.append(sample["timestamp"], sample["amplitudes"], sample["frequencies"]))
+        self.assertFalse(store.append(9.0, [1.0, 2.0]))
+
+        self.assertEqual(len(store), 12)
+        self.assertEqual(store.amplitudes.dtype.name, "float32")
+        self.assertEqual(store[3]["amplitudes"], samples[3]["amplitudes"])
+        self.assertIs(store[-1]["frequencies"], frequencies)
+        self.assertEqual([sample["timestamp"] for sample in store], [sample["timestamp"] for sample in samples])
+        from_store = calculate_emc_detectors(store)
+        from_dicts = calculate_emc_detectors(samples)
+        for mode in ("PEAK", "QUASI_PEAK", "AVERAGE"):
+            self.assertEqual(from_store[mode][1], from_dicts[mode][1])
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                saved = save_emi_measurement_data({"sampling_data": store}, filename_prefix="store")
+                with open(saved[0], encoding="utf-8") as handle:
+                    rows = handle.read().splitlines()
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(len(rows), 13)
+        self.assertTrue(rows[2].startswith("0.250,21.00,29.50,40.50"))
+
+    def test_emc_disk_capture_reopens_partial_capture_with_chunked_detectors(self):
+        controller = N9918AController(ip_address="192.0.2.1", trace_format="ASCII")
+        controller.device = FakeVisaDevice()
+        controller.connected = True
+        controller.start_freq, controller.stop_freq, controller.n_points = 1, 3, 3
+
+        with tempfile.TemporaryDirectory() as tmp:
+            capture_path = os.path.join(tmp, "capture")
+            live = controller.get_emc_measurement_fast(0.3, capture_to_disk=capture_path)
+            self.assertEqual(live["sampling_info"]["capture_path"], capture_path)
+            store = live["sampling_data"]
+            self.assertIsInstance(store, EMCDiskSampleStore)
+            self.assertGreater(len(store), 1)
+
+            # 模拟崩溃：header 未关闭，数据文件末尾有半行
+            with open(os.path.join(capture_path, "amplitudes.f32"), "ab") as handle:
+                handle.write(b"\0\0")
+            with open(os.path.join(capture_path, "header.json"), encoding="utf-8") as handle:
+                header = json.load(handle)
+            header["closed"] = False
+            with open(os.path.join(capture_path, "header.json"), "w", encoding="utf-8") as handle:
+                json.dump(header, handle)
+
+            reopened = load_emc_capture(capture_path, chunk_size=2)
+            self.assertTrue(reopened["sampling_info"]["recovered"])
+            self.assertEqual(reopened["sampling_info"]["total_samples"], len(store))
+            for mode in ("PEAK", "AVERAGE"):
+                for left, right in zip(reopened[mode][1], live[mode][1]):
+                    self.assertAlmostEqual(left, right, places=9)
+            in_memory = calculate_emc_detectors(list(reopened["sampling_data"]))
+            for left, right in zip(reopened["QUASI_PEAK"][1], in_memory["QUASI_PEAK"][1]):
+                self.assertAlmostEqual(left, right, places=9)
+
+            resumed = EMCDiskSampleStore(capture_path)
+            self.assertFalse(hasattr(resumed, "_times"))
+            self.assertEqual(resumed.nbytes, 0)
+            self.assertEqual(resumed.amplitudes.shape, (len(store), 3))
+            self.assertEqual(resumed.nbytes, resumed.disk_bytes)
+            self.assertTrue(resumed.append(99.0, [1.0, 2.0, 3.0]))
+            resumed.close()
+            self.assertEqual(len(EMCDiskSampleStore(capture_path)), len(store) + 1)
+
+    def test_emc_disk_captures_in_same_second_get_separate_directories(self):
+        controller = N9918AController(ip_address="192.0.2.1", trace_format="ASCII")
+        fixed_now = n9918a_backend.datetime(2026, 1, 2, 3, 4, 5)
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                with patch.object(n9918a_backend, "datetime") as fake_datetime:
+                    fake_datetime.now.return_value = fixed_now
+                    first = controller._create_capture_store(True, 1)
+                    self.assertTrue(first.append(0.0, [1.0, 2.0, 3.0], frequencies=[1.0, 2.0, 3.0]))
+                    first.close()
+                    second = controller._create_capture_store(True, 1)
+                    second.close()
+                with self.assertRaises(FileExistsError):
+                    controller._create_capture_store(first.path, 1)
+            finally:
+                os.chdir(cwd)
+            self.assertNotEqual(first.path, second.path)
+            self.assertTrue(second.path.endswith("emi_capture_20260102_030405_1"))
+            self.assertEqual(len(EMCDiskSampleStore(first.path)), 1)
+            self.assertEqual(len(EMCDiskSampleStore(second.path)), 0)
+
+    def test_quasi_peak_array_matches_scalar_estimator(self):
+        rng = np.random.default_rng(9918)
+        frequencies = [50e3, 150e3, 10e6, 30e6, 500e6]
+        times = rng.permutation(np.arange(40) * 0.05)
+        matrix = rng.uniform(0.0, 60.0, size=(40, len(frequencies)))
+        result = calculate_quasi_peak_array(times, matrix, frequencies)
+        for index, freq in enumerate(frequencies):
+            expected = calculate_quasi_peak_value(list(times), list(matrix[:, index]), freq)
+            self.assertAlmostEqual(result[index], expected, places=9)
+        no_freq = calculate_quasi_peak_array(times, matrix[:, 0])
+        self.assertAlmostEqual(no_freq[0], calculate_quasi_peak_value(list(times), list(matrix[:, 0])), places=9)
+
+    def test_compiled_limit_table_matches_per_bin_limits(self):
+        frequencies = [0.1e6, 0.15e6, 0.3e6, 0.5e6, 5e6, 29.9e6, 30e6, 88e6, 100e6, 216e6, 230e6, 960e6, 1e9, 2e9, 18e9, 20e9]
+        for detector in ("QUASI_PEAK", "AVERAGE", "PEAK", "POSITIVE", None):
+            table = compile_limit_table(frequencies, detector_type=detector)
+            self.assertIs(table, compile_limit_table(list(frequencies), detector_type=detector))
+            for index, freq in enumerate(frequencies):
+                expected = get_emission_limit_info(freq, detector_type=detector)
+                info = table.info(index)
+                self.assertAlmostEqual(info.pop("fcc_limit"), expected.pop("fcc_limit"), places=9)
+                self.assertAlmostEqual(info.pop("ce_limit"), expected.pop("ce_limit"), places=9)
+                self.assertEqual(info, expected)
+        table = compile_limit_table(frequencies)
+        self.assertEqual(table.exceeding_indices([0.0] * 8 + [45.0] + [0.0] * 7), [8])
+
+    def test_numpy_peak_finder_matches_scipy_semantics(self):
+        data = [0, 5, 5, 5, 0, 3, 1, 8, 2, 8, 2, 4, 4, 0]
+        peaks, properties = find_peaks_numpy(data)
+        self.assertEqual(peaks.tolist(), [2, 5, 7, 9, 11])  # 平台取中点
+        peaks, _ = find_peaks_numpy(data, distance=3)
+        self.assertEqual(peaks.tolist(), [2, 5, 9])
+        peaks, properties = find_peaks_numpy(data, height=4, prominence=4)
+        self.assertEqual(peaks.tolist(), [2, 7, 9])
+        self.assertEqual(properties["prominences"].tolist(), [5.0, 8.0, 8.0])
+
+        if n9918a_backend.signal is None:
+            return
+        rng = np.random.default_rng(7)
+        for _ in range(20):
+            values = np.round(rng.normal(size=300).cumsum(), 1)
+            kwargs = {"distance": 7, "prominence": 0.5, "height": float(values.mean())}
+            expected, _ = n9918a_backend.signal.find_peaks(values, **kwargs)
+            actual, _ = find_peaks_numpy(values, **kwargs)
+            self.assertEqual(actual.tolist(), expected.tolist())
+
+        frequencies = [30e6 + index * 0.5e6 for index in range(1001)]
+        amplitudes = [
+            round(20 + 6 * math.sin(index / 17.0) + 25 * math.exp(-((index - 400) ** 2) / 40.0), 2)
+            for index in range(1001)
+        ]
+        with_scipy = post_process_peak_search(frequencies, amplitudes)
+        with patch.object(n9918a_backend, "signal", None):
+            without_scipy = post_process_peak_search(frequencies, amplitudes)
+        self.assertEqual(without_scipy, with_scipy)
+
+    def test_vectorized_peak_search_matches_legacy_loop(self):
+        if n9918a_backend.signal is None:
+            self.skipTest("legacy reference needs scipy")
+        # 30MHz-530MHz 同属辐射限值段：超限的宽包络 + 两个等高超限尖峰 + 70 个等高未超限尖峰（分数并列且超过名额）
+        frequencies = [30e6 + index * 0.5e6 for index in range(1001)]
+        amplitudes = [20.0] * 1001
+        for index in range(380, 421):
+            amplitudes[index] = round(20.0 + 30.0 * math.exp(-((index - 400) ** 2) / 60.0), 2)
+        for index in (150, 170):
+            amplitudes[index] = 52.0
+        for index in range(450, 1000, 7):
+            amplitudes[index] = 31.0
+        amplitudes[600] = 31.5
+
+        for detector in ("QUASI_PEAK", "PEAK"):
+            expected = legacy_post_process_peak_search(frequencies, amplitudes, detector_type=detector)
+            actual = post_process_peak_search(frequencies, amplitudes, detector_type=detector)
+            self.assertEqual(len(actual), 50)
+            self.assertEqual(sum(peak["exceed_fcc"] for peak in actual), 3)
+            self.assertEqual([peak["frequency_hz"] for peak in actual], [peak["frequency_hz"] for peak in expected])
+            for got, want in zip(actual, expected):
+                self.assertEqual(set(got), set(want))
+                for key, value in want.items():
+                    if isinstance(value, float):
+                        self.assertAlmostEqual(got[key], value, places=9, msg=key)
+                    else:
+                        self.assertEqual(got[key], value, key)
+
+    def test_numpy_peak_distance_filter_is_single_pass_on_rising_ripple(self):
+        # 单调上升 + 纹波：一串峰的高度依次递增，逐轮剔除的实现需要每个峰一轮
+        index = np.arange(10001)
+        values = np.round(10 + 40 * index / index.size + 2 * np.sin(index * 0.9), 2)
+        for distance in (7, 30):
+            start = time.perf_counter()
+            actual, _ = find_peaks_numpy(values, distance=distance)
+            self.assertLess(time.perf_counter() - start, 0.2)
+            if n9918a_backend.signal is not None:
+                expected, _ = n9918a_backend.signal.find_peaks(values, distance=distance)
+                self.assertEqual(actual.tolist(), expected.tolist())
+
+        frequencies = (30e6 + index * 97e3).tolist()
+        with patch.object(n9918a_backend, "signal", None):
+            start = time.perf_counter()
+            post_process_peak_search(frequencies, values.tolist())
+            self.assertLess(time.perf_counter() - start, 0.3)
+
     def test_na_calibration_switch_and_scpi_sequence(self):
         device = FakeVisaDevice()
         controller = N9918ANAController(ip_address="192.0.2.1")
@@ -577,6 +1461,34 @@ class BackendRegressionTest(unittest.TestCase):
         self.assertLess(commands.index("CORR:COLL:INT 1;*OPC?"), commands.index("CORR:COLL:LOAD 1;*OPC?"))
         self.assertIn("CORR:COLL:SAVE 0", commands)
 
+    def test_na_measure_reads_only_sdata_and_checks_fdata_on_demand(self):
+        device = FakeVisaDevice()
+        controller = N9918ANAController(ip_address="192.0.2.1")
+        controller.device = device
+        controller.connected = True
+        controller.configure_preset("ANT_433", points=5)
+
+        result = controller.measure_s11()
+        queries = [command for kind, command in device.commands if kind == "query"]
+        self.assertIn("CALC:DATA:SDATA?", queries)
+        self.assertNotIn("CALC:DATA:FDATa?", queries)
+        self.assertEqual(result["s11_source"], "SDATA")
+        self.assertNotIn("fdata_check", result)
+        self.assertAlmostEqual(result["series"]["s11_db"][0], 20 * math.log10(0.9), places=4)
+        self.assertAlmostEqual(result["primary_valley"]["s11_db"], -20.0)
+
+        controller.verify_fdata = True
+        with patch("builtins.print") as fake_print:
+            checked = controller.measure_s11()
+        self.assertIn("CALC:DATA:FDATa?", [command for _kind, command in device.commands])
+        self.assertFalse(checked["fdata_check"]["ok"])
+        self.assertIn("[WARN]", fake_print.call_args[0][0])
+        self.assertEqual(checked["series"]["s11_db"].tolist(), result["series"]["s11_db"].tolist())
+
+        controller.s11_source = "FDATA"
+        legacy = controller.measure_s11()
+        self.assertEqual(legacy["series"]["s11_db"].tolist(), [-1, -8, -20, -8, -1])
+
 
 class AIClientRegressionTest(unittest.TestCase):
     def test_ai_prompt_keeps_utf8_chinese(self):
@@ -710,6 +1622,77 @@ class NAAlgorithmTest(unittest.TestCase):
         self.assertEqual([round(v["frequency_mhz"]) for v in result["valleys"]], [2, 5, 8])
         self.assertAlmostEqual(result["primary_valley"]["frequency_mhz"], 5.0)
 
+    def test_vectorized_valleys_and_bandwidths_across_multiple_valleys(self):
+        frequencies = frequency_axis(0, 12e6, 13)
+        s11_db = [0, -5, -20, -5, 0, -4, -12, -4, 0, -1, -2, -1, 0]
+
+        valleys = find_s11_valleys(frequencies, s11_db, min_separation_points=3)
+        self.assertEqual([v["index"] for v in valleys], [2, 6, 10])
+        self.assertEqual([v["prominence_db"] for v in valleys], [20, 12, 2])
+        spaced = find_s11_valleys(frequencies, s11_db, min_separation_points=5)
+        self.assertEqual([v["index"] for v in spaced], [2, 10])
+
+        batch = calculate_valley_bandwidths(frequencies, s11_db, valleys)
+        self.assertEqual(batch, [calculate_all_bandwidths(frequencies, s11_db, v) for v in valleys])
+        self.assertAlmostEqual(batch[1]["absolute_10db"]["left_hz"], 5.75e6)
+        self.assertAlmostEqual(batch[1]["absolute_10db"]["right_hz"], 6.25e6)
+        self.assertIsNone(batch[2]["absolute_3db"]["left_hz"])
+        # 相对 +3dB 阈值高于整条曲线：无穿越点，带宽覆盖全频段
+        self.assertEqual(batch[2]["relative_3db"]["width_hz"], 12e6)
+        self.assertTrue(batch[2]["relative_3db"]["complete"])
+
+    def test_build_na_result_reports_stage_timings(self):
+        frequencies = frequency_axis(1e6, 10e6, 10)
+        s11_db = [0, -10, 0, 0, -20, 0, 0, -15, 0, 0]
+        config = {"start_freq": 1e6, "stop_freq": 10e6, "points": 10, "full_sweep": True}
+        timings = {}
+        timed = build_na_result(frequencies, s11_db, [0.1] * 10, [0.0] * 10, config, "ANT_FULL", timings=timings)
+        plain = build_na_result(frequencies, s11_db, [0.1] * 10, [0.0] * 10, config, "ANT_FULL")
+
+        self.assertEqual(
+            set(timings),
+            {"inputs", "valleys", "bandwidths", "target", "valley_bandwidths", "smith", "series"},
+        )
+        self.assertTrue(all(seconds >= 0 for seconds in timings.values()))
+        timed.pop("measurement_time")
+        plain.pop("measurement_time")
+        self.assertEqual(na_result_lists(timed), na_result_lists(plain))
+
+    def test_build_na_result_keeps_arrays_until_serialization(self):
+        frequencies = frequency_axis(1e6, 5e6, 5)
+        result = build_na_result(frequencies, [0.0, -10.0, -20.0, -10.0, 0.0], [1.0, 0.2, 0.1, 0.2, 1.0], [0.0] * 5)
+        self.assertTrue(hasattr(result["series"]["vswr"], "dtype"))
+        self.assertTrue(hasattr(result["smith"]["real"], "dtype"))
+
+        payload = na_result_lists(result)
+        self.assertEqual(payload["series"]["frequency_mhz"], [1.0, 2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(payload["series"]["return_loss_db"], [-0.0, 10.0, 20.0, 10.0, -0.0])
+        # 全反射点的 VSWR 为 None，与逐点的 vswr_from_s11_db 一致
+        self.assertIsNone(payload["series"]["vswr"][0])
+        self.assertEqual(payload["series"]["vswr"][2], 1.2222)
+        self.assertEqual(payload["smith"]["real"], [1.0, 0.2, 0.1, 0.2, 1.0])
+        json.loads(json.dumps(payload, allow_nan=False))
+
+    def test_na_result_lists_matches_baseline_list_output(self):
+        rng = np.random.default_rng(25)
+        frequencies = np.sort(rng.uniform(1e6, 6e9, 401))
+        s11_db = rng.uniform(-45.0, 0.0, 401)
+        # 半位点上 np.round 与 Python round() 结果不同
+        s11_db[::2] = np.round(s11_db[::2], 4) - 0.00005
+        s11_db[0] = 0.0
+        real = np.round(rng.uniform(-1.0, 1.0, 401), 8) + 5e-9
+        imag = rng.uniform(-1.0, 1.0, 401)
+        payload = na_result_lists(build_na_result(frequencies, s11_db, real, imag))
+
+        values = s11_db.tolist()
+        self.assertEqual(payload["series"]["frequency_mhz"], [round(freq / 1e6, 6) for freq in frequencies.tolist()])
+        self.assertEqual(payload["series"]["s11_db"], [round(value, 4) for value in values])
+        self.assertEqual(payload["series"]["return_loss_db"], [n9918a_na_backend.return_loss_from_s11_db(value) for value in values])
+        self.assertEqual(payload["series"]["vswr"], [n9918a_na_backend.vswr_from_s11_db(value) for value in values])
+        self.assertEqual(payload["smith"]["real"], [round(value, 8) for value in real.tolist()])
+        self.assertEqual(payload["smith"]["imag"], [round(value, 8) for value in imag.tolist()])
+        self.assertEqual(na_result_lists(payload)["series"], payload["series"])
+
 
 if __name__ == "__main__":
     unittest.main()
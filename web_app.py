@@ -6,7 +6,7 @@ import threading
 import webbrowser
 from pathlib import Path
 
-from flask import Flask, jsonify, request, send_file, send_from_directory
+from flask import Flask, Response, jsonify, request, send_file, send_from_directory
 
 from sa_test_service import SATestService, ServiceError, SWITCH_IMPORT_ERROR
 
@@ -170,10 +170,18 @@ def api_na_configure():
             data.get("preset_key", ""),
             points=data.get("points"),
             ifbw=data.get("ifbw"),
+            verify_fdata=data.get("verify_fdata"),
+            use_cal_cache=data.get("use_cal_cache", True),
+            cal_cache_validity_s=data.get("cal_cache_validity_s"),
         )
     )
 
 
+@app.get("/api/na/calibration/cache")
+def api_na_calibration_cache():
+    return ok(service.na_calibration_cache_status())
+
+
 @app.post("/api/na/calibrate")
 def api_na_calibrate():
     return ok(service.na_calibrate())
@@ -181,7 +189,8 @@ def api_na_calibrate():
 
 @app.post("/api/na/measure")
 def api_na_measure():
-    return ok(service.start_na_measurement())
+    data = request.get_json(silent=True) or {}
+    return ok(service.start_na_measurement(adaptive=bool(data.get("adaptive")), segmented=bool(data.get("segmented"))))
 
 
 @app.post("/api/na/stop")
@@ -189,6 +198,59 @@ def api_na_stop():
     return ok(service.stop_na_measurement())
 
 
+@app.post("/api/na/live/start")
+def api_na_live_start():
+    return ok(service.start_na_live())
+
+
+@app.post("/api/na/live/freeze")
+def api_na_live_freeze():
+    return ok(service.freeze_na_live())
+
+
+@app.get("/api/na/live/stream")
+def api_na_live_stream():
+    after_seq = request.args.get("after", -1, type=int)
+
+    def events():
+        for frame in service.na_live_frames(after_seq=after_seq):
+            if frame is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"id: {frame['seq']}\ndata: {json.dumps(frame, ensure_ascii=False)}\n\n"
+        yield "event: end\ndata: {}\n\n"
+
+    return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/api/na/batch/start")
+def api_na_batch_start():
+    data = request.get_json(silent=True) or {}
+    return ok(
+        service.start_na_batch(
+            mask=data.get("mask"),
+            generate_reports=data.get("generate_reports", True),
+            metadata=data.get("metadata"),
+        )
+    )
+
+
+@app.post("/api/na/batch/measure")
+def api_na_batch_measure():
+    data = request.get_json(silent=True) or {}
+    return ok(service.measure_na_batch_unit(data.get("serial")))
+
+
+@app.post("/api/na/batch/stop")
+def api_na_batch_stop():
+    return ok(service.stop_na_batch())
+
+
+@app.get("/api/na/batch/status")
+def api_na_batch_status():
+    return ok(service.na_batch_status())
+
+
 @app.get("/api/na/result")
 def api_na_result():
     return ok(service.na_result_payload())
@@ -288,7 +350,13 @@ def api_measure_single():
 @app.post("/api/measure/timed")
 def api_measure_timed():
     data = request.get_json(silent=True) or {}
-    return ok(service.start_emi_measurement(data.get("duration_seconds", 15)))
+    return ok(
+        service.start_emi_measurement(
+            data.get("duration_seconds", 15),
+            acquisition_mode=data.get("acquisition_mode", "PER_SWEEP"),
+            capture_to_disk=bool(data.get("capture_to_disk", False)),
+        )
+    )
 
 
 @app.post("/api/measure/stop")
@@ -10,6 +10,7 @@ const state = {
   valleyPage: 1,
   valleysPerPage: 12,
   lastStatus: null,
+  naLiveSource: null,
 };
 
 const $ = (id) => document.getElementById(id);
@@ -25,6 +26,7 @@ const elements = {
   naWorkspace: $("naWorkspace"),
   deviceIp: $("deviceIp"),
   presetSelect: $("presetSelect"),
+  acquisitionModeSelect: $("acquisitionModeSelect"),
   connectBtn: $("connectBtn"),
   disconnectBtn: $("disconnectBtn"),
   configureBtn: $("configureBtn"),
@@ -63,7 +65,16 @@ const elements = {
   naConfigureBtn: $("naConfigureBtn"),
   naCalibrateBtn: $("naCalibrateBtn"),
   naMeasureBtn: $("naMeasureBtn"),
+  naAdaptiveBtn: $("naAdaptiveBtn"),
+  naSegmentedBtn: $("naSegmentedBtn"),
+  naLiveBtn: $("naLiveBtn"),
+  naFreezeBtn: $("naFreezeBtn"),
   naStopBtn: $("naStopBtn"),
+  naBatchSerial: $("naBatchSerial"),
+  naBatchStartBtn: $("naBatchStartBtn"),
+  naBatchMeasureBtn: $("naBatchMeasureBtn"),
+  naBatchStopBtn: $("naBatchStopBtn"),
+  naBatchReadout: $("naBatchReadout"),
   naCalibrationLog: $("naCalibrationLog"),
   naConfigText: $("naConfigText"),
   naCalibrationText: $("naCalibrationText"),
@@ -195,6 +206,7 @@ function updateStatus(status) {
   elements.singleBtn.disabled = !connected || !status.current_config || measuring || state.mode !== "SA";
   elements.slowBtn.disabled = !connected || !status.current_config || measuring || state.mode !== "SA";
   elements.fastBtn.disabled = !connected || !status.current_config || measuring || state.mode !== "SA";
+  elements.acquisitionModeSelect.disabled = measuring;
   elements.stopBtn.disabled = !measuring;
   elements.clearSaBtn.disabled =
     measuring || state.mode !== "SA" || (!connected && !status.has_single_data && !status.has_emi_data);
@@ -345,8 +357,10 @@ function renderChart(series, peaks = []) {
 
   drawGrid(ctx, width, height, pad);
   drawLine(ctx, xVals, yVals, x, y, "#0a6a72", 2.2);
-  drawLine(ctx, xVals, xVals.map((mhz) => fccLimit(mhz * 1e6)), x, y, "#b7442e", 1.6, [8, 6]);
-  drawLine(ctx, xVals, xVals.map((mhz) => ceLimit(mhz * 1e6)), x, y, "#23744a", 1.6, [4, 5]);
+  const fccVals = series.fcc_limit_dbuv?.length === xVals.length ? series.fcc_limit_dbuv : xVals.map((mhz) => fccLimit(mhz * 1e6));
+  const ceVals = series.ce_limit_dbuv?.length === xVals.length ? series.ce_limit_dbuv : xVals.map((mhz) => ceLimit(mhz * 1e6));
+  drawLine(ctx, xVals, fccVals, x, y, "#b7442e", 1.6, [8, 6]);
+  drawLine(ctx, xVals, ceVals, x, y, "#23744a", 1.6, [4, 5]);
 
   for (const peak of peaks.slice(0, 28)) {
     const px = x(peak.frequency_mhz);
@@ -756,7 +770,7 @@ function renderNaStatus(data) {
   const config = status.config || data.config || {};
   const calibration = status.calibration || {};
   elements.naConfigText.textContent = config.name ? `${config.name} · ${formatHz(config.start_freq)}-${formatHz(config.stop_freq)}` : "未配置";
-  elements.naCalibrationText.textContent = calibration.in_progress ? "校准中" : calibration.complete ? "已校准" : "未校准";
+  elements.naCalibrationText.textContent = calibration.in_progress ? "校准中" : calibration.complete ? (calibration.cached ? "已校准（缓存召回）" : "已校准") : "未校准";
   elements.naSwitchText.textContent = status.switch_position || "--";
   elements.naStatusText.textContent = status.progress_message || status.error || "等待操作";
 
@@ -770,7 +784,24 @@ function renderNaStatus(data) {
   elements.naConfigureBtn.disabled = busy;
   elements.naCalibrateBtn.disabled = busy || !connected || !status.configured;
   elements.naMeasureBtn.disabled = busy || !connected || !status.configured || !calibration.complete;
+  elements.naAdaptiveBtn.disabled = elements.naMeasureBtn.disabled;
+  elements.naSegmentedBtn.disabled = elements.naMeasureBtn.disabled || !config.full_sweep;
+  elements.naLiveBtn.disabled = elements.naMeasureBtn.disabled;
+  elements.naFreezeBtn.disabled = !status.live_active;
   elements.naStopBtn.disabled = !busy;
+  elements.naBatchStartBtn.disabled = elements.naMeasureBtn.disabled || status.batch_active;
+  elements.naBatchMeasureBtn.disabled = busy || !status.batch_active;
+  elements.naBatchStopBtn.disabled = busy || !status.batch_active;
+  if (status.live_active) {
+    // 实时调试期间 S11 曲线和摘要由 SSE 帧刷新，轮询结果只更新状态
+    openNaLiveStream();
+    return;
+  }
+  if (status.segment_progress) {
+    // 分段扫描期间先显示已完成频段里确认的谷值，完整结果在全部分段结束后刷新
+    renderValleys(status.segment_progress.valleys || []);
+    return;
+  }
   elements.naSaveBtn.disabled = busy || !data.series;
   elements.naExportBtn.disabled = busy || !data.series;
 
@@ -784,6 +815,52 @@ function renderNaStatus(data) {
   renderValleys(data.valleys || []);
 }
 
+function renderNaBatch(data) {
+  const summary = data.summary;
+  const unit = data.last_unit;
+  const reports = data.reports || {};
+  const lines = [];
+  if (unit) {
+    const margin = unit.mask_worst_margin_db == null ? "--" : `${unit.mask_worst_margin_db.toFixed(2)} dB`;
+    lines.push(`${unit.serial}: ${unit.pass ? "PASS" : "FAIL"}${unit.retest ? "（复测）" : ""} · 掩模余量 ${margin} · ${unit.elapsed_ms?.toFixed(0) ?? "--"} ms`);
+  }
+  if (summary) {
+    const rate = summary.pass_rate == null ? "--" : `${(summary.pass_rate * 100).toFixed(1)}%`;
+    lines.push(`已测 ${summary.units} 台，PASS ${summary.passed} / FAIL ${summary.failed}（${rate}），复测 ${summary.retests}`);
+    lines.push(`产能 ${summary.units_per_hour ? summary.units_per_hour.toFixed(0) : "--"} 台/小时（单台节拍 ${summary.cycle_units_per_hour ? summary.cycle_units_per_hour.toFixed(0) : "--"} 台/小时）`);
+  }
+  lines.push(`报告队列：完成 ${reports.done || 0} / 排队 ${reports.queued || 0}，失败 ${reports.failed || 0}`);
+  elements.naBatchReadout.textContent = lines.join("\n");
+}
+
+function renderNaLiveFrame(frame) {
+  const primary = frame.primary_valley;
+  const bw = frame.bandwidth_10db || {};
+  const points = [primary, frame.target].filter(Boolean);
+  renderNaS11(frame.trace, primary, { absolute_10db: bw }, points);
+  const rate = frame.frame_rate_hz ? `${frame.frame_rate_hz.toFixed(1)} 帧/s` : "--";
+  elements.naPrimaryText.textContent = primary
+    ? `实时 #${frame.seq + 1}（${rate}）：中心 ${primary.frequency_mhz.toFixed(3)} MHz，S11/RL ${formatS11Rl(primary.s11_db)}，-10dB 带宽 ${bw.width_hz ? formatHz(bw.width_hz) : "--"}`
+    : "暂无中心谷值。";
+  elements.naTargetText.className = "target-compare";
+  elements.naTargetText.textContent = frame.target
+    ? `理想 ${frame.target.frequency_mhz.toFixed(3)} MHz：S11/RL ${formatS11Rl(frame.target.s11_db)} / VSWR ${formatVswr(frame.target.vswr)}`
+    : "全扫宽无理想频点。";
+}
+
+function openNaLiveStream() {
+  if (state.naLiveSource) return;
+  const source = new EventSource("/api/na/live/stream");
+  state.naLiveSource = source;
+  source.onmessage = (event) => renderNaLiveFrame(JSON.parse(event.data));
+  const close = () => {
+    source.close();
+    if (state.naLiveSource === source) state.naLiveSource = null;
+  };
+  source.addEventListener("end", close);
+  source.onerror = close;
+}
+
 function renderPeaks(peaks = []) {
   elements.peakRows.innerHTML = "";
   if (!peaks.length) {
@@ -922,8 +999,12 @@ function bindEvents() {
   );
   elements.singleBtn.addEventListener("click", () => runAction("单次扫描", () => post("/api/measure/single")));
   elements.clearSaBtn.addEventListener("click", () => runAction("手动清理 SA Trace", () => post("/api/sa/clear")));
-  elements.slowBtn.addEventListener("click", () => runAction("15 秒 EMI 采样", () => post("/api/measure/timed", { duration_seconds: 15 })));
-  elements.fastBtn.addEventListener("click", () => runAction("5 分钟 EMI 采样", () => post("/api/measure/timed", { duration_seconds: 300 })));
+  const timedPayload = (duration) => ({
+    duration_seconds: duration,
+    acquisition_mode: elements.acquisitionModeSelect.value,
+  });
+  elements.slowBtn.addEventListener("click", () => runAction("15 秒 EMI 采样", () => post("/api/measure/timed", timedPayload(15))));
+  elements.fastBtn.addEventListener("click", () => runAction("5 分钟 EMI 采样", () => post("/api/measure/timed", timedPayload(300))));
   elements.stopBtn.addEventListener("click", () => runAction("停止测量", () => post("/api/measure/stop")));
   elements.saveBtn.addEventListener("click", () =>
     runAction("保存数据", async () => {
@@ -969,7 +1050,40 @@ function bindEvents() {
   );
   elements.naCalibrateBtn.addEventListener("click", () => runAction("NA 自动校准", () => post("/api/na/calibrate")));
   elements.naMeasureBtn.addEventListener("click", () => runAction("NA 天线测量", () => post("/api/na/measure")));
+  elements.naSegmentedBtn.addEventListener("click", () =>
+    runAction("NA 分段全扫宽", () => post("/api/na/measure", { segmented: true })),
+  );
+  elements.naAdaptiveBtn.addEventListener("click", () =>
+    runAction("NA 自适应测量", () => post("/api/na/measure", { adaptive: true })),
+  );
+  elements.naLiveBtn.addEventListener("click", () =>
+    runAction("NA 实时调试", async () => {
+      await post("/api/na/live/start");
+      openNaLiveStream();
+    }),
+  );
+  elements.naFreezeBtn.addEventListener("click", () => runAction("冻结并完整分析", () => post("/api/na/live/freeze")));
   elements.naStopBtn.addEventListener("click", () => runAction("停止 NA 流程", () => post("/api/na/stop")));
+  elements.naBatchStartBtn.addEventListener("click", () =>
+    runAction("开始 NA 批量", async () => renderNaBatch(await post("/api/na/batch/start"))),
+  );
+  const measureBatchUnit = () =>
+    runAction("NA 批量测量", async () => {
+      const data = await post("/api/na/batch/measure", { serial: elements.naBatchSerial.value });
+      renderNaBatch(data);
+      elements.naBatchSerial.value = "";
+      elements.naBatchSerial.focus();
+    });
+  elements.naBatchMeasureBtn.addEventListener("click", measureBatchUnit);
+  elements.naBatchSerial.addEventListener("keydown", (event) => {
+    if (event.key === "Enter" && !elements.naBatchMeasureBtn.disabled) measureBatchUnit();
+  });
+  elements.naBatchStopBtn.addEventListener("click", () =>
+    runAction("结束 NA 批量", async () => {
+      const data = await post("/api/na/batch/stop");
+      renderNaBatch({ ...data, last_unit: null });
+    }),
+  );
   elements.naSaveBtn.addEventListener("click", () =>
     runAction("保存 NA 数据", async () => {
       const result = await post("/api/na/data/save");